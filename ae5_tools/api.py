@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 import getpass
+import hashlib
 import io
 import json
 import os
 import re
 import sys
+import threading
 import time
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from http.cookiejar import LWPCookieJar
 from os.path import abspath, basename, isdir, isfile, join
@@ -20,13 +24,17 @@ from requests.adapters import HTTPAdapter
 from requests.packages import urllib3
 from urllib3 import Retry
 
-from .archiver import create_tar_archive
+from .archive_cache import ArchiveCache
+from .archiver import iter_tar_archive
 from .common.config.environment import demand_env_var, get_env_var
 from .config import config
 from .docker import build_image, get_condarc, get_dockerfile
 from .filter import filter_list_of_dicts, filter_vars, split_filter
 from .identifier import Identifier
-from .k8s.client import AE5K8SLocalClient, AE5K8SRemoteClient
+from .k8s.client import AE5K8SConnectionError, AE5K8SLocalClient, AE5K8SRemoteClient
+from .manifest import UploadManifest, diff_files, hash_project, load_backup_manifest, save_backup_manifest, sha256_file
+from .streaming import UPLOAD_CHUNK_SIZE, MultipartEncoder
+from .waiter import WAITER_PAGE_SIZE, ActionWaiter
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -34,6 +42,25 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 KEYCLOAK_PAGE_MAX = int(os.environ.get("KEYCLOAK_PAGE_MAX", "1000"))
 # Maximum number of ids to pass through json body to the k8s endpoint
 K8S_JSON_LIST_MAX = int(os.environ.get("K8S_JSON_LIST_MAX", "100"))
+# Maximum number of concurrent requests to the k8s endpoint
+K8S_JOIN_WORKERS = int(os.environ.get("K8S_JOIN_WORKERS", "4"))
+# Size of the chunks in which downloads are written to disk
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Number of times an interrupted download is resumed before giving up
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", "3"))
+# Default number of concurrent operations for bulk commands such as backups
+BULK_JOBS = int(os.environ.get("BULK_JOBS", "8"))
+# Number of times the project list is retrieved again while waiting for uploaded projects to appear
+UPLOAD_LIST_RETRIES = int(os.environ.get("UPLOAD_LIST_RETRIES", "40"))
+# Seconds that a start waits for pushed pod events before it falls back to polling; 0 always polls
+K8S_WATCH_WAIT = float(os.environ.get("K8S_WATCH_WAIT", "600"))
+# Seconds between checks of the AE5 state while a start waits for pod events, in case it fails without a pod
+K8S_WATCH_CHECK_INTERVAL = float(os.environ.get("K8S_WATCH_CHECK_INTERVAL", "15"))
+# AE5 states in which a record cannot have a live pod, by record type
+K8S_PODLESS_STATES = {
+    "deployment": ("initial", "stopped"),
+    "run": ("completed", "failed", "error"),
+}
 
 # Default subdomain for kubectl service
 DEFAULT_K8S_ENDPOINT = "k8s"
@@ -65,6 +92,11 @@ COLUMNS = {
         "url",
     ],
     "revision": ["name", "latest", "owner", "commands", "created", "updated", "id", "url"],
+    "backup": ["name", "owner", "status", "revisions", "downloaded", "skipped", "size", "id"],
+    "restore": ["name", "owner", "status", "revision", "id", "source_id"],
+    "upload": ["name", "status", "id", "changes", "path"],
+    "session_start": ["name", "owner", "status", "ready", "id", "project_id"],
+    "session_stop": ["name", "owner", "status", "id", "project_id"],
     "command": ["id", "supports_http_options", "unix", "windows", "env_spec"],
     "collaborator": ["id", "permission", "type", "first_name", "last_name", "email"],
     "session": [
@@ -253,6 +285,11 @@ class AESessionBase(object):
         self.persist = persist
         self.prefix = prefix.lstrip("/")
         self.session: Session = AESessionBase._build_requests_session()
+        # Serializes logins when requests are issued from several threads
+        self._auth_lock = threading.RLock()
+        # If set, the ETag, content type and body of GET responses are kept
+        # here, and are reused when a repeated request returns 304 Not Modified
+        self._etag_cache = None
 
         # Cloudflare headers need to be present on all requests (even before auth can be start).
         self._set_cf_headers()
@@ -519,8 +556,20 @@ class AESessionBase(object):
         url = f"https://{subdomain}{self.hostname}/{endpoint}"
         do_save = False
         allow_retry = True
+        # A streamed body is consumed as it is sent, so it cannot be sent again
+        data = kwargs.get("data")
+        streamed = hasattr(data, "read") or hasattr(data, "__next__")
+        cached = cache_key = None
+        # Streamed responses are read by the caller, so their bodies cannot be kept
+        if method == "get" and self._etag_cache is not None and not kwargs.get("stream"):
+            cache_key = (url, json.dumps(kwargs.get("params"), sort_keys=True, default=str))
+            cached = self._etag_cache.get(cache_key)
+            if cached is not None:
+                kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"If-None-Match": cached[0]})
         if not self.connected:
-            self.authorize()
+            with self._auth_lock:
+                if not self.connected:
+                    self.authorize()
             if self.password is not None:
                 allow_retry = False
         retries = redirects = 0
@@ -529,14 +578,20 @@ class AESessionBase(object):
                 response = getattr(self.session, method)(url, allow_redirects=False, **kwargs)
                 retries = 0
             except requests.exceptions.ConnectionError:
-                if retries == 3:
+                if retries == 3 or streamed:
                     raise AEUnexpectedResponseError("Unable to connect", method, url, **kwargs)
                 retries += 1
                 time.sleep(2)
                 continue
             except requests.exceptions.Timeout:
                 raise AEUnexpectedResponseError("Connection timeout", method, url, **kwargs)
-            if 300 <= response.status_code < 400:
+            if response.status_code == 304 and cached is not None:
+                # Complete the unmodified response with the stored body
+                response.status_code = 200
+                response.headers["content-type"] = cached[1]
+                response._content = cached[2]
+                break
+            elif 300 <= response.status_code < 400:
                 # Redirection here happens for two reasons, described below. We
                 # handle them ourselves to provide better behavior than requests.
                 url2 = response.headers["location"].rstrip()
@@ -565,7 +620,12 @@ class AESessionBase(object):
                 url = url2
                 method = "get"
             elif allow_retry and (response.status_code == 401 or self._is_login(response)):
-                self.authorize()
+                if streamed:
+                    # Log in again before the next request, rather than part of the way through it
+                    self.connected = False
+                    raise AEException("The login expired while the request was being sent. The request cannot be repeated; please try again.")
+                with self._auth_lock:
+                    self.authorize()
                 if self.password is not None:
                     allow_retry = False
                 redirects = 0
@@ -574,6 +634,8 @@ class AESessionBase(object):
             else:
                 if do_save and self.persist:
                     self._save()
+                if cache_key is not None and response.headers.get("etag"):
+                    self._etag_cache[cache_key] = (response.headers["etag"], response.headers.get("content-type", ""), response.content)
                 break
         if format == "response":
             return response
@@ -610,6 +672,128 @@ class AESessionBase(object):
     def _patch(self, endpoint, **kwargs):
         return self._api("patch", endpoint, **kwargs)
 
+    def _download(self, endpoint, filename, progress=None, resume=True):
+        """Stream the response to a GET request into a file. The data is
+        written to filename + ".part", which is renamed once it is complete.
+        If that file already exists, and resume is True, only the remaining
+        bytes are requested. Interrupted transfers are resumed up to
+        DOWNLOAD_RETRIES times.
+
+        A partial file is resumed only if it was downloaded from the same
+        endpoint and the server supplied an ETag or Last-Modified validator
+        for it; both are kept in filename + ".part.json". The validator is
+        sent in an If-Range header, so the server sends the whole file again
+        if it has changed since.
+
+        Args:
+            progress: if supplied, called with the number of bytes written
+                so far and the total size, or None if that is unknown.
+        Returns:
+            a dictionary with the filename, size, and SHA-256 digest.
+        """
+        partname = filename + ".part"
+        statename = partname + ".json"
+        validator = None
+        try:
+            with open(statename, "r") as fp:
+                state = json.load(fp)
+            if state.get("endpoint") == endpoint:
+                validator = state.get("validator")
+        except (OSError, ValueError):
+            pass
+        if not (resume and validator):
+            validator = None
+            for fname in (partname, statename):
+                if os.path.exists(fname):
+                    os.unlink(fname)
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            offset = os.path.getsize(partname) if validator and os.path.exists(partname) else 0
+            headers = {}
+            if offset:
+                # The server sends the whole file if it has changed
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+            try:
+                response = self._api("get", endpoint, format="response", stream=True, headers=headers)
+            except AEUnexpectedResponseError:
+                # Most likely 416 Range Not Satisfiable, because the partial
+                # file does not match the current content; start over
+                if not offset:
+                    raise
+                validator = None
+                continue
+            with response:
+                if response.status_code != 206:
+                    offset = 0
+                    validator = response.headers.get("etag") or response.headers.get("last-modified")
+                    if validator:
+                        with open(statename, "w") as fp:
+                            json.dump({"endpoint": endpoint, "validator": validator}, fp)
+                    elif os.path.exists(statename):
+                        os.unlink(statename)
+                total = response.headers.get("content-length")
+                # With a content encoding, the length is that of the encoded data
+                total = offset + int(total) if total and not response.headers.get("content-encoding") else None
+                sha256 = hashlib.sha256()
+                if offset:
+                    with open(partname, "rb") as fp:
+                        for chunk in iter(lambda: fp.read(DOWNLOAD_CHUNK_SIZE), b""):
+                            sha256.update(chunk)
+                nbytes = offset
+                try:
+                    with open(partname, "ab" if offset else "wb") as fp:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            fp.write(chunk)
+                            sha256.update(chunk)
+                            nbytes += len(chunk)
+                            if progress is not None:
+                                progress(nbytes, total)
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise AEException(f"Download interrupted after {nbytes} bytes; run it again to resume")
+                    continue
+            if total is not None and nbytes != total:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise AEException(f"Download incomplete: received {nbytes} of {total} bytes; run it again to resume")
+                continue
+            os.replace(partname, filename)
+            if os.path.exists(statename):
+                os.unlink(statename)
+            return {"filename": filename, "size": nbytes, "sha256": sha256.hexdigest()}
+
+    def _gather(self, *calls):
+        """Run independent API calls concurrently, returning their results
+        in the order given. If any of them fail, the exception raised by
+        the first of those is raised once all of them have finished."""
+        if len(calls) < 2:
+            return [call() for call in calls]
+        self._authorize_first()
+        with ThreadPoolExecutor(len(calls)) as executor:
+            futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    def _authorize_first(self):
+        # Log in before starting threads, so that at most one password prompt is needed
+        if not self.connected:
+            with self._auth_lock:
+                if not self.connected:
+                    self.authorize()
+
+    def _map(self, func, items, jobs=None):
+        """Call func on each of the items, up to jobs (default BULK_JOBS) at
+        a time. Yields (item, result, exception) tuples in the order in which
+        the calls complete; an exception raised by one call does not stop
+        the others."""
+        items = list(items)
+        if not items:
+            return
+        self._authorize_first()
+        with ThreadPoolExecutor(min(jobs or BULK_JOBS, len(items))) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            for future in as_completed(futures):
+                exc = future.exception()
+                yield futures[future], None if exc else future.result(), exc
+
 
 class AEUserSession(AESessionBase):
     def __init__(self, hostname, username, password=None, persist=True, k8s_endpoint=None):
@@ -617,9 +801,27 @@ class AEUserSession(AESessionBase):
         super(AEUserSession, self).__init__(hostname, username, password=password, prefix="api/v2", persist=persist)
         self._k8s_endpoint = k8s_endpoint or os.environ.get("AE5_K8S_ENDPOINT") or "k8s"
         self._k8s_client = None
+        # If set, called with copies of the records as k8s results arrive
+        self._k8s_progress = None
+        self._waiter = ActionWaiter(self)
 
     def _k8s(self, method, *args, **kwargs):
-        quiet = kwargs.pop("quiet", False)
+        kwargs.pop("quiet", False)
+        client = self._k8s_connect()
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except AE5K8SConnectionError as exc:
+            self._k8s_failed(str(exc))
+
+    def _k8s_failed(self, estr):
+        if self._k8s_client is not None:
+            self._k8s_client = None
+            self._k8s_endpoint = None
+        msg = ["Error establishing k8s connection:"]
+        msg.extend("  " + x for x in estr.splitlines())
+        raise AEException("\n".join(msg))
+
+    def _k8s_connect(self):
         if self._k8s_client is None and self._k8s_endpoint is not None:
             if self._k8s_endpoint.startswith("ssh:"):
                 username = self._k8s_endpoint[4:]
@@ -628,14 +830,57 @@ class AEUserSession(AESessionBase):
                 self._k8s_client = AE5K8SRemoteClient(self, self._k8s_endpoint)
             estr = self._k8s_client.error()
             if estr:
-                del self._k8s_client
-                self._k8s_endpoint = self._k8s_client = None
-                msg = ["Error establishing k8s connection:"]
-                msg.extend("  " + x for x in estr.splitlines())
-                raise AEException("\n".join(msg))
+                self._k8s_failed(estr)
         if self._k8s_client is None:
             raise AEException("No k8s connection available")
-        return getattr(self._k8s_client, method)(*args, **kwargs)
+        return self._k8s_client
+
+    def _k8s_daemon_target(self):
+        if not (self._k8s_endpoint or "").startswith("ssh:"):
+            raise AEException('The k8s daemon requires a k8s endpoint of the form "ssh:<username>"')
+        return self.hostname, self._k8s_endpoint[4:]
+
+    def k8s_daemon_start(self, idle_timeout=None, format=None):
+        """Start a background process that keeps the SSH tunnel and k8s
+        server for an ssh:<username> endpoint alive, so that later calls
+        reuse them. Does nothing if one is already running.
+
+        Args:
+            idle_timeout: the number of seconds without a request after
+                which the daemon exits; 0 keeps it running until stopped.
+        """
+        from .k8s.daemon import start_daemon
+
+        hostname, username = self._k8s_daemon_target()
+        try:
+            state = start_daemon(hostname, username, idle_timeout)
+        except RuntimeError as exc:
+            raise AEException(str(exc))
+        # The token that authorizes requests to the daemon is not reported
+        state = {k: v for k, v in state.items() if k != "token"}
+        return self._format_response(dict(state, status="running"), format=format)
+
+    def k8s_daemon_status(self, format=None):
+        from .k8s.daemon import daemon_status
+
+        hostname, username = self._k8s_daemon_target()
+        state = daemon_status(hostname, username)
+        if state is None:
+            state = {"hostname": hostname, "username": username, "status": "stopped"}
+        else:
+            state = {k: v for k, v in state.items() if k != "token"}
+            state["status"] = "running"
+        return self._format_response(state, format=format)
+
+    def k8s_daemon_stop(self, format=None):
+        from .k8s.daemon import stop_daemon
+
+        hostname, username = self._k8s_daemon_target()
+        if self._k8s_client is not None:
+            self._k8s_client.disconnect()
+            self._k8s_client = None
+        stopped = stop_daemon(hostname, username)
+        return self._format_response({"hostname": hostname, "username": username, "status": "stopped" if stopped else "not running"}, format=format)
 
     def _set_header(self):
         s = self.session
@@ -934,7 +1179,8 @@ class AEUserSession(AESessionBase):
         return records
 
     def sample_list(self, filter=None, format=None):
-        records = self._get("template_projects") + self._get("sample_projects")
+        templates, samples = self._gather(lambda: self._get("template_projects"), lambda: self._get("sample_projects"))
+        records = templates + samples
         response = self._fix_records("sample", records, filter)
         return self._format_response(response, format=format)
 
@@ -1053,18 +1299,43 @@ class AEUserSession(AESessionBase):
         rrec = self._revision(ident, quiet=quiet)
         return self._format_response(rrec["_commands"], format=format)
 
-    def project_download(self, ident, filename=None, format=None):
+    def project_download(self, ident, filename=None, progress=None, resume=True, cache=True, details=False, format=None):
+        """Download the archive of a project revision. The archive is
+        streamed to disk, and an interrupted download is resumed. Archives
+        are kept in a local cache, and a revision found there is not
+        downloaded again.
+
+        Args:
+            filename: the file to write. If not supplied, it is constructed
+                from the name of the project and revision.
+            progress: if supplied, called with the number of bytes written
+                so far and the total size, or None if that is unknown.
+            resume: if False, any partial download is discarded.
+            cache: if False, the local archive cache is bypassed.
+            details: if True, return a record with the filename, size, and
+                SHA-256 digest of the archive.
+        Returns:
+            the constructed filename, if one was not supplied.
+        """
         rrec = self._revision(ident, keep_latest=True)
+        # The record for "latest" carries the concrete revision ID, so the
+        # cache never returns the archive of an older revision
         prec, rev = rrec["_project"], rrec["id"]
-        if rrec["name"] == "latest":
-            rev = "latest"
         need_filename = not bool(filename)
         if need_filename:
             revdash = f'-{rrec["name"]}' if rrec["name"] != "latest" else ""
             filename = f'{prec["name"]}{revdash}.tar.gz'
-        response = self._get(f'projects/{prec["id"]}/revisions/{rev}/archive', format="blob")
-        with open(filename, "wb") as fp:
-            fp.write(response)
+        acache = ArchiveCache() if cache else None
+        result = acache and acache.get(self.hostname, prec["id"], rev, filename)
+        if result:
+            if progress is not None:
+                progress(result["size"], result["size"])
+        else:
+            result = self._download(f'projects/{prec["id"]}/revisions/{rev}/archive', filename, progress=progress, resume=resume)
+            if acache:
+                acache.put(self.hostname, prec["id"], rev, filename, result["sha256"])
+        if details:
+            return self._format_response(result, format=format)
         if need_filename:
             return filename
 
@@ -1114,19 +1385,11 @@ class AEUserSession(AESessionBase):
             print("Starting image build. This may take several minutes.")
             build_image(tempdir, tag=tag, debug=debug)
 
-    def _wait(self, response):
-        index = 0
-        id = response.get("project_id", response["id"])
-        status = response["action"]
-        while not status["done"] and not status["error"]:
-            time.sleep(1)
-            params = {"sort": "-updated", "page[size]": index + 1}
-            activity = self._get(f"projects/{id}/activity", params=params)
-            try:
-                status = next(s for s in activity["data"] if s["id"] == status["id"])
-            except StopIteration:
-                index = index + 1
-        response["action"] = status
+    def _wait(self, response, timeout=None):
+        """Wait for the action described by response to finish, updating its
+        "action" field. The session's ActionWaiter polls for all of the
+        actions being waited for, so concurrent waits share requests."""
+        self._waiter.wait(response, timeout)
 
     def project_create(self, url, name=None, tag=None, make_unique=None, wait=True, format=None):
         if not name:
@@ -1147,46 +1410,290 @@ class AEUserSession(AESessionBase):
         if wait:
             return self.project_info(response["id"], format=format, retry=True)
 
-    def project_upload(self, project_archive, name, tag, wait=True, format=None):
+    def project_upload(self, project_archive, name, tag, wait=True, progress=None, force=False, format=None):
+        """Upload a project from an archive file, a project directory, or the
+        bytes of an archive. A directory is archived while it is uploaded,
+        so memory use does not depend on the size of the project.
+
+        The contents of each directory uploaded are recorded in a manifest.
+        If a directory is uploaded again under the same name, and neither
+        its files nor the latest revision of that project have changed, the
+        upload is skipped and the existing project record is returned. The
+        "upload" field of the record is "skipped" or "uploaded", and the
+        "changes" field lists the files changed since the last upload.
+
+        Args:
+            progress: if supplied, called with the number of bytes sent so
+                far and the total, or None if that is unknown.
+            force: if True, upload a directory even if it has not changed.
+        """
+        response, finish = self._send_upload(project_archive, name, tag, progress=progress, force=force)
+        if response is None:
+            return self._format_response(finish(None), format=format)
+        if wait:
+            self._wait(response)
+        if response["action"]["error"]:
+            raise RuntimeError("Error processing upload: {}".format(response["action"]["message"]))
+        if wait:
+            record = finish(self.project_info(response["id"], retry=True))
+            return self._format_response(record, format=format)
+
+    @staticmethod
+    def _upload_name(project_archive):
+        name = basename(abspath(project_archive))
+        for suffix in (".tar.gz", ".tar.bz2", ".tar.gz", ".zip", ".tgz", ".tbz", ".tbz2", ".tz2", ".txz"):
+            if name.endswith(suffix):
+                return name[: -len(suffix)]
+        return name
+
+    def _send_upload(self, project_archive, name, tag, progress=None, force=False, manifest=None):
+        """Send a project upload. Returns the response, which describes the
+        action that processes the upload, and a function to be called with
+        the new project record once that action is complete, which returns
+        the final record. If the upload of a directory is skipped because
+        it has not changed, the response is None, and the function returns
+        the existing project record."""
         if not name:
             if type(project_archive) == bytes:
                 raise RuntimeError("Project name must be supplied for binary input")
-            name = basename(abspath(project_archive))
-            for suffix in (".tar.gz", ".tar.bz2", ".tar.gz", ".zip", ".tgz", ".tbz", ".tbz2", ".tz2", ".txz"):
-                if name.endswith(suffix):
-                    name = name[: -len(suffix)]
-                    break
+            name = self._upload_name(project_archive)
+        f = None
+
+        def finish(record):
+            return record
+
         try:
-            f = None
             if type(project_archive) == bytes:
-                f = io.BytesIO(project_archive)
+                f = source = io.BytesIO(project_archive)
             elif not os.path.exists(project_archive):
                 raise RuntimeError(f"File/directory not found: {project_archive}")
             elif not isdir(project_archive):
-                f = open(project_archive, "rb")
+                f = source = open(project_archive, "rb")
             elif not isfile(join(project_archive, "anaconda-project.yml")):
                 raise RuntimeError(f"Project directory must include anaconda-project.yml")
             else:
-                f = io.BytesIO()
-                create_tar_archive(project_archive, "project", f)
+                directory = project_archive
+                manifest = manifest or UploadManifest(self.hostname, self.username)
+                entry = manifest.get(directory, name)
+                files = hash_project(directory, entry and entry["files"])
+                changes = diff_files(entry["files"], files) if entry else None
+                if entry and not force and not any(changes.values()):
+                    # Nothing to do unless the project was deleted or revised elsewhere
+                    rrec = self._revision(entry["project_id"], quiet=True)
+                    if rrec is not None and rrec["id"] == entry["revision"]:
+                        return None, lambda _: self._upload_result(rrec["_project"], "skipped", changes)
+
+                def finish(record):
+                    manifest.set(directory, name, record["id"], self._revision(record)["id"], files)
+                    return self._upload_result(record, "uploaded", changes)
+
+                source = iter_tar_archive(project_archive, "project", UPLOAD_CHUNK_SIZE)
                 project_archive = project_archive + ".tar.gz"
-            f.seek(0)
             data = {"name": name}
             if tag:
                 data["tag"] = tag
-            f = (project_archive, f)
-            response = self._post_record("projects/upload", record_type="project", api_kwargs={"files": {b"project_file": f}, "data": data})
+            filename = project_archive if isinstance(project_archive, str) else name
+            body = MultipartEncoder(data, {"project_file": (filename, source)}, progress=progress)
+            # A streamed body cannot be sent twice, so make sure that a login
+            # is not needed part of the way through
+            self._authorize_first()
+            api_kwargs = {"data": body, "headers": {"Content-Type": body.content_type}}
+            response = self._post_record("projects/upload", record_type="project", api_kwargs=api_kwargs)
         finally:
             if f is not None:
-                f[1].close()
+                f.close()
         if response.get("error"):
             raise RuntimeError("Error uploading project: {}".format(response["error"]["message"]))
-        if wait:
-            self._wait(response)
-        if response["action"]["error"]:
-            raise RuntimeError("Error processing upload: {}".format(response["action"]["message"]))
-        if wait:
-            return self.project_info(response["id"], format=format, retry=True)
+        return response, finish
+
+    def project_upload_many(self, paths, tag=None, jobs=None, force=False, format=None):
+        """Upload many project archives or directories. Up to jobs uploads
+        (default: BULK_JOBS) are sent at once, each directory archived as it
+        is sent, while the session's ActionWaiter waits for the server to
+        process the uploads already sent. Once all of them are processed, the new
+        project records are retrieved with a single project list.
+
+        Directories that have not changed since they were last uploaded are
+        skipped, unless force is True, as with project_upload.
+
+        Returns:
+            a record for each path, whose status is "uploaded", "skipped",
+            or the error that prevented the upload.
+        """
+        paths = list(dict.fromkeys(paths))
+        manifest = UploadManifest(self.hostname, self.username)
+        records = {}
+        futures = {}
+        finishers = {}
+        for path in paths:
+            records[path] = {"path": path, "name": self._upload_name(path), "status": None, "id": None, "changes": None}
+
+        def _send(path):
+            return self._send_upload(path, records[path]["name"], tag, force=force, manifest=manifest)
+
+        for path, result, exc in self._map(_send, paths, jobs):
+            if exc is not None:
+                records[path]["status"] = f"error: {exc}"
+            elif result[0] is None:
+                finishers[path] = (result[1], None)
+            else:
+                futures[path] = self._waiter.add(result[0])
+                finishers[path] = (result[1], result[0]["id"])
+        for path, future in futures.items():
+            try:
+                action = future.result()["action"]
+            except Exception as exc:
+                action = {"error": True, "message": str(exc)}
+            if action["error"]:
+                records[path]["status"] = "error: {}".format(action["message"])
+                del finishers[path]
+        # As in project_info, the new projects may take a moment to appear
+        project_ids = set(id for _, id in finishers.values() if id is not None)
+        precs = {}
+        for attempt in range(UPLOAD_LIST_RETRIES + 1):
+            if project_ids <= set(precs):
+                break
+            if attempt:
+                time.sleep(0.25)
+            precs = {prec["id"]: prec for prec in self._get_records("projects")}
+
+        def _finish(path):
+            finish, id = finishers[path]
+            if id is not None and id not in precs:
+                raise AEException(f"Uploaded project {id} not found")
+            return finish(precs.get(id))
+
+        for path, record, exc in self._map(_finish, finishers, jobs):
+            if exc is not None:
+                records[path]["status"] = f"error: {exc}"
+            else:
+                records[path].update(status=record.get("upload", "uploaded"), id=record["id"], changes=record.get("changes"))
+        return self._format_response(list(records.values()) or EmptyRecordList("upload"), format=format, record_type="upload")
+
+    @staticmethod
+    def _upload_result(record, status, changes):
+        record["upload"] = status
+        if changes is not None:
+            record["changes"] = ",".join(changes["modified"] + changes["removed"] + changes["added"])
+            record["_changes"] = changes
+        return record
+
+    def project_backup(self, dest, filter=None, all_revisions=False, jobs=None, format=None):
+        """Back up the projects matching filter into the directory dest. The
+        archives of their latest revisions, or of all of them, are downloaded
+        concurrently, and the metadata, collaborators, revisions and archive
+        checksums of each project are recorded in the backup manifest. An
+        archive already present in dest with the checksum recorded by an
+        earlier backup is not downloaded again.
+
+        Args:
+            all_revisions: if True, back up every revision of each project.
+            jobs: the number of concurrent requests (default: BULK_JOBS).
+        Returns:
+            a record for each project, with the number of revisions
+            downloaded and skipped, or the error that prevented its backup.
+        """
+        os.makedirs(dest, exist_ok=True)
+        manifest = load_backup_manifest(dest)
+        manifest["hostname"] = self.hostname
+        projects = manifest.setdefault("projects", {})
+        records = {}
+
+        def _metadata(prec):
+            collabs = self._get_records(f'projects/{prec["id"]}/collaborators')
+            revisions = self._get_records(f'projects/{prec["id"]}/revisions', project=prec)
+            return collabs, revisions if all_revisions else revisions[:1]
+
+        def _fetch(task):
+            entry, rev, previous = task
+            filename = join(dest, rev["filename"])
+            if previous.get("sha256") and isfile(filename) and sha256_file(filename) == previous["sha256"]:
+                rev.update(size=previous["size"], sha256=previous["sha256"])
+                return "skipped"
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            result = self._download(f'projects/{entry["id"]}/revisions/{rev["id"]}/archive', filename)
+            rev.update(size=result["size"], sha256=result["sha256"])
+            return "downloaded"
+
+        tasks = []
+        for prec, result, exc in self._map(_metadata, self._get_records("projects", filter), jobs):
+            record = records[prec["id"]] = {"name": prec["name"], "owner": prec["owner"], "status": "ok", "id": prec["id"]}
+            record.update(revisions=0, downloaded=0, skipped=0, size=0)
+            if exc is not None:
+                record["status"] = f"error: {exc}"
+                continue
+            collabs, revisions = result
+            old = {r["id"]: r for r in projects.get(prec["id"], {}).get("revisions", ())}
+            entry = {k: v for k, v in prec.items() if not k.startswith("_")}
+            entry["collaborators"] = [{k: c[k] for k in ("id", "type", "permission")} for c in collabs]
+            entry["revisions"] = []
+            for rrec in revisions:
+                rev = {"id": rrec["id"], "name": rrec["name"], "created": rrec.get("created")}
+                rev["filename"] = join(prec["id"], f'{rrec["id"]}.tar.gz')
+                entry["revisions"].append(rev)
+                tasks.append((entry, rev, old.get(rrec["id"], {})))
+            record["revisions"] = len(revisions)
+            projects[prec["id"]] = entry
+        try:
+            for (entry, rev, _), result, exc in self._map(_fetch, tasks, jobs):
+                record = records[entry["id"]]
+                if exc is not None:
+                    record["status"] = f"error: {exc}"
+                else:
+                    record[result] += 1
+                    record["size"] += rev["size"]
+        finally:
+            # Archives that are incomplete have no checksum, so a later backup fetches them again
+            save_backup_manifest(dest, manifest)
+        return self._format_response(list(records.values()) or EmptyRecordList("backup"), format=format, record_type="backup")
+
+    def project_restore(self, source, filter=None, jobs=None, format=None):
+        """Recreate projects from a backup made by project_backup, uploading
+        the most recent archive of each project concurrently, then restoring
+        its editor, resource profile and collaborators. The projects are
+        owned by the current user. A project whose name is already in use by
+        one of that user's projects is not restored.
+
+        Args:
+            filter: limits the restore to the matching projects, as they are
+                recorded in the backup manifest.
+            jobs: the number of concurrent uploads (default: BULK_JOBS).
+        Returns:
+            a record for each project, with the ID of the new project, or
+            the error that prevented it from being restored.
+        """
+        entries = list(load_backup_manifest(source)["projects"].values())
+        entries = filter_list_of_dicts(entries, filter)
+        existing = set(p["name"] for p in self._get_records("projects") if p["owner"] == self.username)
+
+        def _restore(entry):
+            if entry["name"] in existing:
+                return "exists", None, None
+            rev = next((r for r in entry["revisions"] if r.get("sha256")), None)
+            if rev is None:
+                raise AEException("No archive in the backup")
+            filename = join(source, rev["filename"])
+            if not isfile(filename) or sha256_file(filename) != rev["sha256"]:
+                raise AEException(f"Archive missing or corrupt: {filename}")
+            record = self.project_upload(filename, entry["name"], rev["name"], wait=True)
+            patch = {k: entry[k] for k in ("editor", "resource_profile") if entry.get(k) and entry[k] != record.get(k)}
+            if patch:
+                self._patch(f'projects/{record["id"]}', json=patch)
+            if entry["collaborators"]:
+                self.project_collaborator_list_set(record, entry["collaborators"])
+            return "restored", record, rev["name"]
+
+        records = []
+        for entry, result, exc in self._map(_restore, entries, jobs):
+            record = {"name": entry["name"], "owner": entry["owner"], "status": None, "revision": None, "id": None, "source_id": entry["id"]}
+            if exc is not None:
+                record["status"] = f"error: {exc}"
+            else:
+                record["status"], prec, record["revision"] = result
+                if prec is not None:
+                    record["id"] = prec["id"]
+            records.append(record)
+        return self._format_response(records or EmptyRecordList("restore"), format=format, record_type="restore")
 
     def _join_collaborators(self, what, response):
         if isinstance(response, dict):
@@ -1200,43 +1707,76 @@ class AEUserSession(AESessionBase):
         elif hasattr(response, "_columns"):
             response._columns.extend(("collaborators", "_collaborators"))
 
+    def _has_pod(self, record):
+        rtype = record["type"] if record.get("_record_type") == "pod" else record.get("_record_type")
+        return record.get("state") not in K8S_PODLESS_STATES.get(rtype, ())
+
+    def _k8s_pod_chunks(self, chunks):
+        # Yields each chunk of records with its pod_info results, in the
+        # order in which they complete
+        if len(chunks) == 1:
+            yield chunks[0], self._k8s("pod_info", [r["id"] for r in chunks[0]])
+            return
+        # Connect before starting any threads
+        self._k8s_connect()
+        with ThreadPoolExecutor(min(K8S_JOIN_WORKERS, len(chunks))) as executor:
+            futures = {executor.submit(self._k8s, "pod_info", [r["id"] for r in chunk]): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _merge_k8s(self, rec, rec2, changes):
+        rec2 = rec2 or {}
+        usage = rec2.get("usage", {})
+        rec["phase"] = rec2.get("phase")
+        rec["since"] = rec2.get("since")
+        rec["rst"] = rec2.get("restarts")
+        rec["usage/mem"] = usage.get("mem")
+        rec["usage/cpu"] = usage.get("cpu")
+        rec["usage/gpu"] = usage.get("gpu")
+        if changes:
+            if "changes" in rec2:
+                chg = rec2["changes"]
+                chg = ",".join(chg["modified"] + chg["deleted"] + chg["added"])
+                rec["changes"] = chg
+                rec["modified"] = bool(chg)
+            else:
+                rec["modified"] = "n/a"
+                rec["changes"] = ""
+        rec["node"] = rec2.get("node")
+        rec["_k8s"] = rec2 or None
+
     def _join_k8s(self, record, changes=False):
         is_single = isinstance(record, dict)
         rlist = [record] if is_single else record
         if rlist:
-            rlist2 = []
+            for rec in rlist:
+                self._merge_k8s(rec, None, changes)
+            # Records that cannot have a pod are not sent to the k8s endpoint
+            live = [rec for rec in rlist if self._has_pod(rec)]
             # Limit the size of the input to pod_info to avoid 413 errors
-            idchunks = [[r["id"] for r in rlist[k : k + K8S_JSON_LIST_MAX]] for k in range(0, len(rlist), K8S_JSON_LIST_MAX)]
-            record2 = sum((self._k8s("pod_info", ch) for ch in idchunks), [])
-            for rec, rec2 in zip(rlist, record2):
-                if not rec2:
-                    continue
-                rlist2.append(rec)
-                rec["phase"] = rec2["phase"]
-                rec["since"] = rec2["since"]
-                rec["rst"] = rec2["restarts"]
-                rec["usage/mem"] = rec2["usage"]["mem"]
-                rec["usage/cpu"] = rec2["usage"]["cpu"]
-                rec["usage/gpu"] = rec2["usage"]["gpu"]
-                if changes:
-                    if "changes" in rec2:
-                        chg = rec2["changes"]
-                        chg = ",".join(chg["modified"] + chg["deleted"] + chg["added"])
-                        rec["changes"] = chg
-                        rec["modified"] = bool(chg)
+            chunks = [live[k : k + K8S_JSON_LIST_MAX] for k in range(0, len(live), K8S_JSON_LIST_MAX)]
+            progress = self._k8s_progress if chunks and not is_single else None
+            if progress:
+                progress([dict(rec) for rec in rlist])
+            missing = set()
+            for chunk, result in self._k8s_pod_chunks(chunks) if chunks else ():
+                for rec, rec2 in zip(chunk, result):
+                    if rec2:
+                        self._merge_k8s(rec, rec2, changes)
                     else:
-                        rec["modified"] = "n/a"
-                        rec["changes"] = ""
-                rec["node"] = rec2["node"]
-                rec["_k8s"] = rec2
+                        missing.add(id(rec))
+                if progress:
+                    progress([dict(rec) for rec in rlist if id(rec) not in missing])
+            rlist2 = [rec for rec in rlist if id(rec) not in missing]
             if not rlist2:
                 rlist2 = EmptyRecordList(rlist[0]["_record_type"], rlist[0])
             rlist = rlist2
         if not rlist and hasattr(rlist, "_columns"):
-            rlist._columns.extend(("phase", "since", "rst", "usage/mem", "usage/cpu", "usage/gpu"))
+            k8s_columns = ["phase", "since", "rst", "usage/mem", "usage/cpu", "usage/gpu"]
             if changes:
-                rlist._columns.extend(("changes", "modified"))
-            rlist._columns.extend(("node", "_k8s"))
+                k8s_columns.extend(("changes", "modified"))
+            k8s_columns.extend(("node", "_k8s"))
+            rlist._columns.extend(c for c in k8s_columns if c not in rlist._columns)
         return record if is_single else rlist
 
     def _pre_session(self, records):
@@ -1268,6 +1808,21 @@ class AEUserSession(AESessionBase):
 
     def session_start(self, ident, editor=None, resource_profile=None, wait=True, open=False, frame=True, format=None):
         prec = self._ident_record("project", ident)
+        response = self._request_session(prec, editor, resource_profile)
+        if wait or open:
+            # The action is checked once the pod is ready, rather than polled throughout
+            action_id, project_id = response["action"]["id"], response.get("project_id", response["id"])
+            self._watch_until_ready(
+                response["id"], lambda: any(a["done"] or a["error"] for a in self._waiter._poll((project_id, [action_id], WAITER_PAGE_SIZE)).values())
+            )
+            self._wait(response)
+        if response["action"].get("error"):
+            raise RuntimeError("Error completing session start: {}".format(response["action"]["message"]))
+        if open:
+            self.session_open(response, frame)
+        return self._format_response(response, format=format)
+
+    def _request_session(self, prec, editor=None, resource_profile=None):
         id = prec["id"]
         patches = {}
         if editor and prec["editor"] != editor:
@@ -1279,13 +1834,108 @@ class AEUserSession(AESessionBase):
         response = self._post_record(f"projects/{id}/sessions")
         if response.get("error"):
             raise RuntimeError("Error starting project: {}".format(response["error"]["message"]))
-        if wait or open:
-            self._wait(response)
-        if response["action"].get("error"):
-            raise RuntimeError("Error completing session start: {}".format(response["action"]["message"]))
-        if open:
-            self.session_open(response, frame)
-        return self._format_response(response, format=format)
+        return response
+
+    def _select_records(self, record_type, records, idents):
+        """Resolve each identifier against a list of records that has already
+        been retrieved, as _ident_record would. Yields each identifier with
+        the unique matching record, or the AEException explaining why there
+        is none. Without identifiers, yields every record."""
+        if not idents:
+            for rec in records:
+                yield rec["id"], rec, None
+            return
+        itype = record_type + "s"
+        for ident in idents:
+            filter = Identifier.from_string(ident, itype).project_filter(itype=itype, ignore_revision=True)
+            try:
+                yield ident, self._should_be_one(self._filter_records(filter, records), filter, False), None
+            except (AEException, ValueError) as exc:
+                yield ident, None, exc
+
+    def session_start_many(self, idents=None, filter=None, editor=None, resource_profile=None, jobs=None, wait=True, format=None):
+        """Start a session for each of many projects. The projects are
+        selected by a list of identifiers, a filter, or both, and are
+        resolved against a single project list. Up to jobs sessions (default:
+        BULK_JOBS) are requested at once, and the session's ActionWaiter
+        waits for all of them together.
+
+        Returns:
+            a record for each project, with the session ID, its status, and
+            the number of seconds it took to become ready.
+        """
+        if not idents and not filter:
+            raise AEException("Projects must be selected with identifiers or a filter")
+        records, todo = [], {}
+        for ident, prec, exc in self._select_records("project", self._get_records("projects", filter), idents):
+            if prec is not None and prec["id"] in todo:
+                continue
+            record = {"name": prec["name"] if prec else ident, "owner": prec and prec["owner"], "status": None, "ready": None, "id": None}
+            record["project_id"] = prec and prec["id"]
+            records.append(record)
+            if exc is not None:
+                record["status"] = f"error: {exc}"
+            else:
+                todo[prec["id"]] = (record, prec)
+        ready = {}
+
+        def _start(item):
+            record, prec = item
+            started = time.monotonic()
+            return self._request_session(prec, editor, resource_profile), started
+
+        def _ready(future, id, started):
+            ready[id] = round(time.monotonic() - started, 1)
+
+        futures = []
+        for (record, prec), result, exc in self._map(_start, todo.values(), jobs):
+            if exc is not None:
+                record["status"] = f"error: {exc}"
+                continue
+            response, started = result
+            record["id"] = response["id"]
+            if wait:
+                future = self._waiter.add(response)
+                future.add_done_callback(lambda f, id=response["id"], started=started: _ready(f, id, started))
+                futures.append((record, future))
+            else:
+                record["status"] = "starting"
+        for record, future in futures:
+            try:
+                action = future.result()["action"]
+            except Exception as exc:
+                action = {"error": True, "message": str(exc)}
+            if action.get("error"):
+                record["status"] = "error: {}".format(action["message"])
+            else:
+                record["status"], record["ready"] = "started", ready.get(record["id"])
+        return self._format_response(records or EmptyRecordList("session_start"), format=format, record_type="session_start")
+
+    def session_stop_many(self, idents=None, filter=None, jobs=None, format=None):
+        """Stop many sessions, selected by a list of identifiers, a filter,
+        or both, and resolved against a single session list. Up to jobs
+        sessions (default: BULK_JOBS) are stopped at once.
+
+        Returns:
+            a record for each session, with its status.
+        """
+        if not idents and not filter:
+            raise AEException("Sessions must be selected with identifiers or a filter")
+        records, todo = [], {}
+        for ident, srec, exc in self._select_records("session", self._get_records("sessions", filter), idents):
+            if srec is not None and srec["id"] in todo:
+                continue
+            record = {"name": srec["name"] if srec else ident, "owner": srec and srec["owner"], "status": "stopped"}
+            record.update(id=srec and srec["id"], project_id=srec and srec["project_id"])
+            records.append(record)
+            if exc is not None:
+                record["status"] = f"error: {exc}"
+            else:
+                todo[srec["id"]] = record
+        for id, _, exc in self._map(lambda id: self._delete(f"sessions/{id}"), todo, jobs):
+            if exc is not None:
+                todo[id]["status"] = f"error: {exc}"
+        return self._format_response(records or EmptyRecordList("session_stop"), format=format, record_type="session_stop")
 
     def session_stop(self, ident, format=format):
         id = self._ident_record("session", ident)["id"]
@@ -1349,9 +1999,7 @@ class AEUserSession(AESessionBase):
         record = self._ident_record("deployment", ident, collaborators=collaborators, k8s=k8s, quiet=quiet)
         return self._format_response(record, format=format)
 
-    def _pre_endpoint(self, records):
-        dlist = self.deployment_list()
-        plist = self.project_list()
+    def _join_endpoints(self, records, dlist, plist):
         dmap = {drec["endpoint"]: drec for drec in dlist if drec["endpoint"]}
         pmap = {prec["id"]: prec for prec in plist}
         newrecs = []
@@ -1375,7 +2023,10 @@ class AEUserSession(AESessionBase):
         return newrecs
 
     def endpoint_list(self, filter=None, format=None):
-        response = self._get("/platform/deploy/api/v1/apps/static-endpoints")["data"]
+        response, dlist, plist = self._gather(
+            lambda: self._get("/platform/deploy/api/v1/apps/static-endpoints")["data"], self.deployment_list, self.project_list
+        )
+        response = self._join_endpoints(response, dlist, plist)
         response = self._fix_records("endpoint", response, filter=filter)
         return self._format_response(response, format=format)
 
@@ -1476,8 +2127,14 @@ class AEUserSession(AESessionBase):
             self.deployment_collaborator_list_set(id, collaborators)
         # The _wait method doesn't work here. The action isn't even updated, it seems
         if wait or stop_on_error:
+            # Once the pod is ready, the state is checked straight away
+            watched = response["state"] in ("initial", "starting") and self._watch_until_ready(
+                id, lambda: self._get_records(f"deployments/{id}", record_type="deployment")["state"] not in ("initial", "starting")
+            )
             while response["state"] in ("initial", "starting"):
-                time.sleep(2)
+                if not watched:
+                    time.sleep(2)
+                watched = False
                 response = self._get_records(f"deployments/{id}", record_type="deployment")
             if response["state"] != "started":
                 if stop_on_error:
@@ -1752,24 +2409,149 @@ class AEUserSession(AESessionBase):
         result = []
         for rec in records:
             if "project_id" in rec:
-                type = rec["_record_type"]
-                value = {k: rec[k] for k in ("name", "owner", "resource_profile", "id", "project_id")}
-                value["type"] = type
+                rec["type"] = rec["_record_type"]
                 result.append(rec)
         return result
 
     def _post_pod(self, records):
-        return self._join_k8s(records, changes=True)
+        # Only records that may have a pod belong in the pod list
+        live = [rec for rec in records if self._has_pod(rec)]
+        if not live and records:
+            live = EmptyRecordList("pod", records[0])
+        return self._join_k8s(live, changes=True)
 
     def pod_list(self, filter=None, format=None):
-        records = self.session_list(filter=filter) + self.deployment_list(filter=filter) + self.run_list(filter=filter)
-        records = self._fix_records("pod", records)
+        # The filter is applied to the combined list so that it can refer to
+        # the k8s columns; any AE5 columns are still filtered before the join
+        sessions, deployments, runs = self._gather(self.session_list, self.deployment_list, self.run_list)
+        records = sessions + deployments + runs
+        records = self._fix_records("pod", records, filter)
         return self._format_response(records, format=format)
 
     def pod_info(self, pod, format=None, quiet=False):
         record = self._ident_record("pod", pod, quiet=quiet)
         return self._format_response(record, format=format)
 
+    def pod_logs(
+        self,
+        filter=None,
+        container=None,
+        follow=False,
+        since=None,
+        tail=None,
+        grep=None,
+        until=None,
+        context=None,
+        stream=None,
+        format=None,
+    ):
+        """Write the logs of every pod matching the filter to stream.
+
+        Args:
+            filter: a pod identifier or filter; may match more than one pod.
+            container: the container name; the default is the editor for
+                sessions, and the app for deployments and runs.
+            follow: if True, continue streaming new lines until interrupted.
+            since: only return lines newer than this many seconds, a
+                duration such as "10m" or "1h30m", or an ISO 8601 time.
+            tail: only return this many of the most recent lines of each log.
+            grep: only return the lines matching this regular expression.
+                The search is performed on the server, so only the matching
+                lines are transferred.
+            until: with grep, only return lines older than this; the same
+                formats as since are accepted.
+            context: with grep, the number of lines of context to include
+                before and after each match.
+            stream: a text file-like object; defaults to sys.stdout.
+        """
+        records = self.session_list(filter=filter) + self.deployment_list(filter=filter) + self.run_list(filter=filter)
+        # Stopped deployments and finished runs have no log to read
+        ids = [rec["id"] for rec in self._pre_pod(records) if self._has_pod(rec)]
+        if not ids:
+            raise AEException("No pods match the given filter")
+        if grep is None:
+            if until is not None or context is not None:
+                raise AEException("The until and context options require a search pattern")
+            self._k8s("pod_logs", ids, container=container, follow=follow, since=since, tail=tail, stream=stream)
+            return
+        if tail is not None:
+            raise AEException("The tail option cannot be combined with a search pattern")
+        if follow and len(ids) > 1:
+            raise AEException("Only a single log may be followed with a search pattern")
+        stream = sys.stdout if stream is None else stream
+        for id in ids:
+            if len(ids) > 1:
+                stream.write(f"==> {id} <==\n")
+            self._k8s("pod_log_search", id, grep, container=container, follow=follow, since=since, until=until, context=context, stream=stream)
+
+    async def watch_pods(self, ids):
+        """Asynchronously yield the status changes of the pods for the
+        given sessions, deployments or runs, as they are pushed by the k8s
+        server, without polling. Each event is a dictionary with the type
+        (ADDED, MODIFIED or DELETED), the AE5 id, and the pod record.
+
+        Args:
+            ids: a list of session, deployment or run IDs.
+        """
+        loop = asyncio.get_running_loop()
+        events = await loop.run_in_executor(None, self._k8s, "watch_pods", list(ids))
+        done = object()
+        try:
+            while True:
+                event = await loop.run_in_executor(None, next, events, done)
+                if event is done:
+                    break
+                yield event
+        finally:
+            # Closing the response also ends a read still waiting in the executor
+            events.close()
+
+    def _watch_until_ready(self, id, finished):
+        """Block until the pod of a session or deployment is ready, has
+        stopped, or is deleted, using the events pushed by the k8s server.
+        A start can also fail before there is any pod, so the finished
+        callable is checked every K8S_WATCH_CHECK_INTERVAL seconds, and
+        the wait ends once it returns True. Returns False, so that the
+        caller polls instead, if no k8s server is available, the watch
+        fails, or K8S_WATCH_WAIT seconds pass, and True otherwise."""
+        if not K8S_WATCH_WAIT:
+            return False
+        try:
+            events = self._k8s("watch_pods", [id])
+        except Exception:
+            return False
+        stop = threading.Event()
+        deadline = time.monotonic() + K8S_WATCH_WAIT
+        result = []
+
+        def _check():
+            while not stop.wait(K8S_WATCH_CHECK_INTERVAL):
+                try:
+                    done = finished()
+                except Exception:
+                    done = False
+                if done or time.monotonic() >= deadline:
+                    result.append(done)
+                    # Closing the watch ends the iteration below
+                    events.close()
+                    return
+
+        checker = threading.Thread(target=_check, daemon=True)
+        checker.start()
+        try:
+            with events:
+                for event in events:
+                    pod = event["pod"]
+                    if pod is None or pod["phase"] in ("Succeeded", "Failed"):
+                        return True
+                    if pod["phase"] == "Running" and pod["containers"] and all(c["ready"] for c in pod["containers"].values()):
+                        return True
+        except Exception:
+            pass
+        finally:
+            stop.set()
+        return bool(result and result[0])
+
     def node_list(self, filter=None, format=None):
         result = []
         for rec in self._k8s("node_info"):
@@ -0,0 +1,139 @@
+"""A local cache of project revision archives. The archive of a given
+revision never changes, so once downloaded it can be reused. Archives are
+stored once per SHA-256 digest, and an index maps each host, project ID
+and revision ID to a digest. When the total size of the archives exceeds
+ARCHIVE_CACHE_SIZE, the least recently used ones are removed.
+
+Archives are copied into and out of the cache, so neither the cache nor
+the caller's files are affected when the other is modified. The index is
+updated under a lock that is shared by every thread and, where fcntl is
+available, by every process using the same cache. The archives themselves
+are copied outside of that lock, since they may be large; a blob is only
+ever added or removed whole, so a copy is checked against the index
+afterwards rather than protected while it is made."""
+
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .config import config
+
+# Maximum total size of the cached archives, in bytes; 0 disables the cache
+ARCHIVE_CACHE_SIZE = int(os.environ.get("ARCHIVE_CACHE_SIZE", str(2 * 1024**3)))
+
+
+# Guards the index against other threads; the file lock guards it against other processes
+_LOCK = threading.Lock()
+
+
+class ArchiveCache(object):
+    def __init__(self, path=None, max_size=None):
+        self.path = path or os.path.join(config._path, "archives")
+        self.max_size = ARCHIVE_CACHE_SIZE if max_size is None else max_size
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def _key(hostname, project_id, revision):
+        return f"{hostname}/{project_id}/{revision}"
+
+    def _blob(self, sha256):
+        return os.path.join(self.path, "blobs", sha256)
+
+    @contextmanager
+    def _locked(self):
+        with _LOCK:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            with open(os.path.join(self.path, "index.lock"), "a") as fp:
+                if fcntl is not None:
+                    # Released when the file is closed
+                    fcntl.flock(fp, fcntl.LOCK_EX)
+                yield
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, "index.json"), "r") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, index):
+        fname = os.path.join(self.path, "index.json")
+        with open(fname + ".tmp", "w") as fp:
+            json.dump(index, fp)
+        os.replace(fname + ".tmp", fname)
+
+    def get(self, hostname, project_id, revision, filename):
+        """If the archive of this revision is cached, copy it to filename,
+        and return a dictionary with the filename, size, and SHA-256 digest.
+        Otherwise return None."""
+        if not self.enabled:
+            return None
+        key = self._key(hostname, project_id, revision)
+        with self._locked():
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        try:
+            # A blob that is evicted once opened can still be read to the end
+            shutil.copyfile(self._blob(entry["sha256"]), filename)
+        except FileNotFoundError:
+            return None
+        if os.path.getsize(filename) != entry["size"]:
+            return None
+        with self._locked():
+            index = self._load()
+            if index.get(key, {}).get("sha256") == entry["sha256"]:
+                index[key]["used"] = time.time()
+                self._save(index)
+        return {"filename": filename, "size": entry["size"], "sha256": entry["sha256"]}
+
+    def put(self, hostname, project_id, revision, filename, sha256):
+        """Add a downloaded archive to the cache, then remove the least
+        recently used archives until the cache is within its size limit."""
+        if not self.enabled:
+            return
+        size = os.path.getsize(filename)
+        if size > self.max_size:
+            return
+        os.makedirs(os.path.join(self.path, "blobs"), mode=0o700, exist_ok=True)
+        blob = self._blob(sha256)
+        # Copied to a name private to this thread, then moved into place under the lock
+        tmp = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(filename, tmp)
+        with self._locked():
+            if os.path.exists(blob):
+                os.unlink(tmp)
+            else:
+                os.replace(tmp, blob)
+            index = self._load()
+            index[self._key(hostname, project_id, revision)] = {"sha256": sha256, "size": size, "used": time.time()}
+            self._evict(index)
+            self._save(index)
+
+    def _evict(self, index):
+        sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+        total = sum(sizes.values())
+        last_used = {}
+        for entry in index.values():
+            last_used[entry["sha256"]] = max(last_used.get(entry["sha256"], 0), entry["used"])
+        for sha256 in sorted(last_used, key=last_used.get):
+            if total <= self.max_size:
+                break
+            for key in [k for k, e in index.items() if e["sha256"] == sha256]:
+                del index[key]
+            try:
+                os.unlink(self._blob(sha256))
+            except OSError:
+                pass
+            total -= sizes[sha256]
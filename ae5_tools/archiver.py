@@ -1,63 +1,318 @@
+import collections
 import fnmatch
+import gzip
 import os
+import queue
 import re
+import struct
 import subprocess
 import tarfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
+# Number of compressed chunks buffered between the archiving thread and the reader
+ARCHIVE_QUEUE_SIZE = 8
+# How project archives are compressed: "gzip" (single-threaded, by tarfile),
+# "parallel" (multi-threaded gzip), or "fast" (multi-threaded gzip at level 1)
+ARCHIVE_COMPRESSION = os.environ.get("ARCHIVE_COMPRESSION", "parallel")
+# The gzip compression level, from 1 (fastest) to 9 (smallest)
+ARCHIVE_LEVEL = int(os.environ.get("ARCHIVE_LEVEL", "6"))
+# The number of threads used by parallel compression
+ARCHIVE_WORKERS = int(os.environ.get("ARCHIVE_WORKERS", "0")) or os.cpu_count() or 1
+# The size of the blocks that are compressed independently
+ARCHIVE_BLOCK_SIZE = 1024 * 1024
+# Files with these extensions are already compressed, so parallel
+# compression stores them rather than trying to compress them again
+STORED_EXTENSIONS = tuple(".gz .tgz .bz2 .xz .zst .zip .7z .rar .whl .conda .parquet .png .jpg .jpeg .gif .webp .mp3 .mp4 .mov .avi".split())
 
-def _list_project(project_directory):
-    anchors, nonanchors = [".git/"], []
 
-    gitdir = os.path.join(project_directory, ".git")
-    if os.path.exists(gitdir):
-        output = subprocess.check_output(["git", "ls-files", "--others", "--ignored", "--exclude-standard", "--directory"], cwd=project_directory)
-        anchors.extend(output.decode("utf-8").splitlines())
+ProjectFile = collections.namedtuple("ProjectFile", ("relpath", "abspath", "size", "mtime"))
+ProjectFile.__doc__ = """A file selected for a project archive. The relative path uses
+forward slashes; size and mtime are those reported by lstat."""
+
+
+class _IgnoreMatcher(object):
+    # Decides whether a path is excluded from a project archive. Paths are
+    # relative to the project directory, and end in a slash for directories.
+    # Since ignored directories are never entered, only the last component
+    # of each path needs to be examined. Literal patterns, including every
+    # path listed by git, are looked up in sets; only glob patterns from
+    # .projectignore are compiled into a regular expression.
+
+    def __init__(self, project_directory):
+        self.paths = {".git/"}
+        self.names = set()
+        self.dir_names = set()
+        anchors, nonanchors = [], []
+
+        gitdir = os.path.join(project_directory, ".git")
+        if os.path.exists(gitdir):
+            cmd = ["git", "ls-files", "-z", "--others", "--ignored", "--exclude-standard", "--directory"]
+            output = subprocess.check_output(cmd, cwd=project_directory)
+            self.paths.update(p for p in output.decode("utf-8", "surrogateescape").split("\0") if p)
+
+        igfile = os.path.join(project_directory, ".projectignore")
+        if os.path.exists(igfile):
+            with open(igfile, "r") as fp:
+                for line in fp:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    if line.startswith(r"\#"):
+                        line = line[1:]
+                    body = line.strip("/")
+                    if not any(c in body for c in "*?[\\"):
+                        if line.startswith("/"):
+                            self.paths.add(body + "/")
+                            if not line.endswith("/"):
+                                self.paths.add(body)
+                            continue
+                        if "/" not in body:
+                            (self.dir_names if line.endswith("/") else self.names).add(body)
+                            continue
+                    pattern = fnmatch.translate(line.lstrip("/"))[4:-3]
+                    pattern = re.sub(r"(?<!\\)[.]", "[^/]", pattern)
+                    if line.endswith("/"):
+                        pattern = pattern + r".*"
+                    if line.startswith("/"):
+                        anchors.append(pattern)
+                    else:
+                        nonanchors.append(pattern)
 
-    igfile = os.path.join(project_directory, ".projectignore")
-    if os.path.exists(igfile):
-        with open(igfile, "r") as fp:
-            for line in fp:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if line.startswith(r"\#"):
-                    line = line[1:]
-                pattern = fnmatch.translate(line.lstrip("/"))[4:-3]
-                pattern = re.sub(r"(?<!\\)[.]", "[^/]", pattern)
-                if line.endswith("/"):
-                    pattern = pattern + r".*"
-                if line.startswith("/"):
-                    anchors.append(pattern)
-                else:
-                    nonanchors.append(pattern)
-
-    if anchors or nonanchors:
         if nonanchors:
             nonanchors = nonanchors[0] if len(nonanchors) == 1 else "(?:" + "|".join(nonanchors) + ")"
             anchors.append(r"(?:.*/)?" + nonanchors)
-        anchors = anchors[0] if len(anchors) == 1 else "(?:" + "|".join(anchors) + ")"
-        pattern = r"\A" + anchors + r"(?:/.*)?\Z"
-    else:
-        pattern = "^$"
-    regex = re.compile(pattern)
-
-    for root, dirs, files in os.walk(project_directory):
-        filtered_dirs = []
-        filtered = False
-        for d in dirs:
-            abspath = os.path.join(root, d)
-            relpath = os.path.relpath(abspath, project_directory)
-            if not regex.match(relpath + "/"):
-                filtered_dirs.append(d)
-        dirs[:] = filtered_dirs
-        for f in files:
-            abspath = os.path.join(root, f)
-            relpath = os.path.relpath(abspath, project_directory)
-            if not regex.match(relpath):
-                yield (abspath, relpath)
-
-
-def create_tar_archive(project_directory, arcname, fp):
-    with tarfile.open(fileobj=fp, mode="w|gz") as tf:
-        for abspath, relpath in _list_project(project_directory):
-            tf.add(abspath, os.path.join(arcname, relpath))
+        if anchors:
+            anchors = anchors[0] if len(anchors) == 1 else "(?:" + "|".join(anchors) + ")"
+            self.regex = re.compile(r"\A" + anchors + r"(?:/.*)?\Z")
+        else:
+            self.regex = None
+
+    def ignored(self, relpath, name, is_dir):
+        if is_dir:
+            relpath += "/"
+            if name in self.dir_names:
+                return True
+        if name in self.names or relpath in self.paths:
+            return True
+        return self.regex is not None and self.regex.match(relpath) is not None
+
+
+def scan_project(project_directory):
+    """Generate a ProjectFile for each file in a project directory that is
+    not excluded by .projectignore or, in a git repository, by the git
+    ignore rules. Excluded directories are not entered. Symbolic links to
+    directories are neither entered nor included, as with os.walk."""
+    matcher = _IgnoreMatcher(project_directory)
+
+    def _scan(path, prefix):
+        files, subdirs = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                relpath = prefix + entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if matcher.ignored(relpath, entry.name, is_dir):
+                    continue
+                if not is_dir:
+                    st = entry.stat(follow_symlinks=False)
+                    files.append(ProjectFile(relpath, entry.path, st.st_size, st.st_mtime))
+                elif not entry.is_symlink():
+                    subdirs.append((entry.path, relpath + "/"))
+        yield from files
+        for subdir in subdirs:
+            yield from _scan(*subdir)
+
+    return _scan(project_directory, "")
+
+
+def _deflate_block(data, level):
+    # A raw deflate stream (wbits=-15) ending in a sync flush, which leaves
+    # it byte-aligned and unterminated, so that blocks compressed separately
+    # can be concatenated into a single deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter(object):
+    """A write-only file object that gzip-compresses its input in blocks,
+    using a pool of threads, in the manner of pigz. The blocks are deflated
+    independently and joined into one deflate stream, with a single gzip
+    header and trailer, so the output is an ordinary single-member gzip
+    file that any gzip reader, including streaming tar readers, accepts.
+    The level can be changed between writes; the block in progress is
+    finished first."""
+
+    def __init__(self, fileobj, level=None, workers=None, block_size=None):
+        self.fileobj = fileobj
+        self.level = ARCHIVE_LEVEL if level is None else level
+        self.block_size = block_size or ARCHIVE_BLOCK_SIZE
+        self._workers = max(1, workers or ARCHIVE_WORKERS)
+        self._executor = ThreadPoolExecutor(self._workers) if self._workers > 1 else None
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._crc = 0
+        self._size = 0
+        # Magic, deflate, no flags, no mtime, no extra flags, unknown OS
+        self.fileobj.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff")
+
+    def _submit(self, block):
+        # The checksum covers the uncompressed data, in order
+        self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        if self._executor is None:
+            self.fileobj.write(_deflate_block(block, self.level))
+            return
+        self._pending.append(self._executor.submit(_deflate_block, block, self.level))
+        # Limit the number of blocks held in memory
+        while len(self._pending) > 2 * self._workers:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def _submit_buffer(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+    def set_level(self, level):
+        if level != self.level:
+            self._submit_buffer()
+            self.level = level
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[: self.block_size]))
+            del self._buffer[: self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer is None:
+            return
+        self._submit_buffer()
+        while self._pending:
+            self.fileobj.write(self._pending.popleft().result())
+        # An empty final block terminates the deflate stream
+        self.fileobj.write(zlib.compressobj(self.level, zlib.DEFLATED, -15).flush())
+        self.fileobj.write(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+        self._buffer = None
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop the compression threads, discarding any pending blocks.
+        This is done by close; call it directly if writing fails."""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def create_tar_archive(project_directory, arcname, fp, compression=None, level=None):
+    """Write a compressed tar archive of a project directory to fp.
+
+    Args:
+        compression: "gzip", "parallel", or "fast"; see ARCHIVE_COMPRESSION.
+        level: the gzip compression level; the default is ARCHIVE_LEVEL,
+            or 1 for the "fast" compression.
+    """
+    compression = compression or ARCHIVE_COMPRESSION
+    if compression not in ("gzip", "parallel", "fast"):
+        raise ValueError(f"Unknown archive compression: {compression}")
+    if level is None:
+        level = 1 if compression == "fast" else ARCHIVE_LEVEL
+    if compression == "gzip":
+        with gzip.GzipFile(fileobj=fp, mode="wb", compresslevel=level) as gz:
+            with tarfile.open(fileobj=gz, mode="w|") as tf:
+                for pfile in scan_project(project_directory):
+                    tf.add(pfile.abspath, f"{arcname}/{pfile.relpath}")
+        return
+    writer = ParallelGzipWriter(fp, level)
+    try:
+        with tarfile.open(fileobj=writer, mode="w|") as tf:
+            for pfile in scan_project(project_directory):
+                writer.set_level(0 if pfile.relpath.lower().endswith(STORED_EXTENSIONS) else level)
+                tf.add(pfile.abspath, f"{arcname}/{pfile.relpath}")
+        writer.close()
+    finally:
+        writer.shutdown()
+
+
+class _QueueWriter(object):
+    # A write-only file object that passes fixed-size chunks to a queue
+    def __init__(self, queue, chunk_size, stop):
+        self._queue = queue
+        self._chunk_size = chunk_size
+        self._stop = stop
+        self._buffer = bytearray()
+
+    def _put(self, item):
+        while True:
+            if self._stop.is_set():
+                raise RuntimeError("Archive consumer has stopped")
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer[: self._chunk_size]))
+            del self._buffer[: self._chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def iter_tar_archive(project_directory, arcname, chunk_size=1024 * 1024):
+    """Generate the compressed tar archive of a project in chunks. The
+    archive is built in a separate thread, which stays at most a few
+    chunks ahead of the consumer, so memory use does not depend on the
+    size of the project."""
+    chunks = queue.Queue(ARCHIVE_QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def _produce():
+        writer = _QueueWriter(chunks, chunk_size, stop)
+        try:
+            create_tar_archive(project_directory, arcname, writer)
+            writer.close()
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            while not stop.is_set():
+                try:
+                    chunks.put(done, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    thread = threading.Thread(target=_produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        thread.join()
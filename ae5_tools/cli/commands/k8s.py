@@ -0,0 +1,57 @@
+import click
+
+from ..login import cluster_call
+from ..utils import global_options
+
+
+@click.group(short_help="daemon", epilog='Type "ae5 k8s <command> --help" for help on a specific command.')
+@global_options
+def k8s():
+    """Commands related to the connection to Kubernetes."""
+    pass
+
+
+@click.group(
+    short_help="Subcommands: start, status, stop",
+    epilog='Type "ae5 k8s daemon <command> --help" for help on a specific command.',
+)
+@global_options
+def daemon():
+    """Commands that manage the background k8s daemon.
+
+    With the --k8s-endpoint=ssh:<username> option, each command normally
+    builds an SSH tunnel and starts a k8s server, then tears them down
+    when it finishes. The daemon keeps them alive in the background, so
+    that later commands for the same user and host can reuse them. It
+    reconnects the tunnel when necessary, and exits after a period of
+    inactivity.
+
+    Set AE5_K8S_DAEMON=start to start the daemon automatically when it is
+    needed, or AE5_K8S_DAEMON=off to ignore a running daemon.
+    """
+    pass
+
+
+k8s.add_command(daemon)
+
+
+@daemon.command()
+@click.option("--idle-timeout", type=float, help="Seconds without a request before the daemon exits; 0 disables this. Default: 1800.")
+@global_options
+def start(**kwargs):
+    """Start the k8s daemon, if it is not already running."""
+    cluster_call("k8s_daemon_start", **kwargs)
+
+
+@daemon.command()
+@global_options
+def status(**kwargs):
+    """Report whether the k8s daemon is running."""
+    cluster_call("k8s_daemon_status", **kwargs)
+
+
+@daemon.command()
+@global_options
+def stop(**kwargs):
+    """Stop the k8s daemon."""
+    cluster_call("k8s_daemon_stop", **kwargs)
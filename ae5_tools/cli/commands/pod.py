@@ -32,3 +32,24 @@ def list(**kwargs):
 def info(**kwargs):
     """Get information about a specific pod."""
     cluster_call("pod_info", **kwargs)
+
+
+@pod.command()
+@ident_filter("pod")
+@click.option("--container", help="The container to read. Defaults to the editor for sessions and the app for deployments and runs.")
+@click.option("--follow", "-f", is_flag=True, help="Continue streaming new log lines until interrupted.")
+@click.option("--since", help="Only return lines newer than a number of seconds, a duration such as 10m or 1h30m, or an ISO 8601 time.")
+@click.option("--tail", type=int, help="Only return this many of the most recent lines of each log.")
+@click.option("--grep", help="Only return the lines matching this regular expression. The search is performed on the server.")
+@click.option("--until", help="With --grep, only return lines older than a number of seconds, a duration, or an ISO 8601 time.")
+@click.option("--context", "-C", type=int, help="With --grep, the number of lines of context to show around each match.")
+@global_options
+def logs(**kwargs):
+    """Retrieve or follow the logs of one or more pods.
+
+    The POD identifier may include wildcards and match multiple pods;
+    in that case, their logs are interleaved, and each line is prefixed
+    with the ID of its pod. With --grep, the logs are searched one at a
+    time, and the matches for each pod are preceded by a header.
+    """
+    cluster_call("pod_logs", **kwargs)
@@ -9,7 +9,7 @@ from .project_revision import revision
 
 
 @click.group(
-    short_help="activity, collaborator, delete, deploy, deployments, download, image, info, jobs, list, patch, revision, run, runs, schedule, sessions, status, upload",
+    short_help="activity, backup, collaborator, delete, deploy, deployments, download, image, info, jobs, list, patch, restore, revision, run, runs, schedule, sessions, status, upload, upload-many",
     epilog='Type "ae5 project <command> --help" for help on a specific command.',
 )
 @global_options
@@ -203,15 +203,79 @@ def image(**kwargs):
 @click.option("--name", default="", help="Name of the project.")
 @click.option("--tag", default="", help="Commit tag to use for initial revision of project.")
 @click.option("--no-wait", is_flag=True, help="Do not wait for the creation session to complete before exiting.")
+@click.option("--force", is_flag=True, help="Upload a project directory even if it has not changed since it was last uploaded.")
 @global_options
-def upload(filename, name, tag, no_wait):
+def upload(filename, name, tag, no_wait, force):
     """Upload a project.
 
     By default, the name of the project is taken from the basename of
     the file. This can be overridden by using the --name option. The
     name must not be the same as an existing project.
+
+    If FILENAME is a directory that was previously uploaded under the
+    same name, the files that have changed since are listed in the
+    "changes" field. If none have, and that project still exists
+    unrevised, the upload is skipped and the existing project is shown.
+    """
+    cluster_call("project_upload", filename, name=name, tag=tag, wait=not no_wait, force=force)
+
+
+@project.command(name="upload-many")
+@click.argument("filenames", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--tag", default="", help="Commit tag to use for the initial revision of each project.")
+@click.option("--jobs", type=int, default=None, help="The number of projects to upload at once (default: 8).")
+@click.option("--force", is_flag=True, help="Upload project directories even if they have not changed since they were last uploaded.")
+@global_options
+def upload_many(filenames, tag, jobs, force):
+    """Upload many projects at once.
+
+    Each FILENAME is a project archive or directory, and the name of each
+    project is taken from its basename. The uploads are sent concurrently,
+    and the command waits until all of them have been processed, showing
+    the result of each. As with the upload command, directories that have
+    not changed since they were last uploaded are skipped.
+    """
+    cluster_call("project_upload_many", filenames, tag=tag, jobs=jobs, force=force)
+
+
+@project.command()
+@ident_filter("project")
+@click.option("--dest", required=True, type=click.Path(file_okay=False), help="The directory to which the projects are backed up.")
+@click.option("--all-revisions", is_flag=True, help="Back up every revision of each project, not just the latest.")
+@click.option("--jobs", type=int, default=None, help="The number of archives to download at once (default: 8).")
+@global_options
+def backup(**kwargs):
+    """Back up projects to a local directory.
+
+    By default, backs up all projects visible to the authenticated user.
+    Simple filters on owner, project name, or id can be performed by
+    supplying an optional PROJECT argument. Filters on other fields may
+    be applied using the --filter option.
+
+    The archives of the projects are downloaded concurrently, and their
+    metadata, collaborators, and checksums are recorded in backup.json.
+    Archives already present from an earlier backup are not downloaded
+    again if their checksums match.
+    """
+    cluster_call("project_backup", **kwargs)
+
+
+@project.command()
+@ident_filter("project")
+@click.option("--source", required=True, type=click.Path(exists=True, file_okay=False), help="A directory created by the backup command.")
+@click.option("--jobs", type=int, default=None, help="The number of projects to upload at once (default: 8).")
+@global_options
+def restore(**kwargs):
+    """Restore projects from a backup.
+
+    Each project in the backup is uploaded from its most recent archive,
+    and its editor, resource profile, and collaborators are restored. The
+    restored projects are owned by the authenticated user; projects whose
+    names are already in use by that user are skipped. The optional
+    PROJECT argument and the --filter option select projects from the
+    backup.
     """
-    cluster_call("project_upload", filename, name=name, tag=tag, wait=not no_wait)
+    cluster_call("project_restore", **kwargs)
 
 
 @project.command()
@@ -7,7 +7,7 @@ from ..utils import global_options, ident_filter, yes_option
 
 
 @click.group(
-    short_help="info, list, open, start, stop",
+    short_help="info, list, open, start, start-many, stop, stop-many",
     epilog='Type "ae5 session <command> --help" for help on a specific command.',
 )
 @global_options
@@ -108,6 +108,52 @@ def stop(**kwargs):
     cluster_call("session_stop", **kwargs, confirm="Stop session {ident}", prefix="Stopping {ident}...", postfix="stopped.")
 
 
+def _read_idents(fp):
+    if fp is None:
+        return None
+    lines = (line.strip() for line in fp)
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+@session.command(name="start-many")
+@ident_filter("project")
+@click.option("--from-file", type=click.File("r"), help="A file listing project identifiers, one per line.")
+@click.option("--editor", help="The editor to use. If supplied, future sessions will use this editor as well.")
+@click.option("--resource-profile", help="The resource profile to use. If supplied, future sessions will use this resource profile as well.")
+@click.option("--jobs", type=int, default=None, help="The number of sessions to start at once (default: 8).")
+@click.option("--no-wait", is_flag=True, help="Do not wait for the sessions to complete initialization before exiting.")
+@global_options
+def start_many(from_file, no_wait, **kwargs):
+    """Start sessions for many projects.
+
+    The projects are selected by the optional PROJECT argument, which may
+    include wildcards, the --filter option, and the identifiers listed in
+    the --from-file file; at least one of these must be supplied. Blank
+    lines and lines beginning with # in that file are ignored.
+
+    The sessions are started concurrently, and the command waits until all
+    of them are ready, showing the number of seconds each one took.
+    """
+    cluster_call("session_start_many", idents=_read_idents(from_file), wait=not no_wait, **kwargs)
+
+
+@session.command(name="stop-many")
+@ident_filter("session")
+@click.option("--from-file", type=click.File("r"), help="A file listing session identifiers, one per line.")
+@click.option("--jobs", type=int, default=None, help="The number of sessions to stop at once (default: 8).")
+@yes_option
+@global_options
+def stop_many(from_file, **kwargs):
+    """Stop many sessions.
+
+    The sessions are selected by the optional SESSION argument, which may
+    include wildcards, the --filter option, and the identifiers listed in
+    the --from-file file; at least one of these must be supplied. Blank
+    lines and lines beginning with # in that file are ignored.
+    """
+    cluster_call("session_stop_many", idents=_read_idents(from_file), **kwargs, confirm="Stop the selected sessions")
+
+
 @session.command()
 @ident_filter("session", required=True)
 @click.option("--wait", is_flag=True, help="Wait for the session to complete initialization before exiting.")
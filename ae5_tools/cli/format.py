@@ -3,6 +3,7 @@ import json
 import os
 import re
 import sys
+import time
 from datetime import datetime
 from fnmatch import fnmatch
 
@@ -88,6 +89,8 @@ _format_help = {
     "width": 'Output width, in characters. The default behavior is to determine the width of the surrounding window and truncate the table to that width. Only applies to the "text" format.',
     "wide": "Do not limit output width. Equivalent to --width=infinity.",
     "no-header": 'Omit the header. Applies to "text" and "csv" formats only.',
+    "watch": 'Repeat the command every given number of seconds, showing the rows that change. In a terminal, the table is updated in place and changed rows are highlighted. Applies to "list" commands only.',
+    "watch-until": "With --watch, stop once every row satisfies this filter expression; e.g., --watch-until state=started.",
 }
 
 
@@ -106,6 +109,8 @@ _format_options = [
     click.option("--width", type=int, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option("--wide", is_flag=True, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option("--header/--no-header", default=None, expose_value=False, callback=param_callback, hidden=True),
+    click.option("--watch", type=float, default=None, expose_value=False, callback=param_callback, hidden=True),
+    click.option("--watch-until", type=str, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option(
         "--help-format",
         is_flag=True,
@@ -289,7 +294,7 @@ def split_header(col, wid):
     return result
 
 
-def print_table(records, columns, header=True, width=0):
+def table_lines(records, columns, header=True, width=0):
     if width <= 0:
         # http://granitosaurus.rocks/getting-terminal-size.html
         for i in range(3):
@@ -301,9 +306,7 @@ def print_table(records, columns, header=True, width=0):
         else:
             width = 80
     if not records and not columns:
-        if header:
-            print("-" * width)
-        return
+        return ["-" * width] if header else []
     nwidth = -2
     widths = []
     lines = [[] for _ in range(len(records))]
@@ -350,8 +353,65 @@ def print_table(records, columns, header=True, width=0):
         n = min(3, max(0, width - owidth - 2))
         dots, dashes, spaces = "." * n, "-" * n, " " * n
         lines = [f[:width] if f[width - n : width] in (dashes, spaces) else f[: width - n] + dots for f in lines]
-    for line in lines:
-        print(line.rstrip())
+    return [line.rstrip() for line in lines]
+
+
+def print_table(records, columns, header=True, width=0):
+    for line in table_lines(records, columns, header, width):
+        print(line)
+
+
+def _terminal_height():
+    for i in range(3):
+        try:
+            return int(os.get_terminal_size(i)[1])
+        except OSError:
+            pass
+    return 0
+
+
+class LiveTable(object):
+    """Draws a table on the terminal before all of its values are known,
+    and redraws it in place whenever they change. Called with a list of
+    records, which are converted to rows by format_response."""
+
+    def __init__(self, format_response):
+        self._format_response = format_response
+        self._nlines = 0
+
+    @staticmethod
+    def supported():
+        term = os.environ.get("TERM", "")
+        return not IS_WIN and term != "dumb" and sys.stdout.isatty()
+
+    def __call__(self, records):
+        result, columns = self._format_response(records, "table")
+        result, columns = _prepare_output(result, columns)
+        opts = get_options()
+        width = sys.maxsize if opts.get("wide") else opts.get("width") or 0
+        lines = table_lines(result, columns, opts.get("header", True), width)
+        # The cursor cannot be moved above the top of the screen
+        if len(lines) >= _terminal_height():
+            return
+        self.clear()
+        sys.stdout.write("".join(line + "\n" for line in lines))
+        sys.stdout.flush()
+        self._nlines = len(lines)
+
+    def clear(self):
+        if self._nlines:
+            # Move to the start of the first line drawn and erase to the end
+            sys.stdout.write(f"\x1b[{self._nlines}F\x1b[J")
+            sys.stdout.flush()
+            self._nlines = 0
+
+
+def _prepare_output(result, columns):
+    opts = get_options()
+    if opts.get("sort"):
+        result = sort_df(result, columns, opts.get("sort"))
+    drop_under = opts.get("format") not in ("json", "csv")
+    return filter_df(result, columns, opts.get("filter"), opts.get("columns"), drop_under)
 
 
 def print_output(result):
@@ -364,13 +424,9 @@ def print_output(result):
     elif not isinstance(result, tuple):
         msg: str = f"Not prepared to print an object of type {type(result)}"
         raise NotImplementedError(msg)
-    result, columns = result
     opts = get_options()
-    if opts.get("sort"):
-        result = sort_df(result, columns, opts.get("sort"))
     fmt = opts.get("format")
-    drop_under = fmt not in ("json", "csv")
-    result, columns = filter_df(result, columns, opts.get("filter"), opts.get("columns"), drop_under)
+    result, columns = _prepare_output(*result)
     if fmt == "json":
         print_json(result, columns)
     elif fmt == "csv":
@@ -378,3 +434,75 @@ def print_output(result):
     else:
         width = sys.maxsize if opts.get("wide") else opts.get("width") or 0
         print_table(result, columns, opts.get("header", True), width)
+
+
+class WatchTable(object):
+    """Renders successive versions of a table. On a terminal, only the
+    lines that differ from the previous version are rewritten, and rows
+    that have changed are highlighted. Otherwise, the table is printed
+    once, followed by each row that changes, and the last version of each
+    row that disappears marked as removed."""
+
+    def __init__(self, tty=None):
+        self._tty = LiveTable.supported() if tty is None else tty
+        self._lines = None
+        self._rows = None
+        self._row_lines = {}
+
+    def _keys(self, records, columns):
+        ndx = columns.index("id") if "id" in columns else 0
+        return [_str(rec[ndx]) if columns else n for n, rec in enumerate(records)]
+
+    def update(self, result):
+        records, columns = _prepare_output(*result)
+        opts = get_options()
+        width = sys.maxsize if opts.get("wide") else opts.get("width") or 0
+        lines = table_lines(records, columns, opts.get("header", True), width)
+        nhead = len(lines) - len(records)
+        keys = self._keys(records, columns)
+        rows = list(zip(keys, map(tuple, records)))
+        changed = [self._rows is not None and self._rows.get(key) != row for key, row in rows]
+        self._rows = dict(rows)
+        if not self._tty:
+            if self._lines is None:
+                output = lines
+            else:
+                output = [line for line, flag in zip(lines[nhead:], changed) if flag]
+                output.extend(f"{line}  (removed)" for key, line in self._row_lines.items() if key not in self._rows)
+            self._lines = lines
+            self._row_lines = dict(zip(keys, lines[nhead:]))
+            for line in output:
+                print(line)
+            return
+        lines = lines[:nhead] + [click.style(line, bold=True) if flag else line for line, flag in zip(lines[nhead:], changed)]
+        old, self._lines = self._lines, lines
+        if old is not None and len(old) == len(lines) and len(lines) < _terminal_height():
+            nlines = len(lines)
+            output = "".join(f"\x1b[{nlines - n}F\x1b[2K{line}\x1b[{nlines - n}E" for n, (line, prev) in enumerate(zip(lines, old)) if line != prev)
+        else:
+            # Redraw everything when the number of rows changes
+            output = f"\x1b[{len(old)}F\x1b[J" if old and len(old) < _terminal_height() else ""
+            output += "".join(line + "\n" for line in lines)
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+
+def watch_output(fetch, interval, until=None):
+    """Call fetch every interval seconds and render each result with a
+    WatchTable, until interrupted or every row satisfies the filter until."""
+    table = WatchTable()
+    try:
+        while True:
+            started = time.monotonic()
+            result = fetch()
+            if not isinstance(result, tuple):
+                raise click.UsageError("--watch requires tabular output")
+            table.update(result)
+            if until:
+                records, columns = result
+                matched, _ = filter_df(records, columns, (until,), None, False)
+                if records and len(matched) == len(records):
+                    return
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
@@ -3,7 +3,7 @@ import click
 from ..api import AEAdminSession, AEException, AESessionBase, AEUserSession
 from ..config import config
 from ..identifier import Identifier
-from .format import print_output
+from .format import LiveTable, print_output, watch_output
 from .utils import GLOBAL_OPTIONS, click_text, get_options, param_callback, persist_option
 
 
@@ -297,6 +297,33 @@ def cluster_call(method, *args, **kwargs):
         format = "table"
     kwargs.setdefault("format", format)
 
+    if opts.get("watch_until") and not opts.get("watch"):
+        raise click.UsageError("--watch-until requires --watch")
+    if opts.get("watch"):
+        if not method.endswith("_list") or opts.get("format") not in (None, "text"):
+            raise click.UsageError('--watch applies only to "list" commands with text output')
+        kwargs["format"] = "table"
+
+        def fetch():
+            try:
+                return getattr(c, method)(*args, **kwargs)
+            except AEException as e:
+                raise click.ClickException(str(e))
+
+        # Keep responses for conditional requests between iterations
+        c._etag_cache = {}
+        try:
+            watch_output(fetch, opts["watch"], opts.get("watch_until"))
+        finally:
+            c._etag_cache = None
+        return
+
+    # On a terminal, tables that are joined with k8s data are drawn before
+    # that data arrives, and redrawn as it does
+    live = None
+    if method.endswith("_list") and opts.get("format") in (None, "text") and hasattr(c, "_k8s_progress") and LiveTable.supported():
+        live = c._k8s_progress = LiveTable(c._format_response)
+
     # Retrieve the proper cluster session object and make the call
     try:
         result = getattr(c, method)(*args, **kwargs)
@@ -304,6 +331,10 @@ def cluster_call(method, *args, **kwargs):
         if postfix or prefix:
             click.echo("", nl=True, err=True)
         raise click.ClickException(str(e))
+    finally:
+        if live is not None:
+            c._k8s_progress = None
+            live.clear()
 
     # Finish out the standardized CLI output
     if postfix or prefix:
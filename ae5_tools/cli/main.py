@@ -29,6 +29,7 @@ from .commands.deployment import deployment
 from .commands.editor import editor
 from .commands.endpoint import endpoint
 from .commands.job import job
+from .commands.k8s import k8s
 from .commands.node import node
 from .commands.pod import pod
 from .commands.project import project
@@ -141,6 +142,7 @@ cli.add_command(resource_profile)
 cli.add_command(editor)
 cli.add_command(node)
 cli.add_command(pod)
+cli.add_command(k8s)
 cli.add_command(secret)
 cli.add_command(role)
 
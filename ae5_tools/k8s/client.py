@@ -1,9 +1,69 @@
+import codecs
+import json
 import os
 import sys
+import time
 
 import requests
 
-from .ssh import launch_background, tunneled_k8s_url
+from .ssh import close_tunnel, launch_background, state_dir, tunneled_k8s_url
+
+# Whether to use the background k8s daemon for ssh: endpoints: "auto" uses
+# one that is already running, "start" starts one if needed, "off" never does
+K8S_DAEMON = os.environ.get("AE5_K8S_DAEMON") or "auto"
+# Seconds for which a successful handshake with a k8s endpoint is remembered
+K8S_HANDSHAKE_TTL = float(os.environ.get("AE5_K8S_HANDSHAKE_TTL") or "300")
+
+
+class PodWatch(object):
+    """An iterator over the events of a pod watch stream. Closing it closes
+    the underlying response, which also ends a call to next() that is
+    blocked in another thread waiting for the next event."""
+
+    def __init__(self, response):
+        self._response = response
+        self._response.encoding = "utf-8"
+        self._closed = False
+        self._events = self._iter_events()
+
+    def _iter_events(self):
+        data = []
+        # chunk_size=None delivers each event as soon as it arrives
+        for line in self._response.iter_lines(chunk_size=None, decode_unicode=True):
+            if line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            elif not line and data:
+                event = json.loads("\n".join(data))
+                data = []
+                if event["type"] == "ERROR":
+                    raise RuntimeError(f'Error watching pods: {event["message"]}')
+                yield event
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._events)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception:
+            if self._closed:
+                # The read was interrupted by close()
+                raise StopIteration
+            self.close()
+            raise
+
+    def close(self):
+        self._closed = True
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 class AE5K8SClient(object):
@@ -21,20 +81,83 @@ class AE5K8SClient(object):
         result = [result.get(x) for x in ids]
         return result
 
-    def pod_log(self, id, container=None, follow=False):
-        follow_s = str(bool(follow)).lower()
-        path = f"pod/{id}/log?follow={follow_s}"
+    def watch_pods(self, ids):
+        """Return a PodWatch that yields pod status events from the
+        server's event stream. See AE5K8STransformer.watch_pods."""
+        response = self._api("get", "pods/watch", params={"id": ids}, stream=True)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return PodWatch(response)
+
+    def pod_log(self, id, container=None, follow=False, since=None, tail=None, stream=None):
+        path = f"pod/{id}/log"
+        return self._stream_log(path, {}, container, follow, since, tail, stream)
+
+    def pod_logs(self, ids, container=None, follow=False, since=None, tail=None, stream=None):
+        """Write the logs of one or more pods to stream (default: stdout).
+        The logs of multiple pods are interleaved by the server, with
+        each line prefixed by the ID of its pod."""
+        if len(ids) == 1:
+            return self.pod_log(ids[0], container, follow, since, tail, stream)
+        return self._stream_log("pods/log", {"id": ids}, container, follow, since, tail, stream)
+
+    def pod_log_search(
+        self, id, pattern, container=None, follow=False, since=None, until=None, context=None, max_count=None, timestamps=False, stream=None
+    ):
+        """Write only the lines of a pod's log that match the regular
+        expression, along with any requested context, to stream. The
+        filtering is performed by the server."""
+        params = {"pattern": pattern, "timestamps": str(bool(timestamps)).lower()}
+        for key, value in (("until", until), ("context", context), ("max_count", max_count)):
+            if value is not None:
+                params[key] = value
+        return self._stream_log(f"pod/{id}/log/search", params, container, follow, since, None, stream)
+
+    def _stream_log(self, path, params, container, follow, since, tail, stream):
+        params["follow"] = str(bool(follow)).lower()
         if container is not None:
-            path = f"{path}&container={container}"
-        response = self._api("get", path, stream=True)
-        for chunk in response.iter_content():
-            if chunk:
-                stream.write(chunk.decode("utf-8", errors="replace"))
+            params["container"] = container
+        if since is not None:
+            params["since"] = since
+        if tail is not None:
+            params["tail"] = tail
+        stream = sys.stdout if stream is None else stream
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        response = self._api("get", path, params=params, stream=True)
+        with response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk:
+                    stream.write(decoder.decode(chunk))
+                    stream.flush()
+        stream.write(decoder.decode(b"", final=True))
 
 
 class AE5K8SLocalClient(AE5K8SClient):
     def __init__(self, hostname, username):
         self._ssh = self._server = None
+        self._port = None
+        # A persistent session keeps connections to the local server alive
+        self._http = requests.Session()
+        if K8S_DAEMON != "off":
+            from .daemon import auth_headers, daemon_status, start_daemon
+
+            try:
+                if K8S_DAEMON == "start":
+                    state = start_daemon(hostname, username)
+                else:
+                    state = daemon_status(hostname, username)
+            except RuntimeError as exc:
+                self._error = str(exc)
+                return
+            if state is not None:
+                self._port = state["port"]
+                self._http.headers.update(auth_headers(state))
+                self._error = None
+                return
         try:
             self._ssh, ssh_url = tunneled_k8s_url(hostname, username)
         except RuntimeError as exc:
@@ -48,13 +171,13 @@ class AE5K8SLocalClient(AE5K8SClient):
             self._error = str(exc)
 
     def disconnect(self):
+        self._http.close()
         if self._server is not None and self._server.returncode is None:
             self._server.terminate()
             self._server.communicate()
             self._server = None
-        if self._ssh is not None and self._ssh.returncode is None:
-            self._ssh.terminate()
-            self._ssh.communicate()
+        if self._ssh is not None:
+            close_tunnel(self._ssh)
             self._ssh = None
 
     def __del__(self):
@@ -64,26 +187,89 @@ class AE5K8SLocalClient(AE5K8SClient):
     def _api(self, method, path, **kwargs):
         from .server import K8S_ENDPOINT_PORT
 
-        return requests.request(method, f"http://localhost:{K8S_ENDPOINT_PORT}/{path}", **kwargs)
+        return self._http.request(method, f"http://localhost:{self._port or K8S_ENDPOINT_PORT}/{path}", **kwargs)
+
+
+class AE5K8SConnectionError(RuntimeError):
+    pass
+
+
+def _handshake_file():
+    return os.path.join(state_dir(), "handshakes.json")
+
+
+def _load_handshakes():
+    try:
+        with open(_handshake_file(), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _handshake_cached(hostname, subdomain):
+    timestamp = _load_handshakes().get(f"{hostname}/{subdomain}")
+    return timestamp is not None and 0 <= time.time() - timestamp < K8S_HANDSHAKE_TTL
+
+
+def _record_handshake(hostname, subdomain, success=True):
+    data = _load_handshakes()
+    key = f"{hostname}/{subdomain}"
+    if success:
+        data[key] = time.time()
+    elif data.pop(key, None) is None:
+        return
+    fname = _handshake_file()
+    try:
+        with open(fname + ".tmp", "w") as fp:
+            json.dump(data, fp)
+        os.replace(fname + ".tmp", fname)
+    except OSError:
+        pass
 
 
 class AE5K8SRemoteClient(AE5K8SClient):
     def __init__(self, session, subdomain):
         self._session = session
         self._subdomain = subdomain
+        self._error = None
+        # A recent successful handshake means that this endpoint exists and
+        # the session's cookies were accepted, so both checks can be skipped.
+        # Otherwise, the endpoint is checked by the first real request.
+        self._verified = _handshake_cached(session.hostname, subdomain)
+        if not self._verified and not self._cookies_fresh():
+            try:
+                session._get("projects/actions", params={"q": "create_action"})
+            except Exception as exc:
+                self._error = f"Issue establishing session: {exc}"
+
+    def _cookies_fresh(self):
+        # A cookie without an expiry never reports itself as expired, even
+        # though the server may have dropped it long ago, so it is stale
+        cookies = self._session.session.cookies
+        return self._session.connected and not any(c.expires is None or c.is_expired() for c in cookies)
+
+    def _check_endpoint(self):
         try:
-            session._get("projects/actions", params={"q": "create_action"})
-        except Exception as exc:
-            self._error = f"Issue establishing session: {exc}"
-            return
-        try:
-            response = session._get("", subdomain=subdomain, format="text")
-            if response == "Alive and kicking":
-                self._error = None
-            else:
-                self._error = f"Unexpected response at endpoint {subdomain}"
+            response = self._session._get("", subdomain=self._subdomain, format="text")
         except RuntimeError:
-            self._error = f"No deployment found at endpoint {subdomain}"
+            return f"No deployment found at endpoint {self._subdomain}"
+        if response != "Alive and kicking":
+            return f"Unexpected response at endpoint {self._subdomain}"
 
     def _api(self, method, path, **kwargs):
-        return self._session._api(method, path, subdomain=self._subdomain, format="response", **kwargs)
+        call = lambda: self._session._api(method, path, subdomain=self._subdomain, format="response", **kwargs)  # noqa: E731
+        if self._verified:
+            return call()
+        try:
+            response = call()
+        except RuntimeError:
+            # Determine whether the endpoint itself is the problem; if not,
+            # the failure may have been transient, so try once more
+            error = self._check_endpoint()
+            if error:
+                _record_handshake(self._session.hostname, self._subdomain, False)
+                raise AE5K8SConnectionError(error)
+            response = call()
+        self._verified = True
+        _record_handshake(self._session.hostname, self._subdomain)
+        return response
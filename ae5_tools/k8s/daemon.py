@@ -0,0 +1,262 @@
+"""A background process that keeps the SSH tunnel and k8s server for an
+ssh:<username> endpoint running between invocations of ae5-tools, so that
+only the first command pays the cost of establishing them. Its state is
+recorded in a file in the config directory, one per user and host.
+
+The daemon listens on a localhost port, which any local user can reach,
+so every request must carry the bearer token recorded in that file. The
+file and its directory are readable only by their owner."""
+
+import argparse
+import asyncio
+import datetime
+import hmac
+import json
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+from aiohttp import web
+
+from .server import make_app
+from .ssh import close_tunnel, find_local_port, state_dir, tunneled_k8s_url
+from .transformer import AE5K8STransformer
+
+# Seconds without a request after which the daemon exits; 0 disables this
+DAEMON_IDLE_TIMEOUT = float(os.environ.get("AE5_K8S_DAEMON_IDLE_TIMEOUT") or "1800")
+# Seconds between health checks of the tunnel
+DAEMON_HEALTH_INTERVAL = 10
+# Seconds to wait for a new daemon to begin serving
+DAEMON_START_TIMEOUT = 60
+
+
+def _state_file(hostname, username):
+    return os.path.join(state_dir(), f"{username}@{hostname}.json")
+
+
+def _read_state(hostname, username):
+    try:
+        with open(_state_file(hostname, username), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_state(hostname, username, pid=None):
+    state = _read_state(hostname, username)
+    if state is not None and (pid is None or state.get("pid") == pid):
+        try:
+            os.unlink(_state_file(hostname, username))
+        except OSError:
+            pass
+
+
+def auth_headers(state):
+    """The headers that authorize a request to the daemon with this state."""
+    return {"authorization": f'Bearer {state.get("token", "")}'}
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # os.kill terminates the process on Windows; rely on the health check
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def daemon_status(hostname, username):
+    """Return the state of the daemon for this user and host if it is
+    running and answers a health check, or None otherwise."""
+    state = _read_state(hostname, username)
+    if state is None:
+        return None
+    if not _pid_alive(state["pid"]):
+        _remove_state(hostname, username, state["pid"])
+        return None
+    try:
+        response = requests.get(f'http://localhost:{state["port"]}/__status__', headers=auth_headers(state), timeout=5)
+        if response.status_code == 200:
+            return state
+    except requests.RequestException:
+        pass
+    return None
+
+
+def stop_daemon(hostname, username, timeout=10):
+    """Stop the daemon for this user and host. Returns False if no
+    daemon was running."""
+    state = _read_state(hostname, username)
+    if state is None:
+        return False
+    pid = state["pid"]
+    if _pid_alive(pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and _read_state(hostname, username) is not None:
+            if not _pid_alive(pid):
+                break
+            time.sleep(0.1)
+    _remove_state(hostname, username, pid)
+    return True
+
+
+def start_daemon(hostname, username, idle_timeout=None):
+    """Return the state of the daemon for this user and host, starting
+    one first if none is running."""
+    state = daemon_status(hostname, username)
+    if state is not None:
+        return state
+    # A daemon that is running but unresponsive is replaced
+    stop_daemon(hostname, username)
+    idle_timeout = DAEMON_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+    cmd = [
+        sys.executable,
+        "-u",
+        "-m",
+        "ae5_tools.k8s.daemon",
+        f"{username}@{hostname}",
+        f"--port={find_local_port()}",
+        f"--idle-timeout={idle_timeout}",
+    ]
+    if os.name == "nt":
+        kwargs = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        kwargs = {"start_new_session": True}
+    log_file = _state_file(hostname, username)[:-5] + ".log"
+    with open(log_file, "a") as log:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, **kwargs)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"The k8s daemon exited with code {proc.returncode}; see {log_file}")
+        state = daemon_status(hostname, username)
+        if state is not None and state["pid"] == proc.pid:
+            return state
+        time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError(f"Timed out waiting for the k8s daemon to start; see {log_file}")
+
+
+class K8SDaemon(object):
+    def __init__(self, hostname, username, port, idle_timeout=None):
+        self.hostname = hostname
+        self.username = username
+        self.port = port
+        self.idle_timeout = DAEMON_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.token = secrets.token_urlsafe(32)
+        # The local end of the tunnel is kept when reconnecting, so that
+        # the server's transformers do not need to change their URLs
+        self._local_port = find_local_port()
+        self._tunnel = self._url = None
+        self._last_activity = time.monotonic()
+
+    def _connect(self):
+        if self._tunnel is not None:
+            close_tunnel(self._tunnel)
+            self._tunnel = None
+        self._tunnel, self._url = tunneled_k8s_url(self.hostname, self.username, self._local_port)
+
+    @web.middleware
+    async def _authorize(self, request, handler):
+        if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {self.token}"):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    @web.middleware
+    async def _activity(self, request, handler):
+        self._last_activity = time.monotonic()
+        return await handler(request)
+
+    async def _healthy(self, probe):
+        if self._tunnel is None or self._tunnel.poll() is not None:
+            return False
+        try:
+            await asyncio.wait_for(probe.get("/version"), DAEMON_HEALTH_INTERVAL)
+            return True
+        except Exception:
+            return False
+
+    def _write_state(self):
+        state = {
+            "pid": os.getpid(),
+            "hostname": self.hostname,
+            "username": self.username,
+            "port": self.port,
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "idle_timeout": self.idle_timeout,
+            "token": self.token,
+        }
+        fname = _state_file(self.hostname, self.username)
+        # The token must not be readable by other users
+        with open(os.open(fname + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as fp:
+            json.dump(state, fp)
+        os.replace(fname + ".tmp", fname)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._connect)
+        app = make_app(self._url, False)
+        # Unauthorized requests do not count as activity
+        app.middlewares[:0] = [self._authorize, self._activity]
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "localhost", self.port).start()
+        self._write_state()
+        print(f"Serving {self.username}@{self.hostname} on port {self.port}", flush=True)
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except NotImplementedError:
+                pass
+        probe = AE5K8STransformer(self._url, None)
+        try:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), DAEMON_HEALTH_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                if self.idle_timeout and time.monotonic() - self._last_activity > self.idle_timeout:
+                    print("Idle timeout reached; exiting", flush=True)
+                    break
+                if not await self._healthy(probe):
+                    print("The k8s tunnel is unavailable; reconnecting", flush=True)
+                    try:
+                        await loop.run_in_executor(None, self._connect)
+                    except RuntimeError as exc:
+                        # Try again at the next health check
+                        print(exc, flush=True)
+        finally:
+            _remove_state(self.hostname, self.username, os.getpid())
+            await probe.close()
+            await runner.cleanup()
+            if self._tunnel is not None:
+                close_tunnel(self._tunnel)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m ae5_tools.k8s.daemon")
+    parser.add_argument("target", help="username@hostname for the SSH connection to the master node")
+    parser.add_argument("--port", type=int, required=True, help="The local port to serve on")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="Seconds without a request before exiting")
+    args = parser.parse_args(args)
+    username, hostname = args.target.split("@", 1)
+    daemon = K8SDaemon(hostname, username, args.port, args.idle_timeout)
+    asyncio.run(daemon.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""A minimal metrics registry for the k8s server, rendered in the
+Prometheus text exposition format. It implements just enough of the
+counter, gauge and histogram semantics to describe the server's own
+behavior without adding a dependency on prometheus_client."""
+
+import bisect
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_PATH_NAMES = re.compile(r"/(pods|nodes|services|deployments)/[^/]+")
+
+
+def path_template(path):
+    """Reduce an upstream API path to a low-cardinality label value
+    by dropping the query string and replacing object names."""
+    path = path.split("?", 1)[0]
+    return _PATH_NAMES.sub(r"/\1/{name}", path)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric {self.name} requires labels: {', '.join(self.labels)}")
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, extra=()):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labels, key, extra), value
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def lines(self, extra=()):
+        return [f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples(extra)]
+
+    def render(self, extra=()):
+        return "\n".join(self.header() + self.lines(extra))
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        rec = self._values.get(key)
+        if rec is None:
+            rec = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+        rec["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        rec["sum"] += value
+
+    def value(self, **labels):
+        rec = self._values.get(self._key(labels))
+        return sum(rec["counts"]) if rec else 0
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def _samples(self, extra=()):
+        extra = list(extra)
+        for key, rec in sorted(self._values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), rec["counts"]):
+                total += count
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, extra + [("le", _format_value(bound))]), total
+            yield f"{self.name}_sum", _format_labels(self.labels, key, extra), rec["sum"]
+            yield f"{self.name}_count", _format_labels(self.labels, key, extra), total
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+        # Labels added to every sample, such as the worker that produced it
+        self.labels = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def snapshot(self):
+        """Return the sample lines of each metric, keyed by metric name,
+        so that another worker's registry can include them in its render."""
+        extra = sorted(self.labels.items())
+        return {name: m.lines(extra) for name, m in self._metrics.items()}
+
+    def render(self, others=()):
+        """Render every metric, followed by the matching sample lines of
+        any snapshots taken from the registries of other workers."""
+        lines = []
+        for name, samples in self.snapshot().items():
+            lines.extend(self._metrics[name].header())
+            lines.extend(samples)
+            for other in others:
+                lines.extend(other.get(name, ()))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("ae5_k8s_requests_total", "Requests handled by the k8s server.", ("method", "route", "status"))
+REQUEST_LATENCY = REGISTRY.histogram("ae5_k8s_request_duration_seconds", "Time spent handling requests.", ("method", "route"))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("ae5_k8s_requests_in_flight", "Requests currently being handled.", ("route",))
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "ae5_k8s_upstream_requests_total", "Requests made to the Kubernetes and Prometheus APIs.", ("service", "path", "status")
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "ae5_k8s_upstream_request_duration_seconds", "Time spent waiting for the Kubernetes and Prometheus APIs.", ("service", "path")
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge("ae5_k8s_upstream_requests_in_flight", "Upstream requests currently open.", ("service",))
+EXEC_SESSIONS = REGISTRY.counter("ae5_k8s_exec_sessions_total", "Exec websockets opened to examine pod changes.", ("status",))
+EXEC_LATENCY = REGISTRY.histogram("ae5_k8s_exec_duration_seconds", "Lifetime of exec websockets.")
+CACHE_LOOKUPS = REGISTRY.counter("ae5_k8s_cache_lookups_total", "Cache lookups by cache and result.", ("cache", "result"))
+CACHE_HIT_RATIO = REGISTRY.gauge("ae5_k8s_cache_hit_ratio", "Fraction of cache lookups that were hits.", ("cache",))
+
+
+def _update_ratios():
+    caches = {key[0] for key in CACHE_LOOKUPS._values}
+    for cache in caches:
+        hits = CACHE_LOOKUPS.value(cache=cache, result="hit")
+        total = hits + CACHE_LOOKUPS.value(cache=cache, result="miss")
+        CACHE_HIT_RATIO.set(hits / total if total else 0.0, cache=cache)
+
+
+def write_snapshot(directory, worker):
+    """Publish this worker's samples to a shared directory, replacing
+    the file atomically so that readers never see a partial snapshot."""
+    _update_ratios()
+    path = os.path.join(directory, f"worker-{worker}.json")
+    with open(path + ".tmp", "w") as fp:
+        json.dump(REGISTRY.snapshot(), fp)
+    os.replace(path + ".tmp", path)
+
+
+def read_snapshots(directory, worker):
+    """Load the snapshots published by every worker except this one."""
+    result = []
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith(".json") or fname == f"worker-{worker}.json":
+            continue
+        try:
+            with open(os.path.join(directory, fname)) as fp:
+                result.append(json.load(fp))
+        except (OSError, ValueError):
+            continue
+    return result
+
+
+def render(others=()):
+    _update_ratios()
+    return REGISTRY.render(others)
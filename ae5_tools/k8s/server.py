@@ -1,14 +1,35 @@
+import asyncio
 import datetime
+import hashlib
 import json
+import multiprocessing
 import os
+import re
+import shutil
+import signal
+import socket
 import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import unquote, urlencode
 
 import requests
 from aiohttp import web
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from . import metrics
 from .ssh import tunneled_k8s_url
-from .transformer import AE5K8STransformer, AE5PromQLTransformer
+from .transformer import DOWNSAMPLERS, AE5K8STransformer, AE5PromQLTransformer, _series_by_id, _watch_selectors, parse_timedelta
 
 DEFAULT_K8S_URL = "https://kubernetes.default/"
 DEFAULT_K8S_TOKEN_FILES = (
@@ -17,11 +38,95 @@ DEFAULT_K8S_TOKEN_FILES = (
 )
 K8S_ENDPOINT_PORT = int(os.environ.get("AE5_K8S_PORT") or "8086")
 DEFAULT_PROMETHEUS_PORT = 9090
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.environ.get("AE5_K8S_COMPRESS_MIN_SIZE") or "1024")
+# Number of server processes sharing the listening port
+K8S_WORKERS = int(os.environ.get("AE5_K8S_WORKERS") or "1")
+# Number of processes per worker for CPU-bound transforms; 0 runs them in the event loop
+K8S_PROCESSES = int(os.environ.get("AE5_K8S_PROCESSES") or "0")
+# Whether to use uvloop: "auto" uses it when it is installed
+K8S_UVLOOP = os.environ.get("AE5_K8S_UVLOOP") or "auto"
+# Seconds between the metrics snapshots each worker shares with the others
+METRICS_INTERVAL = float(os.environ.get("AE5_K8S_METRICS_INTERVAL") or "5")
+# Seconds between keepalive comments on an idle event stream
+WATCH_KEEPALIVE = float(os.environ.get("AE5_K8S_WATCH_KEEPALIVE") or "15")
+# Prometheus metric names, which are placed in queries without quoting
+_METRIC_NAME = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+
+
+def _dumps(result):
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(result, separators=(",", ":")).encode()
 
 
 def _json(result):
-    text = json.dumps(result, indent=2)
-    return web.Response(text=text, content_type="application/json")
+    return web.Response(body=_dumps(result), content_type="application/json")
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Count and time every request by method, route template and status."""
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    status = 500
+    metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+    started = time.monotonic()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+        metrics.REQUESTS.inc(method=request.method, route=route, status=status)
+        metrics.REQUEST_LATENCY.observe(time.monotonic() - started, method=request.method, route=route)
+
+
+@web.middleware
+async def conditional_middleware(request, handler):
+    """Tag complete responses with an ETag computed from their content,
+    answer matching If-None-Match requests with 304 Not Modified, and
+    compress the remaining large responses if the client accepts it."""
+    response = await handler(request)
+    if type(response) is not web.Response or response.status != 200 or not response.body:
+        return response
+    body = response.body
+    response.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    if request.method in ("GET", "HEAD") and request.if_none_match:
+        matched = any(tag.value in ("*", response.etag.value) for tag in request.if_none_match)
+        metrics.CACHE_LOOKUPS.inc(cache="etag", result="hit" if matched else "miss")
+        if matched:
+            return web.Response(status=304, headers={"ETag": response.headers["ETag"]})
+    if len(body) >= COMPRESS_MIN_SIZE:
+        response.enable_compression()
+    return response
+
+
+def _parse_time(name, value, absolute=False):
+    """Parse a time window parameter. A number of seconds, or a duration
+    such as 1h30m, is interpreted as that long ago, and is returned as an
+    integer number of seconds unless absolute is True. Otherwise the value
+    must be an ISO 8601 time, which is returned as a datetime in UTC."""
+    if value.isdigit():
+        seconds = int(value)
+    elif value[:1].isdigit() and re.fullmatch(r"(\d+[wdhms])+", value):
+        seconds = int(parse_timedelta(value).total_seconds())
+    else:
+        try:
+            result = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise web.HTTPUnprocessableEntity(reason=f"Invalid parameter: {name}={value}")
+        if result.tzinfo is None:
+            result = result.replace(tzinfo=datetime.timezone.utc)
+        return result
+    if seconds <= 0:
+        raise web.HTTPUnprocessableEntity(reason=f"Invalid parameter: {name}={value}")
+    if absolute:
+        return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=seconds)
+    return seconds
 
 
 class WebStream(object):
@@ -33,7 +138,8 @@ class WebStream(object):
         await self._response.prepare(self._request)
 
     def closing(self):
-        return self._request.protocol.transport.is_closing()
+        transport = self._request.transport
+        return transport is None or transport.is_closing()
 
     async def write(self, data):
         await self._response.write(data)
@@ -43,10 +149,16 @@ class WebStream(object):
 
 
 class AE5K8SHandler(object):
-    def __init__(self, url, token, prometheus_url=None):
-        self.xfrm = AE5K8STransformer(url, token)
+    def __init__(self, url, token, prometheus_url=None, executor=None, metrics_dir=None, worker=None):
+        self.xfrm = AE5K8STransformer(url, token, executor=executor)
+        self.promql = None
         if prometheus_url:
-            self.promql = AE5PromQLTransformer(prometheus_url, token)
+            self.promql = AE5PromQLTransformer(prometheus_url, token, executor=executor)
+        # With multiple workers, each one publishes its metrics to this
+        # directory, and /__metrics__ combines them with its own
+        self.metrics_dir = metrics_dir
+        self.worker = worker
+        self._publisher = None
 
     @classmethod
     def get_promQL_IP(cls, url, token):
@@ -59,12 +171,29 @@ class AE5K8SHandler(object):
         assert len(entries) == 1, "More than one prometheus-k8s service found"
         return entries[0]["spec"]["clusterIP"]
 
-    async def cleanup(self):
+    async def _publish_metrics(self):
+        while True:
+            metrics.write_snapshot(self.metrics_dir, self.worker)
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    async def startup(self, app=None):
+        if self.metrics_dir is not None:
+            self._publisher = asyncio.ensure_future(self._publish_metrics())
+
+    async def cleanup(self, app=None):
+        if self._publisher is not None:
+            self._publisher.cancel()
         await self.xfrm.close()
+        if self.promql is not None:
+            await self.promql.close()
 
     async def hello(self, request):
         return web.Response(text="Alive and kicking")
 
+    async def server_metrics(self, request):
+        others = metrics.read_snapshots(self.metrics_dir, self.worker) if self.metrics_dir else ()
+        return web.Response(text=metrics.render(others), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
     async def nodeinfo(self, request):
         result = await self.xfrm.node_info()
         return _json(result)
@@ -105,8 +234,7 @@ class AE5K8SHandler(object):
     async def podinfo_get_path(self, request):
         return _json(await self._podinfo(request.match_info["id"]))
 
-    async def podlog(self, request):
-        id = request.match_info["id"]
+    def _log_options(self, request):
         if "container" in request.query:
             container = ",".join(v for k, v in request.query.items() if k == "container")
         else:
@@ -119,11 +247,103 @@ class AE5K8SHandler(object):
             follow = value != "false"
         else:
             follow = False
+        since = request.query.get("since")
+        if since is not None:
+            since = _parse_time("since", since)
+        tail = request.query.get("tail")
+        if tail is not None:
+            if not tail.isdigit():
+                raise web.HTTPUnprocessableEntity(reason=f"Invalid parameter: tail={tail}")
+            tail = int(tail)
+        return {"container": container, "follow": follow, "since": since, "tail": tail}
+
+    async def podlog(self, request):
+        id = request.match_info["id"]
+        options = self._log_options(request)
+        try:
+            await self.xfrm.pod_log(id, stream=WebStream(request), **options)
+        except (KeyError, ValueError) as exc:
+            raise web.HTTPUnprocessableEntity(reason=str(exc))
+
+    async def podlogs(self, request):
+        ids = request.query.getall("id", [])
+        if not ids:
+            raise web.HTTPUnprocessableEntity(reason="Must supply at least one ID.")
+        options = self._log_options(request)
+        try:
+            await self.xfrm.pod_logs(ids, stream=WebStream(request), **options)
+        except (KeyError, ValueError) as exc:
+            raise web.HTTPUnprocessableEntity(reason=str(exc))
+
+    async def podlog_search(self, request):
+        id = request.match_info["id"]
+        valid = ("pattern", "container", "follow", "since", "until", "context", "max_count", "timestamps")
+        invalid_keys = set(k for k in request.query if k not in valid)
+        if invalid_keys:
+            raise web.HTTPUnprocessableEntity(reason=f'Invalid parameter: {", ".join(sorted(invalid_keys))}')
+        pattern = request.query.get("pattern")
+        if not pattern:
+            raise web.HTTPUnprocessableEntity(reason="Must supply a search pattern.")
+        try:
+            re.compile(pattern)
+        except re.error as exc:
+            raise web.HTTPUnprocessableEntity(reason=f"Invalid pattern: {exc}")
+        options = self._log_options(request)
+        for key in ("context", "max_count"):
+            value = request.query.get(key)
+            if value is not None and not value.isdigit():
+                raise web.HTTPUnprocessableEntity(reason=f"Invalid parameter: {key}={value}")
+            options[key] = None if value is None else int(value)
+        options["context"] = options["context"] or 0
+        if "until" in request.query:
+            options["until"] = _parse_time("until", request.query["until"], absolute=True)
+        options["timestamps"] = request.query.get("timestamps", "false") not in ("false", "0")
+        del options["tail"]
         try:
-            await self.xfrm.pod_log(id, container, follow=follow, stream=WebStream(request))
+            await self.xfrm.pod_log_search(id, pattern, stream=WebStream(request), **options)
         except (KeyError, ValueError) as exc:
             raise web.HTTPUnprocessableEntity(reason=str(exc))
 
+    async def podwatch(self, request):
+        """Stream pod status changes as Server-Sent Events."""
+        ids = request.query.getall("id", [])
+        if not ids:
+            raise web.HTTPUnprocessableEntity(reason="Must supply at least one ID.")
+        try:
+            _watch_selectors(ids)
+        except ValueError as exc:
+            raise web.HTTPUnprocessableEntity(reason=str(exc))
+        headers = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        response = web.StreamResponse(headers=headers)
+        await response.prepare(request)
+        stream = WebStream(request)
+        # The events pass through a queue so that waiting for the next one
+        # can time out, for a keepalive, without cancelling the watch itself
+        queue = asyncio.Queue(1)
+
+        async def _pump():
+            try:
+                async for event in self.xfrm.watch_pods(ids):
+                    await queue.put(event)
+            except Exception as exc:
+                await queue.put({"type": "ERROR", "message": str(exc)})
+
+        task = asyncio.ensure_future(_pump())
+        try:
+            while not stream.closing():
+                try:
+                    event = await asyncio.wait_for(queue.get(), WATCH_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                await response.write(b"event: " + event["type"].lower().encode() + b"\ndata: " + _dumps(event) + b"\n\n")
+                if event["type"] == "ERROR":
+                    break
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return response
+
     async def promql_status(self, request):
         if self.promql is None:
             raise web.HTTPMethodNotAllowed(reason="AE5 instance does not expose PromQL service.")
@@ -133,28 +353,103 @@ class AE5K8SHandler(object):
         await self.promql_status(request)
         if not ("query" in request.query or ("id" in request.query and "metric" in request.query)):
             raise web.HTTPUnprocessableEntity(reason="Must supply an ID and metric or an explicit query.")
-        valid = ("id", "query", "metric", "start", "end", "step", "samples", "period")
+        valid = ("id", "query", "metric", "start", "end", "step", "samples", "period", "downsample", "points")
         invalid_keys = set(k for k in request.query if k not in valid)
         if invalid_keys:
             query = urlencode(request.query)
             raise web.HTTPUnprocessableEntity(reason=f"Invalid query: {query}")
-
-        query = dict(request.query)
-        pod_id = query.pop("id", None)
-        if "start" in query:
-            start = unquote(query["start"]).replace("Z", "")
-            query["start"] = datetime.datetime.fromisoformat(start)
-        if "end" in query:
-            end = unquote(query["end"]).replace("Z", "")
-            query["end"] = datetime.datetime.fromisoformat(end)
-        resp = await self.promql.query_range(pod_id, **query)
+        if request.query.get("downsample", "lttb") not in DOWNSAMPLERS:
+            options = ", ".join(DOWNSAMPLERS)
+            raise web.HTTPUnprocessableEntity(reason=f"Downsampling method must be one of: {options}")
+
+        query = {k: v for k, v in request.query.items() if k not in ("id", "metric")}
+        pod_ids = request.query.getall("id", [])
+        metrics = request.query.getall("metric", [])
+        invalid = [m for m in metrics if not _METRIC_NAME.fullmatch(m)]
+        if invalid:
+            raise web.HTTPBadRequest(reason=f"Invalid metric name: {invalid[0]}")
+        for key in ("points", "samples"):
+            if key in query:
+                try:
+                    query[key] = int(query[key])
+                    if query[key] < 1:
+                        raise ValueError
+                except ValueError:
+                    raise web.HTTPBadRequest(reason=f"The {key} parameter must be a positive integer.")
+        for key in ("start", "end"):
+            if key in query:
+                try:
+                    value = datetime.datetime.fromisoformat(unquote(query[key]).replace("Z", "+00:00"))
+                except ValueError:
+                    raise web.HTTPBadRequest(reason=f"The {key} parameter must be an ISO 8601 time.")
+                # Times without an offset are UTC; the transformer compares them with utcnow()
+                if value.tzinfo is not None:
+                    value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                query[key] = value
+        resp = await self.promql.query_range(pod_ids, metric=metrics, **query)
         if resp["status"] == "success":
             result = resp["data"]["result"]
+            if "query" not in query and (len(pod_ids) > 1 or len(metrics) > 1):
+                return _json(_series_by_id(result, pod_ids, metrics))
             return _json(result[0]["values"] if len(result) else [])
         raise web.HTTPUnprocessableEntity(reason=f'Prometheus query returned status {resp["status"]}.')
 
 
-def main(url=None, token=None, port=None, promql_port=None):
+def make_app(url, token, promql_url=None, executor=None, metrics_dir=None, worker=None):
+    app = web.Application(middlewares=[metrics_middleware, conditional_middleware])
+    handler = AE5K8SHandler(url, token, promql_url, executor, metrics_dir, worker)
+    app.add_routes(
+        [
+            web.get("/", handler.hello),
+            web.get("/__status__", handler.hello),
+            web.get("/__metrics__", handler.server_metrics),
+            web.get("/nodes", handler.nodeinfo),
+            web.get("/pods", handler.podinfo_get_query),
+            web.post("/pods", handler.podinfo_post),
+            web.get("/pods/watch", handler.podwatch),
+            web.get("/pod/{id}", handler.podinfo_get_path),
+            web.get("/promql/", handler.promql_status),
+            web.get("/promql/__status__", handler.promql_status),
+            web.get("/promql/query_range", handler.query_range),
+            web.get("/pod/{id}/log", handler.podlog),
+            web.get("/pod/{id}/log/search", handler.podlog_search),
+            web.get("/pods/log", handler.podlogs),
+        ]
+    )
+    app.on_startup.append(handler.startup)
+    app.on_cleanup.append(handler.cleanup)
+    return app
+
+
+def _install_uvloop(mode):
+    if mode.lower() in ("0", "false", "no", "off"):
+        return False
+    if uvloop is None:
+        if mode.lower() != "auto":
+            raise RuntimeError("uvloop was requested but is not installed")
+        return False
+    uvloop.install()
+    return True
+
+
+def _serve(url, token, promql_url, port, reuse_port, processes, loop_mode, worker=None, metrics_dir=None):
+    """Run a single server process. Each process creates its own event
+    loop, upstream sessions and executor, so this may be called in a
+    freshly forked worker. Its metrics then carry a worker label, and
+    are shared with the other workers through metrics_dir."""
+    if worker is not None:
+        metrics.REGISTRY.labels["worker"] = str(worker)
+    _install_uvloop(loop_mode)
+    executor = ProcessPoolExecutor(processes) if processes else None
+    app = make_app(url, token, promql_url, executor, metrics_dir, worker)
+    try:
+        web.run_app(app, port=port, reuse_port=reuse_port)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main(url=None, token=None, port=None, promql_port=None, workers=None, processes=None):
     url = url or os.environ.get("AE5_K8S_URL", DEFAULT_K8S_URL)
     if token is None:
         token = os.environ.get("AE5_K8S_TOKEN")
@@ -175,24 +470,39 @@ def main(url=None, token=None, port=None, promql_port=None):
     except Exception:
         promql_url = None
 
-    app = web.Application()
-    handler = AE5K8SHandler(url, token, promql_url)
-    app.add_routes(
-        [
-            web.get("/", handler.hello),
-            web.get("/__status__", handler.hello),
-            web.get("/nodes", handler.nodeinfo),
-            web.get("/pods", handler.podinfo_get_query),
-            web.post("/pods", handler.podinfo_post),
-            web.get("/pod/{id}", handler.podinfo_get_path),
-            web.get("/promql/", handler.promql_status),
-            web.get("/promql/__status__", handler.promql_status),
-            web.get("/promql/query_range", handler.query_range),
-            web.get("/pod/{id}/log", handler.podlog),
-        ]
-    )
-    port = port or int(os.environ.get("AE5_K8S_PORT") or "8086")
-    web.run_app(app, port=port or K8S_ENDPOINT_PORT)
+    port = port or K8S_ENDPOINT_PORT
+    workers = K8S_WORKERS if workers is None else workers
+    processes = K8S_PROCESSES if processes is None else processes
+    if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        print("SO_REUSEPORT is not supported on this platform; using a single worker")
+        workers = 1
+    if workers <= 1:
+        _serve(url, token, promql_url, port, False, processes, K8S_UVLOOP)
+        return
+
+    # Every worker binds the same port with SO_REUSEPORT, and the kernel
+    # distributes incoming connections among them
+    metrics_dir = tempfile.mkdtemp(prefix="ae5-k8s-metrics-")
+    args = (url, token, promql_url, port, True, processes, K8S_UVLOOP)
+    procs = [multiprocessing.Process(target=_serve, args=args + (worker, metrics_dir)) for worker in range(workers)]
+    for proc in procs:
+        proc.start()
+
+    def _terminate(signum, frame):
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        _terminate(signal.SIGINT, None)
+        for proc in procs:
+            proc.join()
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
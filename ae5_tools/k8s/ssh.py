@@ -1,7 +1,13 @@
 import atexit
+import os
 import socket
 import subprocess
 
+# OpenSSH for Windows does not support connection sharing
+USE_CONTROL_MASTER = os.name != "nt" and os.environ.get("AE5_K8S_SSH_CONTROL_MASTER", "1") != "0"
+# Seconds that an idle shared SSH connection is kept open
+CONTROL_PERSIST = int(os.environ.get("AE5_K8S_SSH_CONTROL_PERSIST") or "600")
+
 
 def register_cleanup(proc):
     def cleanup():
@@ -30,6 +36,7 @@ def launch_background(cmd, waitfor, what, retries=1):
         for line in proc.stdout:
             stdout += line
             if line.startswith(waitfor):
+                proc.banner = line.strip()
                 register_cleanup(proc)
                 return proc
         stderr = proc.stderr.read()
@@ -38,12 +45,31 @@ def launch_background(cmd, waitfor, what, retries=1):
     raise_error(stdout, stderr, proc.returncode, cmd, f"Could not {what}")
 
 
+def state_dir():
+    """The directory for the SSH control sockets and k8s daemon state."""
+    from ..config import config
+
+    path = os.path.join(config._path, "k8s")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def ssh_options():
+    """Options that share a single SSH connection to the master node
+    among all of the commands sent to it, including across processes,
+    so that only the first command pays for the SSH handshake."""
+    options = ["-o", "StrictHostKeyChecking=no"]
+    if USE_CONTROL_MASTER:
+        control_path = os.path.join(state_dir(), "ssh-%C")
+        options.extend(["-o", "ControlMaster=auto", "-o", f"ControlPath={control_path}", "-o", f"ControlPersist={CONTROL_PERSIST}"])
+    return options
+
+
 def find_remote_port(hostname, username):
     # https://stackoverflow.com/questions/2838244/get-open-tcp-port-in-python/2838309#2838309
     cmd = [
         "ssh",
-        "-o",
-        "StrictHostKeyChecking=no",
+        *ssh_options(),
         f"{username}@{hostname}",
         "python",
         "-c",
@@ -75,22 +101,43 @@ def find_local_port():
     return local_port
 
 
-def tunneled_k8s_url(hostname, username):
-    remote_port = find_remote_port(hostname, username)
-    local_port = find_local_port()
-    cmd = [
-        "ssh",
-        "-o",
-        "StrictHostKeyChecking=no",
-        "-t",
-        "-t",
-        "-L",
-        f"{local_port}:localhost:{remote_port}",
-        f"{username}@{hostname}",
-        "kubectl",
-        "proxy",
-        "--disable-filter",
-        f"--port={remote_port}",
-    ]
+def close_tunnel(proc):
+    """Stop a tunnel created by tunneled_k8s_url, releasing its local port."""
+    if proc.returncode is None:
+        proc.terminate()
+        proc.communicate()
+    forward = getattr(proc, "forward", None)
+    if forward is not None:
+        forward_port(*forward, cancel=True)
+
+
+def forward_port(hostname, username, local_port, remote_port, cancel=False):
+    """Add (or cancel) a port forward on the shared SSH connection."""
+    action = "cancel" if cancel else "forward"
+    cmd = ["ssh", *ssh_options(), "-O", action, "-L", f"{local_port}:localhost:{remote_port}", f"{username}@{hostname}"]
+    proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0 and not cancel:
+        raise_error(proc.stdout, proc.stderr, proc.returncode, cmd, "Could not forward k8s proxy port")
+
+
+def tunneled_k8s_url(hostname, username, local_port=None):
+    local_port = local_port or find_local_port()
+    if not USE_CONTROL_MASTER:
+        remote_port = find_remote_port(hostname, username)
+        cmd = ["ssh", *ssh_options(), "-t", "-t", "-L", f"{local_port}:localhost:{remote_port}", f"{username}@{hostname}"]
+        cmd.extend(["kubectl", "proxy", "--disable-filter", f"--port={remote_port}"])
+        proc = launch_background(cmd, "Starting to serve", "establish k8s proxy", retries=3)
+        return proc, f"http://localhost:{local_port}"
+    # With a shared connection, kubectl may choose its own port, which is
+    # then forwarded, saving the round trip needed to find a free port
+    cmd = ["ssh", *ssh_options(), "-t", "-t", f"{username}@{hostname}", "kubectl", "proxy", "--disable-filter", "--port=0"]
     proc = launch_background(cmd, "Starting to serve", "establish k8s proxy", retries=3)
+    remote_port = int(proc.banner.rsplit(":", 1)[-1])
+    try:
+        forward_port(hostname, username, local_port, remote_port)
+    except RuntimeError:
+        proc.terminate()
+        proc.communicate()
+        raise
+    proc.forward = (hostname, username, local_port, remote_port)
     return proc, f"http://localhost:{local_port}"
@@ -1,14 +1,50 @@
 import asyncio
+import calendar
+import copy
 import datetime
 import io
 import json
+import os
 import re
 import sys
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from urllib.parse import urlencode
 
 import aiohttp
 import dateutil.parser
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from . import metrics
+
+# Page size for cluster-wide list calls, so that neither the API server nor this
+# process ever has to materialize the complete pod list at once
+K8S_PAGE_LIMIT = int(os.environ.get("AE5_K8S_PAGE_LIMIT") or "500")
+# Number of times a list is restarted after its continue token expires
+K8S_LIST_RESTARTS = int(os.environ.get("AE5_K8S_LIST_RESTARTS") or "3")
+# Pods in a terminal phase never contribute to node usage
+ACTIVE_POD_SELECTOR = "status.phase!=Failed,status.phase!=Succeeded"
+# Maximum number of (query, step) results retained by the PromQL cache
+PROMQL_CACHE_SIZE = int(os.environ.get("AE5_PROMQL_CACHE_SIZE") or "256")
+# Maximum number of simultaneous connections to each upstream API
+K8S_POOL_LIMIT = int(os.environ.get("AE5_K8S_POOL_LIMIT") or "100")
+# Maximum number of log lines buffered between the pod readers and the client
+LOG_QUEUE_SIZE = int(os.environ.get("AE5_K8S_LOG_QUEUE_SIZE") or "1000")
+# Seconds between resource usage samples for watched pods
+WATCH_USAGE_INTERVAL = float(os.environ.get("AE5_K8S_WATCH_USAGE_INTERVAL") or "15")
+# Seconds within which an upstream request must complete, unless it is streamed
+K8S_REQUEST_TIMEOUT = float(os.environ.get("AE5_K8S_REQUEST_TIMEOUT") or "300")
+# Followed logs and watches are open indefinitely, so they have no overall timeout
+STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30)
+# Kubernetes closes a watch after this many seconds, and it is then resumed
+WATCH_TIMEOUT = 240
+
 
 def _or_raise(exc, return_exceptions):
     if return_exceptions:
@@ -100,16 +136,17 @@ def _k8s_pod_to_record(pRec):
         return [_k8s_pod_to_record(rec) for rec in pRec]
     npRec = {
         "name": pRec["metadata"]["name"],
-        "node": pRec["spec"]["nodeName"],
+        "node": pRec["spec"].get("nodeName"),
         "phase": pRec["status"]["phase"],
-        "since": max(c["lastTransitionTime"] or "" for c in pRec["status"]["conditions"]),
+        "since": max((c.get("lastTransitionTime") or "" for c in pRec["status"].get("conditions") or ()), default=""),
         "restarts": 0,
         "containers": {},
         "requests": {"mem": 0, "cpu": 0, "gpu": 0},
         "limits": {"mem": 0, "cpu": 0, "gpu": 0},
     }
     cMap = {}
-    for cRec in pRec["status"]["containerStatuses"]:
+    # Pending pods may not have been scheduled or had their containers created
+    for cRec in pRec["status"].get("containerStatuses") or ():
         name = cRec["name"]
         if name == "app":
             cid = "app"
@@ -128,7 +165,7 @@ def _k8s_pod_to_record(pRec):
         ncRec = {
             "name": name,
             "ready": cRec["ready"],
-            "since": cRec["state"].get("running", {}).get("startedAt"),
+            "since": (cRec.get("state") or {}).get("running", {}).get("startedAt"),
             "restarts": cRec["restartCount"],
         }
         npRec["restarts"] = max(npRec["restarts"], ncRec["restarts"])
@@ -137,8 +174,8 @@ def _k8s_pod_to_record(pRec):
         dst = npRec[which]
         default = float("inf") if which == "limits" else 0
         for cRec in pRec["spec"]["containers"]:
-            ncRec = cMap[cRec["name"]]
-            src = ncRec[which] = cRec["resources"][which]
+            ncRec = cMap.get(cRec["name"], {})
+            src = ncRec[which] = (cRec.get("resources") or {}).get(which) or {}
             for key, value in dst.items():
                 skey = FIELD_RENAMES.get(key, key)
                 dst[key] = value + _to_float(src.get(skey, src.get(key, default)))
@@ -155,8 +192,10 @@ def _pod_merge_metrics(pRec, mRec):
     dst = pRec["usage"] = {"mem": 0, "cpu": 0, "gpu": 0}
     for mcRec in mRec.get("containers", ()):
         cRec = cMap.get(mcRec["name"])
-        src = cRec["usage"] = mcRec["usage"]
-        src["gpu"] = cRec["requests"]["nvidia.com/gpu"]
+        if cRec is None:
+            continue
+        src = cRec["usage"] = dict(mcRec["usage"])
+        src["gpu"] = cRec.get("requests", {}).get("nvidia.com/gpu", "0")
         for key, value in dst.items():
             skey = FIELD_RENAMES.get(key, key)
             dst[key] = value + _to_float(src.get(skey, src.get(key, "0")))
@@ -168,6 +207,145 @@ def _pod_merge_metrics(pRec, mRec):
         dst[key] = _to_text(value)
 
 
+def _pod_ae5_id(pod):
+    labels = pod["metadata"].get("labels") or {}
+    if "anaconda-session-id" in labels:
+        return "a1-" + labels["anaconda-session-id"]
+    if "anaconda-app-id" in labels:
+        return "a2-" + labels["anaconda-app-id"]
+    job = labels.get("job-name", "")
+    if job.startswith("anaconda-job-"):
+        return "a2-" + job[len("anaconda-job-") :]
+
+
+def _watch_selectors(ids):
+    """Build the label selectors that match the pods for a list of AE5
+    IDs. Selectors cannot be combined with OR, so one is needed for each
+    of the labels that identify sessions, deployments and job runs."""
+    slugs = {"anaconda-session-id": [], "anaconda-app-id": [], "job-name": []}
+    for id in ids:
+        if not re.match(r"[a-f0-9]{2}-[a-f0-9]{32}", id) or not id.startswith(("a1", "a2")):
+            raise ValueError(f"Invalid ID: {id}")
+        prefix, slug = id.split("-", 1)
+        if prefix == "a1":
+            slugs["anaconda-session-id"].append(slug)
+        else:
+            slugs["anaconda-app-id"].append(slug)
+            slugs["job-name"].append(f"anaconda-job-{slug}")
+    return [f'{key} in ({",".join(values)})' for key, values in slugs.items() if values]
+
+
+def _pod_state(rec):
+    ready = all(c["ready"] for c in rec["containers"].values())
+    return rec["phase"], ready, rec["restarts"], tuple(rec.get("usage", {}).items())
+
+
+def _reduce_pod(pod):
+    # Keep only the fields node_info needs from a full pod record
+    return {
+        "name": pod["metadata"]["name"],
+        "node": pod["spec"].get("nodeName"),
+        "phase": pod["status"].get("phase"),
+        "resources": [c.get("resources") or {} for c in pod["spec"]["containers"]],
+    }
+
+
+def _reduce_pod_metrics(pod):
+    return {
+        "name": pod["metadata"]["name"],
+        "window": pod.get("window"),
+        "timestamp": pod.get("timestamp"),
+        "usage": [c.get("usage") or {} for c in pod.get("containers") or ()],
+    }
+
+
+def _aggregate_nodes(nodes, pods, pod_metrics):
+    """Summarize the resources requested by and used by the pods on each
+    node. The inputs are the raw node list and the reduced pod and pod
+    metrics lists; this is pure so that it may run in a process pool."""
+    nodeMap = {}
+    nodeList = []
+    subsets = ("total", "sessions", "deployments", "middleware", "system")
+    whiches = ("requests", "limits", "usage")
+    for rec in nodes:
+        nodeRec = {
+            "name": rec["metadata"]["name"],
+            "role": rec["metadata"]["labels"]["role"],
+            "capacity": {
+                "pods": rec["status"]["allocatable"]["pods"],
+                "mem": _to_text2(rec["status"]["allocatable"]["memory"]),
+                "cpu": rec["status"]["allocatable"]["cpu"],
+                "gpu": rec["status"]["allocatable"].get("nvidia.com/gpu", "0"),
+            },
+            "ready": any(c["type"] == "Ready" and c["status"] == "True" for c in rec["status"]["conditions"]),
+            "conditions": [c["type"] for c in rec["status"]["conditions"] if c["type"] != "Ready" and c["status"] == "True"],
+            "timestamp": None,
+            "window": None,
+        }
+        for subset in subsets:
+            srec = nodeRec[subset] = {"pods": 0, "pending": 0}
+            for which in whiches:
+                srec[which] = {"mem": 0, "cpu": 0, "gpu": 0}
+        nodeMap[nodeRec["name"]] = nodeRec
+        nodeList.append(nodeRec)
+
+    podMap = {}
+    for pod in pods:
+        nodeName = pod["node"]
+        phase = pod["phase"]
+        if phase in ("Failed", "Succeeded") or nodeName not in nodeMap:
+            continue
+        pfld = "pending" if phase == "Pending" else "pods"
+        podName = pod["name"]
+        if podName.startswith("anaconda-session"):
+            t_sub = "sessions"
+        elif podName.startswith("anaconda-app"):
+            t_sub = "deployments"
+        elif podName.startswith("anaconda-"):
+            t_sub = "middleware"
+        else:
+            t_sub = "system"
+        nodeRec = nodeMap[nodeName]
+        podMap[podName] = [nodeRec, t_sub]
+        for subset in ("total", t_sub):
+            subRec = nodeRec[subset]
+            subRec[pfld] += 1
+            for resources in pod["resources"]:
+                for which in ("requests", "limits"):
+                    src = resources.get(which, {})
+                    dst = subRec[which]
+                    for key, value in dst.items():
+                        skey = FIELD_RENAMES.get(key, key)
+                        default = "inf" if which == "limits" and key != "gpu" else "0"
+                        dst[key] = value + _to_float(src.get(skey, src.get(key, default)))
+            subRec["usage"]["gpu"] = subRec["requests"]["gpu"]
+
+    for pod in pod_metrics:
+        podName = pod["name"]
+        if podName in podMap:
+            nodeRec, t_sub = podMap[podName]
+            if nodeRec["window"] is None:
+                nodeRec["window"] = pod["window"]
+            if nodeRec["timestamp"] is None:
+                nodeRec["timestamp"] = pod["timestamp"]
+            for subset in ("total", t_sub):
+                subRec = nodeRec[subset]
+                dst = subRec["usage"]
+                for uRec in pod["usage"]:
+                    for key, value in dst.items():
+                        skey = FIELD_RENAMES.get(key, key)
+                        dst[key] += _to_float(uRec.get(skey, uRec.get(key, "0")))
+
+    for nodeRec in nodeList:
+        for subset in subsets:
+            for which in whiches:
+                dst = nodeRec[subset][which]
+                for key, value in dst.items():
+                    dst[key] = _to_text(value)
+
+    return nodeList
+
+
 _period_regex = re.compile(r"((?P<weeks>\d+?)w)?((?P<days>\d+?)d)?((?P<hours>\d+?)h)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?")
 
 
@@ -183,6 +361,188 @@ def parse_timedelta(time_str):
     return datetime.timedelta(**time_params)
 
 
+def _to_seconds(step):
+    try:
+        return int(float(step))
+    except ValueError:
+        return int(parse_timedelta(step).total_seconds())
+
+
+def _to_epoch(value):
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return int(float(value))
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _promql_regex(values):
+    # Match each value literally, within a single-quoted PromQL string
+    values = [re.escape(v).replace("\\", "\\\\").replace("'", "\\'") for v in values]
+    return values[0] if len(values) == 1 else "(" + "|".join(values) + ")"
+
+
+def _promql_query(pod_ids, metrics):
+    pod_ids, metrics = _as_list(pod_ids), _as_list(metrics)
+    selector = f"container_name='app',pod_name=~'anaconda-app-{_promql_regex(pod_ids)}-.*'"
+    if len(metrics) == 1:
+        return f"{metrics[0]}{{{selector}}}"
+    return f"{{__name__=~'{_promql_regex(metrics)}',{selector}}}"
+
+
+def _series_key(metric):
+    return tuple(sorted(metric.items()))
+
+
+def _series_by_id(result, pod_ids, metrics):
+    """Split the series of a combined query into a nested dictionary
+    of sample lists, keyed first by pod ID and then by metric name.
+    Series from successive pods of the same ID are concatenated."""
+    output = {}
+    for pod_id in pod_ids:
+        output[pod_id] = {}
+        for metric in metrics:
+            values = []
+            for rec in result:
+                labels = rec["metric"]
+                if len(metrics) > 1 and labels.get("__name__") != metric:
+                    continue
+                if labels.get("pod_name", "").startswith(f"anaconda-app-{pod_id}-"):
+                    values.extend(rec["values"])
+            output[pod_id][metric] = sorted(values, key=lambda v: v[0])
+    return output
+
+
+def lttb(values, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of [timestamp, value] pairs.
+    The first and last samples are always retained."""
+    if threshold >= len(values) or threshold < 3:
+        return values
+    data = [(float(t), float(v)) for t, v in values]
+    result = [values[0]]
+    every = (len(values) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = int(i * every) + 1, int((i + 1) * every) + 1
+        nlo, nhi = hi, min(int((i + 2) * every) + 1, len(values))
+        bucket = data[nlo:nhi] or data[-1:]
+        avg_t = sum(t for t, _ in bucket) / len(bucket)
+        avg_v = sum(v for _, v in bucket) / len(bucket)
+        a_t, a_v = data[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            t, v = data[j]
+            area = abs((a_t - avg_t) * (v - a_v) - (a_t - t) * (avg_v - a_v))
+            if area > best_area:
+                best, best_area = j, area
+        result.append(values[best])
+        a = best
+    result.append(values[-1])
+    return result
+
+
+def minmax(values, threshold):
+    """Min/max downsampling of [timestamp, value] pairs: each of threshold/2
+    buckets contributes its smallest and largest samples, in time order."""
+    nbuckets = threshold // 2
+    if threshold >= len(values) or nbuckets < 1:
+        return values
+    result = []
+    every = len(values) / nbuckets
+    for i in range(nbuckets):
+        bucket = values[int(i * every) : int((i + 1) * every)]
+        if not bucket:
+            continue
+        lo = min(range(len(bucket)), key=lambda j: float(bucket[j][1]))
+        hi = max(range(len(bucket)), key=lambda j: float(bucket[j][1]))
+        result.extend(bucket[j] for j in sorted({lo, hi}))
+    return result
+
+
+DOWNSAMPLERS = {"lttb": lttb, "minmax": minmax}
+
+
+def _downsample(result, method, points):
+    func = DOWNSAMPLERS[method]
+    for rec in result:
+        rec["values"] = func(rec["values"], points)
+    return result
+
+
+async def _iter_lines(content):
+    """Split a response body into lines as it arrives. Unlike iterating
+    over the StreamReader directly, there is no limit on line length."""
+    partial = b""
+    async for data, eoc in content.iter_chunks():
+        lines = (partial + data).splitlines(keepends=True)
+        partial = lines.pop() if lines and not lines[-1].endswith(b"\n") else b""
+        for line in lines:
+            yield line
+    if partial:
+        yield partial + b"\n"
+
+
+def _to_rfc3339(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class LogFilter(object):
+    """Select the lines of a log that match a regular expression, with
+    grep-style context lines and an optional end time. The lines must
+    be prefixed with the RFC 3339 timestamps that Kubernetes adds when
+    the log is requested with timestamps=true."""
+
+    def __init__(self, pattern, context=0, until=None, timestamps=False, max_count=None):
+        self.regex = re.compile(pattern.encode() if isinstance(pattern, str) else pattern)
+        self.context = context
+        # Timestamps in this format may be compared as strings
+        self.until = None if until is None else _to_rfc3339(until)[:19]
+        self.timestamps = timestamps
+        self.max_count = max_count
+        self.count = 0
+        self.done = False
+        self._before = deque(maxlen=context or None)
+        self._after = 0
+        self._index = 0
+        self._last = None
+
+    def feed(self, line):
+        """Consume one line and return the list of lines to output."""
+        if self.max_count is not None and self.count >= self.max_count and not self._after:
+            self.done = True
+        stamp, _, text = line.partition(b" ")
+        if self.until is not None and stamp[:19].decode(errors="replace") > self.until:
+            self.done = True
+        if self.done:
+            return []
+        index, self._index = self._index, self._index + 1
+        line = line if self.timestamps else text
+        if self.regex.search(text):
+            output = []
+            if self.context and self._last is not None and index - len(self._before) > self._last + 1:
+                output.append(b"--\n")
+            output.extend(self._before)
+            output.append(line)
+            self._before.clear()
+            self._after = self.context
+            self._last = index
+            self.count += 1
+            return output
+        if self._after:
+            self._after -= 1
+            self._last = index
+            return [line]
+        if self.context:
+            self._before.append(line)
+        return []
+
+
 class FileStream(object):
     def __init__(self, stream):
         self.stream = sys.stdout if stream is None else stream
@@ -201,7 +561,9 @@ class FileStream(object):
 
 
 class AE5BaseTransformer(object):
-    def __init__(self, url=None, token=None):
+    _service = None
+
+    def __init__(self, url=None, token=None, executor=None, pool_limit=None):
         headers = {"accept": "application/json"}
         if token:
             headers["authorization"] = f"Bearer {token}"
@@ -209,10 +571,23 @@ class AE5BaseTransformer(object):
         self._session = None
         self._url = url.rstrip("/")
         self._has_metrics = None
+        self._executor = executor
+        self._pool_limit = K8S_POOL_LIMIT if pool_limit is None else pool_limit
 
     async def connect(self):
         if self._session is None:
-            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
+            connector = aiohttp.TCPConnector(verify_ssl=False, limit=self._pool_limit)
+            timeout = aiohttp.ClientTimeout(total=K8S_REQUEST_TIMEOUT, sock_connect=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def offload(self, func, *args):
+        """Call a CPU-bound function in the executor, if one was supplied,
+        so that it does not block the event loop. The function and its
+        arguments must be picklable if the executor is a process pool."""
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
 
     async def close(self):
         if self._session is not None:
@@ -224,12 +599,27 @@ class AE5BaseTransformer(object):
             loop = asyncio.get_event_loop()
             return loop.run_until_complete(self.close())
 
-    async def get(self, path, type="json", ok404=False):
+    @asynccontextmanager
+    async def _request(self, path, stream=False):
         await self.connect()
         if not path.startswith("/"):
             path = "/api/v1/" + path
-        url = self._url + path
-        async with self._session.get(url, headers=self._headers) as resp:
+        labels = {"service": self._service, "path": metrics.path_template(path)}
+        status = "error"
+        metrics.UPSTREAM_IN_FLIGHT.inc(service=self._service)
+        started = time.monotonic()
+        try:
+            kwargs = {"timeout": STREAM_TIMEOUT} if stream else {}
+            async with self._session.get(self._url + path, headers=self._headers, **kwargs) as resp:
+                status = resp.status
+                yield resp
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.dec(service=self._service)
+            metrics.UPSTREAM_REQUESTS.inc(status=status, **labels)
+            metrics.UPSTREAM_LATENCY.observe(time.monotonic() - started, **labels)
+
+    async def get(self, path, type="json", ok404=False):
+        async with self._request(path) as resp:
             if resp.status == 404 and ok404:
                 return
             resp.raise_for_status()
@@ -240,8 +630,76 @@ class AE5BaseTransformer(object):
             else:
                 return resp
 
+    async def list_items(self, path, reduce=None, **params):
+        """Iterate over the items of a Kubernetes list, following the
+        limit/continue pagination protocol. If ijson is available, each page
+        is parsed incrementally, so only one item is held in memory at a time.
+        The optional reduce function is applied to each item as it arrives.
+
+        A continue token expires after a few minutes, and the next page is
+        then refused with 410 Gone. If the error carries a new token, the
+        list continues from it; otherwise it starts again from the beginning,
+        skipping the items that were already returned."""
+        params.setdefault("limit", K8S_PAGE_LIMIT)
+        seen = set()
+        restarts = 0
+
+        def _emit(item):
+            uid = (item.get("metadata") or {}).get("uid")
+            if uid is not None:
+                if uid in seen:
+                    return False
+                seen.add(uid)
+            return True
+
+        while True:
+            token = None
+            async with self._request(f"{path}?{urlencode(params)}") as resp:
+                if resp.status == 410 and "continue" in params and restarts < K8S_LIST_RESTARTS:
+                    restarts += 1
+                    try:
+                        status = await resp.json(content_type=None)
+                    except ValueError:
+                        status = {}
+                    token = (status.get("metadata") or {}).get("continue")
+                    if token:
+                        params["continue"] = token
+                    else:
+                        del params["continue"]
+                    continue
+                resp.raise_for_status()
+                if ijson is None:
+                    data = await resp.json()
+                    token = (data.get("metadata") or {}).get("continue")
+                    for item in data.get("items") or ():
+                        if _emit(item):
+                            yield reduce(item) if reduce else item
+                    del data
+                else:
+                    builder = None
+                    async for prefix, event, value in ijson.parse_async(resp.content, use_float=True):
+                        if builder is not None:
+                            builder.event(event, value)
+                            if prefix == "items.item" and event == "end_map":
+                                if _emit(builder.value):
+                                    yield reduce(builder.value) if reduce else builder.value
+                                builder = None
+                        elif prefix == "items.item" and event == "start_map":
+                            builder = ijson.ObjectBuilder()
+                            builder.event(event, value)
+                        elif prefix == "metadata.continue":
+                            token = value
+            if not token:
+                break
+            params["continue"] = token
+
+    async def list_all(self, path, reduce=None, **params):
+        return [item async for item in self.list_items(path, reduce, **params)]
+
 
 class AE5K8STransformer(AE5BaseTransformer):
+    _service = "kubernetes"
+
     async def has_metrics(self):
         if self._has_metrics is None:
             result = await self.get("/apis/metrics.k8s.io/v1beta1", ok404=True)
@@ -281,10 +739,16 @@ class AE5K8STransformer(AE5BaseTransformer):
             headers["authorization"] = self._headers["authorization"]
         url = "{}{}?{}".format(self._url, path, urlencode(params, True))
         output = {}
-        async with self._session.ws_connect(url, headers=headers) as ws:
-            async for msg in ws:
-                if msg.type == aiohttp.WSMsgType.BINARY:
-                    output.setdefault(msg.data[0], []).append(msg.data[1:])
+        status = "error"
+        with metrics.EXEC_LATENCY.time():
+            try:
+                async with self._session.ws_connect(url, headers=headers) as ws:
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.BINARY:
+                            output.setdefault(msg.data[0], []).append(msg.data[1:])
+                status = "ok"
+            finally:
+                metrics.EXEC_SESSIONS.inc(status=status)
         output = {k: b"".join(v).decode("utf-8", errors="replace") for k, v in output.items()}
         if 3 in output:
             output[3] = json.loads(output[3])
@@ -326,17 +790,18 @@ class AE5K8STransformer(AE5BaseTransformer):
                 result["mtime"] = max(result.get("mtime") or "", line.split()[0])
         return result
 
+    async def _metrics_url(self, name):
+        if await self.has_metrics():
+            return f"/apis/metrics.k8s.io/v1beta1/namespaces/default/pods/{name}"
+        return f"namespaces/monitoring/services/heapster/proxy/apis/metrics/v1alpha1/namespaces/default/pods/{name}"
+
     async def pod_info(self, id, return_exceptions=False):
         if isinstance(id, list):
             return await asyncio.gather(*(self.pod_info(t) for t in id), return_exceptions=return_exceptions)
         nrec = await self._pod_info(id, return_exceptions=return_exceptions)
         if isinstance(nrec, Exception):
             return nrec
-        name = nrec["name"]
-        if await self.has_metrics():
-            url = f"/apis/metrics.k8s.io/v1beta1/namespaces/default/pods/{name}"
-        else:
-            url = f"namespaces/monitoring/services/heapster/proxy/apis/metrics/v1alpha1/namespaces/default/pods/{name}"
+        url = await self._metrics_url(nrec["name"])
         if id.startswith("a2-"):
             resp2, resp3 = await self.get(url, ok404=True), None
         else:
@@ -346,141 +811,324 @@ class AE5K8STransformer(AE5BaseTransformer):
             nrec["changes"] = resp3
         return nrec
 
-    async def pod_log(self, id, container=None, follow=False, stream=None):
+    async def _watch_selector(self, selector, queue):
+        """Place the events for the pods matching a label selector on the
+        queue. The pods are listed first, and then watched from the version
+        of that list; if the version expires, the pods are listed again."""
+        version = None
+        while True:
+            if version is None:
+                data = await self.get(f"namespaces/default/pods?{urlencode({'labelSelector': selector})}")
+                version = data["metadata"]["resourceVersion"]
+                for pod in data["items"]:
+                    await queue.put(("ADDED", pod))
+            params = {
+                "labelSelector": selector,
+                "watch": "true",
+                "resourceVersion": version,
+                "allowWatchBookmarks": "true",
+                "timeoutSeconds": WATCH_TIMEOUT,
+            }
+            async with self._request(f"namespaces/default/pods?{urlencode(params)}", stream=True) as resp:
+                resp.raise_for_status()
+                async for line in _iter_lines(resp.content):
+                    event = json.loads(line)
+                    if event["type"] == "ERROR":
+                        # Usually 410 Gone, when the version is too old to resume from
+                        version = None
+                        break
+                    version = event["object"]["metadata"].get("resourceVersion") or version
+                    if event["type"] != "BOOKMARK":
+                        await queue.put((event["type"], event["object"]))
+
+    async def _watch_usage(self, records, usage, queue, interval):
+        """Sample the resource usage of the watched pods, and place the
+        names of those whose usage has changed on the queue."""
+        while True:
+            await asyncio.sleep(interval)
+            names = list(records)
+            urls = [await self._metrics_url(name) for name in names]
+            results = await asyncio.gather(*(self.get(url, ok404=True) for url in urls))
+            for name, result in zip(names, results):
+                if result is not None and result != usage.get(name):
+                    usage[name] = result
+                    await queue.put(("USAGE", name))
+
+    async def watch_pods(self, ids, usage_interval=None):
+        """Yield an event whenever the phase, readiness, restart count or
+        resource usage of a pod for one of the AE5 IDs changes. Each event
+        is a dictionary with the type (ADDED, MODIFIED or DELETED), the AE5
+        ID, and the pod record, which is None for deleted pods. Changes in
+        status are pushed by Kubernetes watches; usage is sampled every
+        usage_interval seconds."""
+        selectors = _watch_selectors(ids)
+        queue = asyncio.Queue()
+        records, usage, states = {}, {}, {}
+        interval = WATCH_USAGE_INTERVAL if usage_interval is None else usage_interval
+
+        async def _forward(coro):
+            try:
+                await coro
+            except Exception as exc:
+                await queue.put(("ERROR", exc))
+
+        tasks = [asyncio.ensure_future(_forward(self._watch_selector(s, queue))) for s in selectors]
+        tasks.append(asyncio.ensure_future(_forward(self._watch_usage(records, usage, queue, interval))))
+        try:
+            while True:
+                kind, obj = await queue.get()
+                if kind == "ERROR":
+                    raise obj
+                if kind == "USAGE":
+                    name = obj
+                    if name not in records:
+                        continue
+                    id, rec = records[name]
+                else:
+                    name, id = obj["metadata"]["name"], _pod_ae5_id(obj)
+                    if kind == "DELETED":
+                        records.pop(name, None)
+                        usage.pop(name, None)
+                        if states.pop(name, None) is not None:
+                            yield {"type": "DELETED", "id": id, "name": name, "pod": None}
+                        continue
+                    rec = _k8s_pod_to_record(obj)
+                    records[name] = (id, rec)
+                _pod_merge_metrics(rec, usage.get(name))
+                state = _pod_state(rec)
+                previous = states.get(name)
+                if state == previous:
+                    continue
+                states[name] = state
+                yield {"type": "MODIFIED" if previous else "ADDED", "id": id, "name": name, "pod": copy.deepcopy(rec)}
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _log_path(self, id, container=None, follow=False, since=None, tail=None, timestamps=False):
         data = await self._pod_info(id)
         if not container:
             container = "editor" if id.startswith("a1-") else "app"
         if container not in data["containers"]:
             keys = ", ".join(sorted(data["containers"].keys()))
             raise KeyError(f"Container must be one of: {keys}")
-        pname = data["name"]
-        cname = data["containers"][container]["name"]
+        params = {"container": data["containers"][container]["name"], "follow": str(bool(follow)).lower()}
+        if isinstance(since, datetime.datetime):
+            params["sinceTime"] = _to_rfc3339(since)
+        elif since:
+            params["sinceSeconds"] = int(since)
+        if tail is not None:
+            params["tailLines"] = int(tail)
+        if timestamps:
+            params["timestamps"] = "true"
+        return f'namespaces/default/pods/{data["name"]}/log?{urlencode(params)}'
+
+    async def pod_log(self, id, container=None, follow=False, stream=None, since=None, tail=None):
+        path = await self._log_path(id, container, follow, since, tail)
         if follow and (stream is None or isinstance(stream, io.TextIOWrapper)):
             stream = FileStream(stream)
-        follow = str(bool(follow)).lower()
-        path = f"namespaces/default/pods/{pname}/log?container={cname}&follow={follow}"
-        ctype = "text" if stream is None else "content"
-        result = await self.get(path, type=ctype)
-        if ctype == "text":
-            return result
-        await stream.prepare(result)
-        async for data, eoc in result.content.iter_chunks():
-            if stream.closing():
-                await result.release()
-                break
-            await stream.write(data)
+        if stream is None:
+            return await self.get(path, type="text")
+        async with self._request(path, stream=True) as resp:
+            resp.raise_for_status()
+            await stream.prepare(resp)
+            async for data, eoc in resp.content.iter_chunks():
+                if stream.closing():
+                    break
+                await stream.write(data)
+        await stream.finish()
+
+    async def pod_log_search(
+        self,
+        id,
+        pattern,
+        container=None,
+        follow=False,
+        since=None,
+        until=None,
+        context=0,
+        max_count=None,
+        timestamps=False,
+        stream=None,
+    ):
+        """Filter the log of a pod as it is read, returning or streaming only
+        the lines that match the regular expression, and their context.
+        The upstream request is closed as soon as the end time or maximum
+        number of matches is reached."""
+        filter = LogFilter(pattern, context, until, timestamps, max_count)
+        path = await self._log_path(id, container, follow, since, timestamps=True)
+        output = []
+        async with self._request(path, stream=True) as resp:
+            resp.raise_for_status()
+            if stream is not None:
+                await stream.prepare(resp)
+            async for line in _iter_lines(resp.content):
+                lines = filter.feed(line)
+                if lines and stream is None:
+                    output.extend(lines)
+                elif lines:
+                    await stream.write(b"".join(lines))
+                if filter.done or (stream is not None and stream.closing()):
+                    break
+        if stream is None:
+            return b"".join(output).decode(errors="replace")
+        await stream.finish()
+
+    async def pod_logs(self, ids, container=None, follow=False, stream=None, since=None, tail=None, queue_size=None):
+        """Multiplex the logs of several pods onto a single stream, prefixing
+        each line with the ID of its pod. The lines pass through a bounded
+        queue: when the consumer falls behind, the readers block, and stop
+        reading from their upstream connections, instead of buffering.
+        A pod that cannot be found is reported with an error line in place
+        of its log, unless none of them can be found."""
+        paths = await asyncio.gather(*(self._log_path(id, container, follow, since, tail) for id in ids), return_exceptions=True)
+        if all(isinstance(path, Exception) for path in paths):
+            raise paths[0]
+        if stream is None or isinstance(stream, io.TextIOWrapper):
+            stream = FileStream(stream)
+        queue = asyncio.Queue(queue_size or LOG_QUEUE_SIZE)
+
+        async def _reader(id, path):
+            prefix = f"[{id}] ".encode()
+            if isinstance(path, Exception):
+                message = path.args[0] if isinstance(path, KeyError) and path.args else path
+                await queue.put(prefix + f"Error reading log: {message}\n".encode())
+                await queue.put(None)
+                return
+            try:
+                async with self._request(path, stream=True) as resp:
+                    resp.raise_for_status()
+                    async for line in _iter_lines(resp.content):
+                        await queue.put(prefix + line)
+            except aiohttp.ClientError as exc:
+                await queue.put(prefix + f"Error reading log: {exc}\n".encode())
+            await queue.put(None)
+
+        readers = [asyncio.ensure_future(_reader(id, path)) for id, path in zip(ids, paths)]
+        await stream.prepare(None)
+        try:
+            remaining = len(readers)
+            while remaining and not stream.closing():
+                # Send whatever lines are already waiting in a single write
+                lines = [await queue.get()]
+                while not queue.empty():
+                    lines.append(queue.get_nowait())
+                remaining -= lines.count(None)
+                data = b"".join(line for line in lines if line is not None)
+                if data:
+                    await stream.write(data)
+        finally:
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
         await stream.finish()
 
     async def node_info(self):
         resp1 = self.get("nodes")
-        resp2 = self.get("pods")
+        resp2 = self.list_all("pods", _reduce_pod, fieldSelector=ACTIVE_POD_SELECTOR)
         if await self.has_metrics():
             url = "/apis/metrics.k8s.io/v1beta1/pods"
         else:
             url = "namespaces/monitoring/services/heapster/proxy/apis/metrics/v1alpha1/pods"
-        resp3 = self.get(url)
+        resp3 = self.list_all(url, _reduce_pod_metrics)
         resp1, resp2, resp3 = await asyncio.gather(resp1, resp2, resp3)
-        resp1, resp2, resp3 = resp1["items"], resp2["items"], resp3["items"]
-
-        nodeMap = {}
-        nodeList = []
-        subsets = ("total", "sessions", "deployments", "middleware", "system")
-        whiches = ("requests", "limits", "usage")
-        for rec in resp1:
-            nodeRec = {
-                "name": rec["metadata"]["name"],
-                "role": rec["metadata"]["labels"]["role"],
-                "capacity": {
-                    "pods": rec["status"]["allocatable"]["pods"],
-                    "mem": _to_text2(rec["status"]["allocatable"]["memory"]),
-                    "cpu": rec["status"]["allocatable"]["cpu"],
-                    "gpu": rec["status"]["allocatable"].get("nvidia.com/gpu", "0"),
-                },
-                "ready": any(c["type"] == "Ready" and c["status"] == "True" for c in rec["status"]["conditions"]),
-                "conditions": [c["type"] for c in rec["status"]["conditions"] if c["type"] != "Ready" and c["status"] == "True"],
-                "timestamp": None,
-                "window": None,
-            }
-            for subset in subsets:
-                srec = nodeRec[subset] = {"pods": 0, "pending": 0}
-                for which in whiches:
-                    srec[which] = {"mem": 0, "cpu": 0, "gpu": 0}
-            nodeMap[nodeRec["name"]] = nodeRec
-            nodeList.append(nodeRec)
-
-        podMap = {}
-        for pod in resp2:
-            nodeName = pod["spec"]["nodeName"]
-            phase = pod["status"]["phase"]
-            if phase in ("Failed", "Succeeded") or nodeName not in nodeMap:
-                continue
-            pfld = "pending" if phase == "Pending" else "pods"
-            podName = pod["metadata"]["name"]
-            if podName.startswith("anaconda-session"):
-                t_sub = "sessions"
-            elif podName.startswith("anaconda-app"):
-                t_sub = "deployments"
-            elif podName.startswith("anaconda-"):
-                t_sub = "middleware"
-            else:
-                t_sub = "system"
-            nodeRec = nodeMap[nodeName]
-            podMap[podName] = [nodeRec, t_sub]
-            for subset in ("total", t_sub):
-                subRec = nodeRec[subset]
-                subRec[pfld] += 1
-                for container in pod["spec"]["containers"]:
-                    for which in ("requests", "limits"):
-                        src = container["resources"].get(which, {})
-                        dst = subRec[which]
-                        for key, value in dst.items():
-                            skey = FIELD_RENAMES.get(key, key)
-                            default = "inf" if which == "limits" and key != "gpu" else "0"
-                            dst[key] = value + _to_float(src.get(skey, src.get(key, default)))
-                subRec["usage"]["gpu"] = subRec["requests"]["gpu"]
-
-        for pod in resp3:
-            podName = pod["metadata"]["name"]
-            if podName in podMap:
-                nodeRec, t_sub = podMap[podName]
-                if nodeRec["window"] is None:
-                    nodeRec["window"] = pod["window"]
-                if nodeRec["timestamp"] is None:
-                    nodeRec["timestamp"] = pod["timestamp"]
-                for subset in ("total", t_sub):
-                    subRec = nodeRec[subset]
-                    dst = subRec["usage"]
-                    for container in pod["containers"]:
-                        uRec = container["usage"]
-                        for key, value in dst.items():
-                            skey = FIELD_RENAMES.get(key, key)
-                            dst[key] += _to_float(uRec.get(skey, uRec.get(key, "0")))
-
-        for nodeRec in nodeList:
-            for subset in subsets:
-                for which in whiches:
-                    dst = nodeRec[subset][which]
-                    for key, value in dst.items():
-                        dst[key] = _to_text(value)
-
-        return nodeList
+        return await self.offload(_aggregate_nodes, resp1["items"], resp2, resp3)
 
 
 class AE5PromQLTransformer(AE5BaseTransformer):
-    async def query_range(self, pod_id=None, query=None, metric=None, start=None, end=None, step=None, period=None, samples=None):
+    _service = "prometheus"
+
+    def __init__(self, url=None, token=None, cache_size=None, executor=None, pool_limit=None):
+        super(AE5PromQLTransformer, self).__init__(url, token, executor, pool_limit)
+        self._cache = OrderedDict()
+        self._cache_size = PROMQL_CACHE_SIZE if cache_size is None else cache_size
+        # (query, step) -> lock, held while a cache entry is read, extended and merged
+        self._locks = weakref.WeakValueDictionary()
+
+    async def _fetch_range(self, query, start, end, step):
+        params = {"query": query, "start": start, "end": end, "step": step}
+        return await self.get(f"query_range?{urlencode(params)}")
+
+    async def _cached_range(self, query, start, end, step):
+        """Perform a range query, reusing the cached result of an earlier query
+        with the same expression and step. Since the window is aligned to the
+        step, the cached samples remain valid, and only the tail from the last
+        cached sample onward needs to be retrieved from Prometheus."""
+        key = (query, step)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        # Concurrent identical queries would otherwise merge overlapping tails
+        async with lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry["start"] <= start <= entry["end"] <= end:
+                metrics.CACHE_LOOKUPS.inc(cache="promql", result="hit")
+                resp = await self._fetch_range(query, entry["end"], end, step)
+                if resp["status"] != "success":
+                    return resp
+                series = entry["series"]
+                for value in series.values():
+                    value["values"] = [v for v in value["values"] if start <= v[0] < entry["end"]]
+                for rec in resp["data"]["result"]:
+                    tkey = _series_key(rec["metric"])
+                    if tkey in series:
+                        series[tkey]["values"].extend(rec["values"])
+                    else:
+                        series[tkey] = rec
+                entry["start"], entry["end"] = start, end
+                self._cache.move_to_end(key)
+            else:
+                metrics.CACHE_LOOKUPS.inc(cache="promql", result="miss")
+                resp = await self._fetch_range(query, start, end, step)
+                if resp["status"] != "success":
+                    return resp
+                series = {_series_key(rec["metric"]): rec for rec in resp["data"]["result"]}
+                self._cache[key] = entry = {"start": start, "end": end, "series": series}
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+            result = [{"metric": rec["metric"], "values": [v for v in rec["values"] if v[0] <= end]} for rec in entry["series"].values()]
+            result = [rec for rec in result if rec["values"]]
+            return {"status": "success", "data": {"resultType": "matrix", "result": result}}
+
+    async def query_range(
+        self,
+        pod_id=None,
+        query=None,
+        metric=None,
+        start=None,
+        end=None,
+        step=None,
+        period=None,
+        samples=None,
+        downsample=None,
+        points=None,
+    ):
+        """Retrieve a range of samples from Prometheus.
+
+        Either an explicit query or a combination of pod IDs and metric names
+        may be given. Multiple IDs and/or metrics are combined into a single
+        query, and the resulting series can be separated with _series_by_id.
+        If downsample is "lttb" or "minmax", each series is reduced to
+        approximately the given number of points.
+        """
         if period is None:
             timedelta = datetime.timedelta(weeks=4)
         else:
             timedelta = parse_timedelta(period)
         end = end or datetime.datetime.utcnow()
         start = start or (end - timedelta)
-        end_timestamp = end.isoformat("T") + "Z"
-        start_timestamp = start.isoformat("T") + "Z"
         if step is None:
             samples = int(samples or 200)
             step = int(((end - start) / samples).total_seconds())
+        else:
+            step = _to_seconds(step)
+        step = max(1, step)
+        end = _to_epoch(end) // step * step
+        start = _to_epoch(start) // step * step
         if query is None:
-            regex = f"anaconda-app-{pod_id}-.*"
-            query = f"{metric}{{container_name='app',pod_name=~'{regex}'}}"
-        url = f"query_range?query={query}&start={start_timestamp}&end={end_timestamp}&step={step}"
-        return await self.get(url)
+            query = _promql_query(pod_id, metric)
+        resp = await self._cached_range(query, start, end, step)
+        if downsample and resp["status"] == "success":
+            resp["data"]["result"] = await self.offload(_downsample, resp["data"]["result"], downsample, int(points or 200))
+        return resp
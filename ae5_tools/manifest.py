@@ -0,0 +1,111 @@
+"""A record of the project directories uploaded from this machine, so that
+uploading an unchanged directory again can be skipped. For each directory
+and project name, the manifest holds the project ID, the revision created
+by the upload, and the size, mtime and SHA-256 of every file.
+
+This module also reads and writes the manifest of a project backup,
+which records the metadata, collaborators and revision archives of each
+project backed up, with their checksums."""
+
+import hashlib
+import json
+import os
+import threading
+
+from .archiver import scan_project
+from .config import config
+
+HASH_CHUNK_SIZE = 1024 * 1024
+BACKUP_MANIFEST = "backup.json"
+
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def hash_project(project_directory, previous=None):
+    """Return a dictionary mapping the relative path of each file in the
+    project to [size, mtime, sha256]. Files whose size and mtime match
+    those in previous, a dictionary of the same form, are not read again."""
+    previous = previous or {}
+    result = {}
+    for pfile in scan_project(project_directory):
+        old = previous.get(pfile.relpath)
+        if old is not None and old[0] == pfile.size and old[1] == pfile.mtime:
+            result[pfile.relpath] = old
+        elif os.path.islink(pfile.abspath):
+            result[pfile.relpath] = [pfile.size, pfile.mtime, "link:" + os.readlink(pfile.abspath)]
+        else:
+            result[pfile.relpath] = [pfile.size, pfile.mtime, sha256_file(pfile.abspath)]
+    return result
+
+
+def diff_files(old, new):
+    """Compare two results of hash_project by content, returning the lists
+    of added, modified and removed paths."""
+    return {
+        "added": sorted(k for k in new if k not in old),
+        "modified": sorted(k for k in new if k in old and old[k][2] != new[k][2]),
+        "removed": sorted(k for k in old if k not in new),
+    }
+
+
+class UploadManifest(object):
+    def __init__(self, hostname, username):
+        self._filename = os.path.join(config._path, "uploads", f"{username}@{hostname}.json")
+        self._data = None
+        # Bulk uploads record their results from several threads
+        self._lock = threading.RLock()
+
+    @property
+    def data(self):
+        if self._data is None:
+            try:
+                with open(self._filename, "r") as fp:
+                    self._data = json.load(fp)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    @staticmethod
+    def _key(project_directory, name):
+        return f"{name}@{os.path.abspath(project_directory)}"
+
+    def get(self, project_directory, name):
+        return self.data.get(self._key(project_directory, name))
+
+    def set(self, project_directory, name, project_id, revision, files):
+        with self._lock:
+            self.data[self._key(project_directory, name)] = {"project_id": project_id, "revision": revision, "files": files}
+            self.save()
+
+    def remove(self, project_directory, name):
+        with self._lock:
+            if self.data.pop(self._key(project_directory, name), None) is not None:
+                self.save()
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self._filename), mode=0o700, exist_ok=True)
+            with open(self._filename + ".tmp", "w") as fp:
+                json.dump(self.data, fp)
+            os.replace(self._filename + ".tmp", self._filename)
+
+
+def load_backup_manifest(directory):
+    try:
+        with open(os.path.join(directory, BACKUP_MANIFEST), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {"projects": {}}
+
+
+def save_backup_manifest(directory, data):
+    fname = os.path.join(directory, BACKUP_MANIFEST)
+    with open(fname + ".tmp", "w") as fp:
+        json.dump(data, fp, indent=2, default=str)
+    os.replace(fname + ".tmp", fname)
@@ -0,0 +1,108 @@
+"""Request bodies that are produced as they are sent, so that uploads
+use a bounded amount of memory regardless of their size."""
+
+import os
+import uuid
+
+# Size of the chunks read from files and archives while uploading
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+def _quote(value):
+    return str(value).replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def _file_length(fileobj):
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        pos = fileobj.tell()
+        end = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(pos)
+        return end - pos
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class MultipartEncoder(object):
+    """A multipart/form-data body that can be passed to requests as data.
+    Form fields are strings; files are (filename, source) pairs, where the
+    source is an open binary file, which is read in chunks, or an iterable
+    of bytes objects. If the length of every file can be determined, the
+    body is sent with a Content-Length; otherwise it is sent chunked.
+
+    Args:
+        fields: a dictionary of form field names and values.
+        files: a dictionary of form field names and (filename, source) pairs.
+        progress: if supplied, called with the number of bytes sent so far
+            and the total, or None if that is unknown.
+    """
+
+    def __init__(self, fields=None, files=None, progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.progress = progress
+        self._parts = []
+        for name, value in (fields or {}).items():
+            header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+            self._parts.append(header.encode() + str(value).encode() + b"\r\n")
+        for name, (filename, source) in (files or {}).items():
+            header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"; filename="{_quote(filename)}"\r\n\r\n'
+            self._parts.extend((header.encode(), source, b"\r\n"))
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+        lengths = [len(part) if isinstance(part, bytes) else _file_length(part) for part in self._parts]
+        # requests looks for this attribute to set the Content-Length
+        if None not in lengths:
+            self.len = sum(lengths)
+        self._total = getattr(self, "len", None)
+        self._sent = 0
+        self._chunks = self._generate()
+        # The unread portion of the current chunk is self._chunk[self._pos:]
+        self._chunk = b""
+        self._pos = 0
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _generate(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+            elif hasattr(part, "read"):
+                for chunk in iter(lambda: part.read(UPLOAD_CHUNK_SIZE), b""):
+                    yield chunk
+            else:
+                for chunk in part:
+                    if chunk:
+                        yield chunk
+
+    def _report(self, chunk):
+        self._sent += len(chunk)
+        if self.progress is not None and chunk:
+            self.progress(self._sent, self._total)
+        return chunk
+
+    def __iter__(self):
+        if self._pos < len(self._chunk):
+            chunk, self._chunk = self._chunk[self._pos :], b""
+            yield self._report(chunk)
+        for chunk in self._chunks:
+            if chunk:
+                yield self._report(chunk)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(self)
+        pieces = []
+        while size > 0:
+            if self._pos >= len(self._chunk):
+                self._chunk, self._pos = next(self._chunks, b""), 0
+                if not self._chunk:
+                    break
+            piece = self._chunk[self._pos : self._pos + size]
+            self._pos += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return self._report(b"".join(pieces))
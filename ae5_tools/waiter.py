@@ -0,0 +1,188 @@
+"""Waiting for many AE5 actions at once. Creating or uploading a project,
+or starting a session, returns a record whose "action" field is complete
+once its "done" or "error" flag is set. Rather than having each caller
+poll the activity of its project, the records are registered with an
+ActionWaiter, whose single thread polls the activity of every project
+with pending actions and resolves a future for each action.
+
+Each project is polled with a single request however many of its actions
+are pending. The first poll comes quickly, and the interval grows after
+each poll that completes nothing, so that long-running actions do not
+cause a steady stream of requests. A poll that fails is retried, with
+the same backoff, before the project's actions are failed."""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+# Seconds before the first poll of a project's activity
+WAITER_INITIAL_INTERVAL = float(os.environ.get("WAITER_INITIAL_INTERVAL", "0.25"))
+# Factor by which the interval grows after each poll that completes no action
+WAITER_BACKOFF = float(os.environ.get("WAITER_BACKOFF", "1.5"))
+# Longest interval between polls of a project's activity, in seconds
+WAITER_MAX_INTERVAL = float(os.environ.get("WAITER_MAX_INTERVAL", "5"))
+# Seconds after which an action still pending is reported as an error; 0 waits forever
+WAITER_TIMEOUT = float(os.environ.get("WAITER_TIMEOUT", "1800"))
+# Smallest number of activity records requested in each poll
+WAITER_PAGE_SIZE = int(os.environ.get("WAITER_PAGE_SIZE", "10"))
+# Largest number of activity records requested in each poll
+WAITER_MAX_PAGE_SIZE = int(os.environ.get("WAITER_MAX_PAGE_SIZE", "1000"))
+# Number of consecutive failed polls of a project that are retried before its actions fail
+WAITER_POLL_RETRIES = int(os.environ.get("WAITER_POLL_RETRIES", "3"))
+
+
+class _PendingProject(object):
+    def __init__(self, interval, due):
+        # action ID -> (future, response, deadline)
+        self.actions = {}
+        self.interval = interval
+        self.due = due
+        self.page_size = WAITER_PAGE_SIZE
+        self.failures = 0
+
+
+class ActionWaiter(object):
+    def __init__(self, session, initial=None, backoff=None, max_interval=None, timeout=None, jobs=None):
+        self._session = session
+        self.initial = WAITER_INITIAL_INTERVAL if initial is None else initial
+        self.backoff = WAITER_BACKOFF if backoff is None else backoff
+        self.max_interval = WAITER_MAX_INTERVAL if max_interval is None else max_interval
+        self.timeout = WAITER_TIMEOUT if timeout is None else timeout
+        self.jobs = jobs
+        # project ID -> _PendingProject
+        self._projects = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, response, timeout=None):
+        """Register the response to a request that started an action.
+        Returns a future whose result is the response, with its "action"
+        field updated, once the action is done or has failed. If it is
+        still pending after timeout seconds, the future raises AEException."""
+        future = Future()
+        action = response["action"]
+        if action["done"] or action["error"]:
+            future.set_result(response)
+            return future
+        project_id = response.get("project_id", response["id"])
+        timeout = self.timeout if timeout is None else timeout
+        now = time.monotonic()
+        deadline = now + timeout if timeout else None
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is None:
+                project = self._projects[project_id] = _PendingProject(self.initial, now + self.initial)
+            else:
+                # A new action is likely to be quick, so poll soon again
+                project.interval = self.initial
+                project.due = min(project.due, now + self.initial)
+            project.actions[action["id"]] = (future, response, deadline)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def wait(self, response, timeout=None):
+        return self.add(response, timeout).result()
+
+    def _poll(self, item):
+        project_id, action_ids, page_size = item
+        params = {"sort": "-updated", "page[size]": max(page_size, len(action_ids))}
+        activity = self._session._get(f"projects/{project_id}/activity", params=params)
+        return {s["id"]: s for s in activity["data"] if s["id"] in action_ids}
+
+    def _resolve(self, project_id, action_id, status=None, exc=None):
+        # Called with the lock held
+        project = self._projects[project_id]
+        future, response, _ = project.actions.pop(action_id)
+        if not project.actions:
+            del self._projects[project_id]
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            response["action"] = status
+            future.set_result(response)
+
+    def _update(self, project_id, action_ids, found, exc):
+        now = time.monotonic()
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is None:
+                return
+            if exc is not None:
+                project.failures += 1
+                if project.failures > WAITER_POLL_RETRIES:
+                    for action_id in list(project.actions):
+                        self._resolve(project_id, action_id, exc=exc)
+                    return
+                project.interval = min(project.interval * self.backoff, self.max_interval)
+                project.due = now + project.interval
+                return
+            project.failures = 0
+            completed = False
+            for action_id in action_ids:
+                if action_id not in project.actions:
+                    continue
+                if action_id in found and (found[action_id]["done"] or found[action_id]["error"]):
+                    self._resolve(project_id, action_id, found[action_id])
+                    completed = True
+            if project_id not in self._projects:
+                return
+            if len(found) < len(action_ids):
+                # Newer activity has pushed an action out of the page
+                project.page_size = min(project.page_size * 2, WAITER_MAX_PAGE_SIZE)
+            if not completed:
+                project.interval = min(project.interval * self.backoff, self.max_interval)
+            project.due = now + project.interval
+
+    def _expire(self):
+        # Imported here because the api module imports this one
+        from .api import AEException
+
+        now = time.monotonic()
+        with self._lock:
+            for project_id, project in list(self._projects.items()):
+                for action_id, (_, _, deadline) in list(project.actions.items()):
+                    if deadline is not None and deadline <= now:
+                        exc = AEException(f"Timed out waiting for action {action_id} of project {project_id}")
+                        self._resolve(project_id, action_id, exc=exc)
+
+    def _run(self):
+        try:
+            self._poll_until_done()
+        finally:
+            with self._lock:
+                # Still set only if the loop ended with an error. Fail every
+                # pending action, rather than leave its caller waiting forever,
+                # and let the next add() start a new thread.
+                if self._thread is threading.current_thread():
+                    from .api import AEException
+
+                    self._thread = None
+                    for project_id, project in list(self._projects.items()):
+                        for action_id in list(project.actions):
+                            exc = AEException(f"Stopped waiting for action {action_id} of project {project_id} after an error")
+                            self._resolve(project_id, action_id, exc=exc)
+
+    def _poll_until_done(self):
+        while True:
+            self._wakeup.clear()
+            self._expire()
+            now = time.monotonic()
+            with self._lock:
+                if not self._projects:
+                    self._thread = None
+                    return
+                due = [(pid, list(p.actions), p.page_size) for pid, p in self._projects.items() if p.due <= now]
+                delay = min(p.due for p in self._projects.values()) - now
+                deadlines = [d for p in self._projects.values() for _, _, d in p.actions.values() if d is not None]
+                if deadlines:
+                    delay = min(delay, min(deadlines) - now)
+            if not due:
+                self._wakeup.wait(max(delay, 0))
+                continue
+            for (project_id, action_ids, _), found, exc in self._session._map(self._poll, due, self.jobs):
+                self._update(project_id, action_ids, found, exc)
@@ -0,0 +1,74 @@
+"""Compare the throughput of the project archive compressors on a
+synthetic project tree.
+
+    python benchmarks/bench_archiver.py [--size-mb 256] [--files 200]
+
+The tree mixes compressible text, incompressible binary data, and files
+with already-compressed extensions. For each compression setting the
+script reports the time taken, the throughput, and the compression ratio.
+"""
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+from ae5_tools.archiver import ARCHIVE_WORKERS, create_tar_archive
+
+
+class _CountingWriter(io.RawIOBase):
+    def __init__(self):
+        self.count = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.count += len(data)
+        return len(data)
+
+
+def make_tree(root, size_mb, nfiles, seed=0):
+    rng = random.Random(seed)
+    words = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10))) for _ in range(2000)]
+    per_file = size_mb * 1024 * 1024 // nfiles
+    with open(os.path.join(root, "anaconda-project.yml"), "w") as fp:
+        fp.write("name: bench\n")
+    for k in range(nfiles):
+        kind = k % 3
+        subdir = os.path.join(root, f"dir{k % 10}")
+        os.makedirs(subdir, exist_ok=True)
+        if kind == 0:
+            name, data = f"text{k}.csv", b" ".join(rng.choice(words) for _ in range(per_file // 6))
+        elif kind == 1:
+            name, data = f"binary{k}.bin", rng.randbytes(per_file)
+        else:
+            name, data = f"archive{k}.zip", rng.randbytes(per_file)
+        with open(os.path.join(subdir, name), "wb") as fp:
+            fp.write(data[:per_file])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256, help="Total size of the project tree")
+    parser.add_argument("--files", type=int, default=200, help="Number of files in the project tree")
+    args = parser.parse_args()
+    settings = [("gzip", 6), ("gzip", 1), ("parallel", 6), ("parallel", 1), ("fast", None)]
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, args.size_mb, args.files)
+        total = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+        print(f"{total / 1e6:.1f} MB in {args.files} files; {ARCHIVE_WORKERS} workers")
+        print(f"{'compression':>12} {'level':>5} {'seconds':>8} {'MB/s':>8} {'ratio':>6}")
+        for compression, level in settings:
+            out = _CountingWriter()
+            started = time.perf_counter()
+            create_tar_archive(root, "project", out, compression=compression, level=level)
+            elapsed = time.perf_counter() - started
+            level = "-" if level is None else level
+            print(f"{compression:>12} {level:>5} {elapsed:8.2f} {total / 1e6 / elapsed:8.1f} {total / out.count:6.2f}")
+
+
+if __name__ == "__main__":
+    main()
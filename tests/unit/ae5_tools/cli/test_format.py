@@ -0,0 +1,70 @@
+import io
+
+import click
+
+from ae5_tools.cli import format
+
+
+def test_table_lines():
+    lines = format.table_lines([("a", 1), ("bb", None)], ["name", "usage/cpu"], width=80)
+    assert lines == ["      usage", "name  cpu", "----  ---", "a     1", "bb"]
+
+
+def test_live_table_redraws_in_place(monkeypatch):
+    out = io.StringIO()
+    monkeypatch.setattr(format.sys, "stdout", out)
+    monkeypatch.setattr(format, "_terminal_height", lambda: 24)
+
+    def format_response(records, fmt):
+        return [(r["name"], r["phase"]) for r in records], ["name", "phase"]
+
+    with click.Context(click.Command("test")):
+        live = format.LiveTable(format_response)
+        live([{"name": "a", "phase": None}])
+        first = out.getvalue()
+        live([{"name": "a", "phase": "Running"}])
+        live.clear()
+    assert first == "name  phase\n----  -----\na\n"
+    # Each redraw, and the final clear, erases the three lines drawn before
+    assert out.getvalue() == first + "\x1b[3F\x1b[J" + "name   phase\n----  -------\na     Running\n" + "\x1b[3F\x1b[J"
+
+
+def test_watch_table_prints_changed_rows(monkeypatch, capsys):
+    with click.Context(click.Command("test")):
+        table = format.WatchTable(tty=False)
+        table.update(([("a1", "started"), ("a2", "initial")], ["id", "state"]))
+        table.update(([("a1", "started"), ("a2", "initial")], ["id", "state"]))
+        table.update(([("a1", "started"), ("a2", "started")], ["id", "state"]))
+    assert capsys.readouterr().out == "id   state\n--  -------\na1  started\na2  initial\na2  started\n"
+
+
+def test_watch_table_prints_removed_rows(capsys):
+    with click.Context(click.Command("test")):
+        table = format.WatchTable(tty=False)
+        table.update(([("a1", "started"), ("a2", "initial")], ["id", "state"]))
+        table.update(([("a1", "started")], ["id", "state"]))
+        table.update(([("a1", "started")], ["id", "state"]))
+    assert capsys.readouterr().out == "id   state\n--  -------\na1  started\na2  initial\na2  initial  (removed)\n"
+
+
+def test_watch_table_rewrites_changed_lines(monkeypatch):
+    out = io.StringIO()
+    monkeypatch.setattr(format.sys, "stdout", out)
+    monkeypatch.setattr(format, "_terminal_height", lambda: 24)
+    with click.Context(click.Command("test")):
+        table = format.WatchTable(tty=True)
+        table.update(([("a1", "started"), ("a2", "initial")], ["id", "state"]))
+        first = out.getvalue()
+        table.update(([("a1", "started"), ("a2", "stopped")], ["id", "state"]))
+    # Only the last of the four lines is rewritten, in bold
+    assert out.getvalue() == first + "\x1b[1F\x1b[2K" + click.style("a2  stopped", bold=True) + "\x1b[1E"
+
+
+def test_watch_output_until(monkeypatch):
+    results = iter([([("a1", "initial")], ["id", "state"]), ([("a1", "started")], ["id", "state"]), ([("a1", "stopped")], ["id", "state"])])
+    monkeypatch.setattr(format.time, "sleep", lambda t: None)
+    monkeypatch.setattr(format.LiveTable, "supported", staticmethod(lambda: False))
+    with click.Context(click.Command("test")):
+        format.watch_output(lambda: next(results), 1, "state=started")
+    # Returns as soon as every row matches
+    assert len(list(results)) == 1
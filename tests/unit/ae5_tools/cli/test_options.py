@@ -0,0 +1,31 @@
+import warnings
+from unittest.mock import MagicMock
+
+import pytest
+from click.testing import CliRunner
+
+from ae5_tools.cli import login
+from ae5_tools.cli.main import cli
+
+
+@pytest.fixture(scope="function")
+def session(monkeypatch):
+    session = MagicMock()
+    monkeypatch.setattr(login, "cluster", lambda admin=False: session)
+    return session
+
+
+def test_pod_logs_until_is_not_a_watch_option(session):
+    session.pod_logs.return_value = None
+    with warnings.catch_warnings():
+        # Click warns when two options share a parameter name
+        warnings.simplefilter("error")
+        result = CliRunner().invoke(cli, ["pod", "logs", "a1-x", "--grep", "foo", "--until", "1h"])
+    assert result.exit_code == 0, result.output
+    assert session.pod_logs.call_args.kwargs["until"] == "1h"
+
+
+def test_watch_until_requires_watch(session):
+    result = CliRunner().invoke(cli, ["session", "list", "--watch-until", "state=started"])
+    assert result.exit_code != 0
+    assert "--watch-until requires --watch" in result.output
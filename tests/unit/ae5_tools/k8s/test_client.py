@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools.api import AEUserSession
+from ae5_tools.k8s import client
+from ae5_tools.k8s.client import AE5K8SConnectionError, AE5K8SRemoteClient, PodWatch
+
+
+def _session(connected=True):
+    session = MagicMock()
+    session.hostname = "ae5.example.com"
+    session.connected = connected
+    session.session.cookies = []
+    session._get.return_value = "Alive and kicking"
+    return session
+
+
+@pytest.fixture(autouse=True)
+def state_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(client, "state_dir", lambda: str(tmp_path))
+
+
+def test_handshake_is_lazy_and_cached():
+    session = _session()
+    k8s = AE5K8SRemoteClient(session, "k8s")
+    assert k8s.error() is None
+    session._get.assert_not_called()
+    k8s._api("get", "nodes")
+    session._api.assert_called_once_with("get", "nodes", subdomain="k8s", format="response")
+    assert client._handshake_cached("ae5.example.com", "k8s")
+    # A stale session is trusted while the handshake is cached
+    session = _session(connected=False)
+    k8s = AE5K8SRemoteClient(session, "k8s")
+    assert k8s._verified
+    session._get.assert_not_called()
+
+
+def test_stale_session_is_probed():
+    session = _session(connected=False)
+    AE5K8SRemoteClient(session, "k8s")
+    session._get.assert_called_once_with("projects/actions", params={"q": "create_action"})
+
+
+def test_session_cookies_are_probed():
+    cookie = MagicMock(expires=None)
+    cookie.is_expired.return_value = False
+    session = _session()
+    session.session.cookies = [cookie]
+    AE5K8SRemoteClient(session, "k8s")
+    session._get.assert_called_once_with("projects/actions", params={"q": "create_action"})
+    cookie.expires = time.time() + 3600
+    session = _session()
+    session.session.cookies = [cookie]
+    AE5K8SRemoteClient(session, "k8s")
+    session._get.assert_not_called()
+
+
+def test_failed_request_checks_endpoint():
+    client._record_handshake("ae5.example.com", "k8s")
+    client._record_handshake("ae5.example.com", "other")
+    session = _session()
+    session._api.side_effect = [RuntimeError("502"), "response"]
+    k8s = AE5K8SRemoteClient(session, "other")
+    k8s._verified = False
+    assert k8s._api("get", "nodes") == "response"
+    session._api.side_effect = RuntimeError("404")
+    session._get.side_effect = RuntimeError("404")
+    k8s = AE5K8SRemoteClient(session, "missing")
+    with pytest.raises(AE5K8SConnectionError, match="No deployment found at endpoint missing"):
+        k8s._api("get", "nodes")
+    client._record_handshake("ae5.example.com", "k8s", False)
+    assert not client._handshake_cached("ae5.example.com", "k8s")
+    assert client._handshake_cached("ae5.example.com", "other")
+
+
+class StreamResponse:
+    def __init__(self):
+        self.closed = threading.Event()
+        self.finished = threading.Event()
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        yield 'data: {"type": "ADDED", "id": "a1-x"}'
+        yield ""
+        # Block like a socket read until the response is closed
+        self.closed.wait()
+        self.finished.set()
+        raise AttributeError("'NoneType' object has no attribute 'read'")
+
+    def close(self):
+        self.closed.set()
+
+
+def test_watch_pods_closes_stream():
+    response = StreamResponse()
+    session = AEUserSession(hostname="MOCK-HOSTNAME", username="MOCK-AE-USERNAME", password="MOCK-AE-USER-PASSWORD", persist=False)
+    session._k8s = MagicMock(return_value=PodWatch(response))
+
+    async def watch():
+        events = session.watch_pods(["a1-x"])
+        first = await events.__anext__()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(events.__anext__(), 0.05)
+        return first
+
+    assert asyncio.run(watch()) == {"type": "ADDED", "id": "a1-x"}
+    assert response.closed.is_set()
+    # The read blocked in the executor thread ended as well
+    assert response.finished.wait(5)
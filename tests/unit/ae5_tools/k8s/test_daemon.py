@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import stat
+
+import requests
+
+from ae5_tools.k8s import daemon, ssh
+
+
+class FakeProc:
+    returncode = None
+
+    def poll(self):
+        return None
+
+
+def test_daemon_serves_and_exits_when_idle(monkeypatch, tmp_path):
+    monkeypatch.setattr(daemon, "state_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(daemon, "tunneled_k8s_url", lambda hostname, username, port: (FakeProc(), f"http://localhost:{port}"))
+    monkeypatch.setattr(daemon, "close_tunnel", lambda proc: None)
+    monkeypatch.setattr(daemon, "DAEMON_HEALTH_INTERVAL", 0.05)
+
+    async def healthy(self, probe):
+        return True
+
+    monkeypatch.setattr(daemon.K8SDaemon, "_healthy", healthy)
+    port = ssh.find_local_port()
+    k8s_daemon = daemon.K8SDaemon("ae5.example.com", "centos", port, idle_timeout=1)
+
+    async def run():
+        task = asyncio.ensure_future(k8s_daemon.run())
+        loop = asyncio.get_running_loop()
+        for _ in range(50):
+            state = await loop.run_in_executor(None, daemon.daemon_status, "ae5.example.com", "centos")
+            if state is not None:
+                break
+            await asyncio.sleep(0.05)
+        # Requests without the token from the state file are refused
+        unauthorized = await loop.run_in_executor(None, requests.get, f"http://localhost:{port}/__status__")
+        mode = os.stat(tmp_path / "centos@ae5.example.com.json").st_mode
+        await asyncio.wait_for(task, 5)
+        return state, unauthorized.status_code, mode
+
+    state, status, mode = asyncio.run(run())
+    assert state["pid"] == os.getpid() and state["port"] == port
+    assert state["token"] == k8s_daemon.token and status == 401
+    assert stat.S_IMODE(mode) == 0o600
+    assert not os.path.exists(tmp_path / "centos@ae5.example.com.json")
+    assert daemon.daemon_status("ae5.example.com", "centos") is None
+
+
+def test_stale_state_is_removed(monkeypatch, tmp_path):
+    monkeypatch.setattr(daemon, "state_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(daemon, "_pid_alive", lambda pid: False)
+    fname = tmp_path / "centos@ae5.example.com.json"
+    fname.write_text(json.dumps({"pid": 1, "port": 1}))
+    assert daemon.daemon_status("ae5.example.com", "centos") is None
+    assert not fname.exists()
+    assert daemon.stop_daemon("ae5.example.com", "centos") is False
+
+
+def test_tunnel_uses_shared_connection(monkeypatch, tmp_path):
+    commands = []
+
+    class Proc(FakeProc):
+        banner = "Starting to serve on 127.0.0.1:41234"
+
+    def launch(cmd, waitfor, what, retries=1):
+        commands.append(cmd)
+        return Proc()
+
+    def run(cmd, **kwargs):
+        commands.append(cmd)
+        return type("Result", (), {"returncode": 0, "stdout": "", "stderr": ""})()
+
+    monkeypatch.setattr(ssh, "USE_CONTROL_MASTER", True)
+    monkeypatch.setattr(ssh, "state_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(ssh, "launch_background", launch)
+    monkeypatch.setattr(ssh.subprocess, "run", run)
+    proc, url = ssh.tunneled_k8s_url("ae5.example.com", "centos", 5555)
+    assert url == "http://localhost:5555"
+    assert "--port=0" in commands[0] and "ControlMaster=auto" in commands[0]
+    assert commands[1][-4:] == ["forward", "-L", "5555:localhost:41234", "centos@ae5.example.com"]
+    assert proc.forward == ("ae5.example.com", "centos", 5555, 41234)
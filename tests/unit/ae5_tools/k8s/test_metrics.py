@@ -0,0 +1,60 @@
+import json
+
+from ae5_tools.k8s import metrics
+from ae5_tools.k8s.metrics import Registry, path_template
+
+
+def test_path_template():
+    assert path_template("/api/v1/namespaces/default/pods/anaconda-app-123?container=app") == "/api/v1/namespaces/default/pods/{name}"
+    assert path_template("/api/v1/pods?limit=500") == "/api/v1/pods"
+
+
+def test_registry_render():
+    registry = Registry()
+    counter = registry.counter("calls_total", "Calls.", ("path",))
+    histogram = registry.histogram("call_seconds", "Latency.", buckets=(0.1, 1.0))
+    counter.inc(path='a"b')
+    counter.inc(2, path='a"b')
+    histogram.observe(0.5)
+    histogram.observe(5)
+    text = registry.render()
+    assert "# TYPE calls_total counter" in text
+    assert 'calls_total{path="a\\"b"} 3' in text
+    assert 'call_seconds_bucket{le="0.1"} 0' in text
+    assert 'call_seconds_bucket{le="1"} 1' in text
+    assert 'call_seconds_bucket{le="+Inf"} 2' in text
+    assert "call_seconds_sum 5.5" in text
+    assert "call_seconds_count 2" in text
+
+
+def test_registry_labels():
+    registry = Registry()
+    registry.labels["worker"] = 2
+    registry.counter("calls_total", "Calls.", ("path",)).inc(path="a")
+    registry.histogram("call_seconds", "Latency.", buckets=(1.0,)).observe(0.5)
+    text = registry.render()
+    assert 'calls_total{path="a",worker="2"} 1' in text
+    assert 'call_seconds_bucket{worker="2",le="1"} 1' in text
+    assert 'call_seconds_count{worker="2"} 1' in text
+
+
+def test_registry_render_combines_snapshots():
+    registry = Registry()
+    registry.labels["worker"] = 0
+    registry.counter("calls_total", "Calls.", ("path",)).inc(path="a")
+    other = Registry()
+    other.labels["worker"] = 1
+    other.counter("calls_total", "Calls.", ("path",)).inc(2, path="a")
+    text = registry.render([other.snapshot()])
+    assert text.count("# TYPE calls_total counter") == 1
+    assert 'calls_total{path="a",worker="0"} 1' in text
+    assert 'calls_total{path="a",worker="1"} 2' in text
+
+
+def test_snapshot_files(tmp_path):
+    metrics.write_snapshot(str(tmp_path), 0)
+    (tmp_path / "worker-1.json").write_text(json.dumps({"ae5_k8s_requests_total": ["sample 1"]}))
+    (tmp_path / "worker-2.json").write_text("{")
+    others = metrics.read_snapshots(str(tmp_path), 0)
+    assert others == [{"ae5_k8s_requests_total": ["sample 1"]}]
+    assert "sample 1" in metrics.render(others)
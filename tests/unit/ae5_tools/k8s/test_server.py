@@ -0,0 +1,194 @@
+import asyncio
+import datetime
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from ae5_tools.k8s import server
+
+PAYLOAD = [{"name": f"node{k}", "usage": {"cpu": "250m", "mem": "1.2Gi"}} for k in range(100)]
+
+
+async def _with_client(check):
+    async def nodes(request):
+        return server._json(PAYLOAD)
+
+    app = web.Application(middlewares=[server.conditional_middleware])
+    app.add_routes([web.get("/nodes", nodes)])
+    async with TestClient(TestServer(app)) as client:
+        await check(client)
+
+
+def test_json_is_compact():
+    body = server._json({"a": [1, 2]}).body
+    assert json.loads(body) == {"a": [1, 2]}
+    assert b" " not in body and b"\n" not in body
+
+
+def test_compression_is_negotiated():
+    async def check(client):
+        resp = await client.get("/nodes", headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert await resp.json() == PAYLOAD
+        resp = await client.get("/nodes", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in resp.headers
+        assert await resp.json() == PAYLOAD
+
+    asyncio.run(_with_client(check))
+
+
+def test_conditional_request():
+    async def check(client):
+        resp = await client.get("/nodes")
+        etag = resp.headers["ETag"]
+        resp = await client.get("/nodes", headers={"If-None-Match": etag})
+        assert resp.status == 304
+        assert resp.headers["ETag"] == etag
+        resp = await client.get("/nodes", headers={"If-None-Match": '"stale"'})
+        assert resp.status == 200
+
+    asyncio.run(_with_client(check))
+
+
+def test_server_metrics():
+    async def check(client):
+        await client.get("/nodes")
+        await client.get("/missing")
+        resp = await client.get("/__metrics__")
+        assert resp.status == 200
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        text = await resp.text()
+        assert 'ae5_k8s_requests_total{method="GET",route="/nodes",status="200"}' in text
+        assert 'route="unmatched",status="404"' in text
+        assert 'ae5_k8s_request_duration_seconds_bucket{method="GET",route="/nodes",le="+Inf"}' in text
+        assert 'ae5_k8s_requests_in_flight{route="/__metrics__"} 1' in text
+
+    async def run():
+        async def nodes(request):
+            return server._json(PAYLOAD)
+
+        handler = server.AE5K8SHandler("http://localhost", None)
+        app = web.Application(middlewares=[server.metrics_middleware, server.conditional_middleware])
+        app.add_routes([web.get("/nodes", nodes), web.get("/__metrics__", handler.server_metrics)])
+        async with TestClient(TestServer(app)) as client:
+            await check(client)
+        await handler.cleanup()
+
+    asyncio.run(run())
+
+
+def test_pod_logs_route():
+    handler = server.AE5K8SHandler("http://localhost", None)
+    calls = []
+
+    async def pod_logs(ids, stream, **options):
+        calls.append((ids, options))
+        await stream.prepare(None)
+        await stream.write(b"[a2-x] line\n")
+        await stream.finish()
+
+    handler.xfrm.pod_logs = pod_logs
+    app = web.Application()
+    app.add_routes([web.get("/pods/log", handler.podlogs)])
+
+    async def check():
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/pods/log?id=a2-x&id=a2-y&since=1h30m&tail=5&follow=true")
+            assert await resp.text() == "[a2-x] line\n"
+            resp = await client.get("/pods/log?id=a2-x&since=never")
+            assert resp.status == 422
+            resp = await client.get("/pods/log")
+            assert resp.status == 422
+
+    asyncio.run(check())
+    assert calls == [(["a2-x", "a2-y"], {"container": None, "follow": True, "since": 5400, "tail": 5})]
+
+
+def test_pod_log_search_route():
+    handler = server.AE5K8SHandler("http://localhost", None)
+    calls = []
+
+    async def pod_log_search(id, pattern, stream, **options):
+        calls.append((id, pattern, options))
+        await stream.prepare(None)
+        await stream.write(b"match\n")
+        await stream.finish()
+
+    handler.xfrm.pod_log_search = pod_log_search
+    app = web.Application()
+    app.add_routes([web.get("/pod/{id}/log/search", handler.podlog_search)])
+
+    async def check():
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/pod/a2-x/log/search?pattern=ERR.*&context=2&since=600&until=2024-01-01T12:00:00Z")
+            assert await resp.text() == "match\n"
+            for query in ("pattern=(", "context=2", "pattern=x&context=-1", "pattern=x&tail=5", "pattern=x&until=yesterday"):
+                resp = await client.get(f"/pod/a2-x/log/search?{query}")
+                assert resp.status == 422, query
+
+    asyncio.run(check())
+    until = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    options = {"container": None, "follow": False, "since": 600, "until": until, "context": 2, "max_count": None, "timestamps": False}
+    assert calls == [("a2-x", "ERR.*", options)]
+
+
+def test_pod_watch_route(monkeypatch):
+    monkeypatch.setattr(server, "WATCH_KEEPALIVE", 0.01)
+    handler = server.AE5K8SHandler("http://localhost", None)
+    id = "a2-" + "0" * 32
+
+    async def watch_pods(ids):
+        yield {"type": "ADDED", "id": ids[0], "pod": {"phase": "Pending"}}
+        await asyncio.sleep(0.05)
+        raise RuntimeError("watch failed")
+
+    handler.xfrm.watch_pods = watch_pods
+    app = web.Application()
+    app.add_routes([web.get("/pods/watch", handler.podwatch)])
+
+    async def check():
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get(f"/pods/watch?id={id}")
+            assert resp.headers["Content-Type"] == "text/event-stream"
+            text = await resp.text()
+            resp = await client.get("/pods/watch?id=bad")
+            assert resp.status == 422
+        return text
+
+    text = asyncio.run(check())
+    messages = text.split("\n\n")
+    assert messages[0] == 'event: added\ndata: {"type":"ADDED","id":"%s","pod":{"phase":"Pending"}}' % id
+    assert ": keepalive" in messages
+    assert messages[-2] == 'event: error\ndata: {"type":"ERROR","message":"watch failed"}'
+
+
+def test_query_range_rejects_bad_parameters():
+    handler = server.AE5K8SHandler("http://localhost", None)
+    calls = []
+
+    class PromQL:
+        async def query_range(self, pod_ids, **query):
+            calls.append((pod_ids, query))
+            return {"status": "success", "data": {"result": []}}
+
+    handler.promql = PromQL()
+    app = web.Application()
+    app.add_routes([web.get("/promql/query_range", handler.query_range)])
+
+    async def check():
+        async with TestClient(TestServer(app)) as client:
+            for query in ("points=many", "points=0", "samples=x", "start=yesterday", "metric=cpu})"):
+                resp = await client.get(f"/promql/query_range?id=abc&metric=cpu&{query}")
+                assert resp.status == 400, query
+            resp = await client.get("/promql/query_range?id=abc&metric=cpu&downsample=lttb&points=50")
+            assert resp.status == 200
+            resp = await client.get(
+                "/promql/query_range", params={"id": "abc", "metric": "cpu", "start": "2024-01-01T14:00:00+02:00", "end": "2024-01-01T13:00:00Z"}
+            )
+            assert resp.status == 200
+
+    asyncio.run(check())
+    assert calls[0] == (["abc"], {"metric": ["cpu"], "downsample": "lttb", "points": 50})
+    # Times with an offset are converted to naive UTC
+    assert calls[1][1]["start"] == datetime.datetime(2024, 1, 1, 12) and calls[1][1]["end"] == datetime.datetime(2024, 1, 1, 13)
@@ -0,0 +1,426 @@
+import asyncio
+import datetime
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from ae5_tools.k8s import transformer
+from ae5_tools.k8s.transformer import AE5K8STransformer, _aggregate_nodes, _reduce_pod
+
+
+class MockContent:
+    def __init__(self, data):
+        self._buffer = io.BytesIO(data)
+
+    async def read(self, n=-1):
+        return self._buffer.read(n)
+
+    async def iter_chunks(self):
+        while True:
+            data = self._buffer.read(7)
+            if not data:
+                break
+            yield data, True
+
+
+class MockResponse:
+    def __init__(self, data, status=200):
+        self._data = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.content = MockContent(self._data)
+        self.status = status
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self, content_type="application/json"):
+        return json.loads(self._data)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class MockSession:
+    def __init__(self, pages):
+        self.pages = pages
+        self.urls = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        query = parse_qs(urlparse(url).query)
+        token = query.get("continue", [""])[0]
+        return MockResponse(self.pages[token])
+
+
+def _pod(name, phase="Running"):
+    return {
+        "metadata": {"name": name, "labels": {"a": "b"}},
+        "spec": {"nodeName": "node1", "containers": [{"name": "app", "resources": {"requests": {"cpu": "1"}}}]},
+        "status": {"phase": phase, "conditions": []},
+    }
+
+
+PAGES = {
+    "": {"metadata": {"continue": "page2"}, "items": [_pod("pod1"), _pod("pod2")]},
+    "page2": {"metadata": {}, "items": [_pod("pod3", "Pending")]},
+}
+
+
+@pytest.mark.parametrize("use_ijson", [False, True])
+def test_list_items_paginates_and_reduces(monkeypatch, use_ijson):
+    if use_ijson:
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(transformer, "ijson", None)
+    xfrm = AE5K8STransformer("http://localhost", None)
+    xfrm._session = session = MockSession(PAGES)
+    result = asyncio.run(xfrm.list_all("pods", _reduce_pod, fieldSelector=transformer.ACTIVE_POD_SELECTOR))
+    xfrm._session = None
+    assert [r["name"] for r in result] == ["pod1", "pod2", "pod3"]
+    assert result[2] == {"name": "pod3", "node": "node1", "phase": "Pending", "resources": [{"requests": {"cpu": "1"}}]}
+    assert len(session.urls) == 2
+    query = parse_qs(urlparse(session.urls[0]).query)
+    assert query["fieldSelector"] == [transformer.ACTIVE_POD_SELECTOR]
+    assert query["limit"] == [str(transformer.K8S_PAGE_LIMIT)]
+    assert "continue" not in query
+
+
+class ExpiringSession(MockSession):
+    """Refuses each token in expired once with 410 Gone, returning the
+    continue token mapped to it, if any, in the error."""
+
+    def __init__(self, pages, expired):
+        super().__init__(pages)
+        self.expired = expired
+
+    def get(self, url, headers=None):
+        token = parse_qs(urlparse(url).query).get("continue", [""])[0]
+        if token in self.expired:
+            self.urls.append(url)
+            replacement = self.expired.pop(token)
+            metadata = {"continue": replacement} if replacement else {}
+            return MockResponse({"kind": "Status", "code": 410, "metadata": metadata}, status=410)
+        return super().get(url, headers)
+
+
+@pytest.mark.parametrize("use_ijson", [False, True])
+def test_list_items_recovers_from_expired_token(monkeypatch, use_ijson):
+    if use_ijson:
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(transformer, "ijson", None)
+    pods = [_pod(f"pod{n}") for n in range(1, 5)]
+    for n, pod in enumerate(pods):
+        pod["metadata"]["uid"] = f"uid{n}"
+    pages = {
+        "": {"metadata": {"continue": "page2"}, "items": pods[:2]},
+        "page2": {"metadata": {"continue": "page3"}, "items": pods[2:3]},
+        "page2b": {"metadata": {"continue": "page3"}, "items": pods[2:3]},
+        "page3": {"metadata": {}, "items": pods[3:]},
+    }
+    xfrm = AE5K8STransformer("http://localhost", None)
+    # An expired token that is replaced continues from the new one
+    xfrm._session = session = ExpiringSession(pages, {"page2": "page2b"})
+    result = asyncio.run(xfrm.list_all("pods"))
+    assert [r["metadata"]["name"] for r in result] == ["pod1", "pod2", "pod3", "pod4"]
+    assert "continue=page2b" in session.urls[2]
+    # Otherwise the list starts again, without repeating items
+    xfrm._session = session = ExpiringSession(pages, {"page3": None})
+    result = asyncio.run(xfrm.list_all("pods"))
+    xfrm._session = None
+    assert [r["metadata"]["name"] for r in result] == ["pod1", "pod2", "pod3", "pod4"]
+    assert len(session.urls) == 6
+    assert "continue" not in parse_qs(urlparse(session.urls[3]).query)
+
+
+def _values(n, start=0, step=60):
+    return [[start + k * step, str(float(k % 7))] for k in range(n)]
+
+
+NODES = [
+    {
+        "metadata": {"name": "node1", "labels": {"role": "worker"}},
+        "status": {
+            "allocatable": {"pods": "110", "memory": "16Gi", "cpu": "8"},
+            "conditions": [{"type": "Ready", "status": "True"}],
+        },
+    }
+]
+
+
+def test_aggregate_nodes():
+    pods = [_reduce_pod(p) for p in PAGES[""]["items"] + PAGES["page2"]["items"]]
+    usage = [{"name": "pod1", "window": "30s", "timestamp": "now", "usage": [{"cpu": "500m"}]}]
+    (node,) = _aggregate_nodes(NODES, pods, usage)
+    assert node["ready"] and node["capacity"]["mem"] == "16.00Gi"
+    assert (node["total"]["pods"], node["total"]["pending"]) == (2, 1)
+    assert node["system"]["requests"]["cpu"] == "3.000"
+    assert node["total"]["usage"]["cpu"] == "500m"
+    assert node["window"] == "30s"
+
+
+def test_offload_to_process_pool():
+    pods = [_reduce_pod(p) for p in PAGES[""]["items"]]
+    expected = _aggregate_nodes(NODES, pods, [])
+
+    async def run():
+        with ProcessPoolExecutor(1) as executor:
+            xfrm = AE5K8STransformer("http://localhost", None, executor=executor)
+            return await xfrm.offload(_aggregate_nodes, NODES, pods, [])
+
+    assert asyncio.run(run()) == expected
+
+
+@pytest.mark.parametrize("func", [transformer.lttb, transformer.minmax])
+def test_downsample(func):
+    values = _values(1000)
+    result = func(values, 100)
+    assert len(result) <= 100
+    assert result[0] == values[0]
+    assert [v[0] for v in result] == sorted(v[0] for v in result)
+    assert func(values[:50], 100) == values[:50]
+
+
+def test_promql_query():
+    assert transformer._promql_query("abc", "cpu") == "cpu{container_name='app',pod_name=~'anaconda-app-abc-.*'}"
+    query = transformer._promql_query(["abc", "def"], ["cpu", "mem"])
+    assert query == "{__name__=~'(cpu|mem)',container_name='app',pod_name=~'anaconda-app-(abc|def)-.*'}"
+    # IDs are matched literally, and cannot end the string
+    query = transformer._promql_query(["a.b", "c'd"], "cpu")
+    assert query == "cpu{container_name='app',pod_name=~'anaconda-app-(a\\\\.b|c\\'d)-.*'}"
+
+
+def test_series_by_id():
+    result = [
+        {"metric": {"__name__": "cpu", "pod_name": "anaconda-app-abc-1"}, "values": [[2, "1"]]},
+        {"metric": {"__name__": "cpu", "pod_name": "anaconda-app-abc-2"}, "values": [[1, "2"]]},
+        {"metric": {"__name__": "mem", "pod_name": "anaconda-app-def-1"}, "values": [[1, "3"]]},
+    ]
+    output = transformer._series_by_id(result, ["abc", "def"], ["cpu", "mem"])
+    assert output == {"abc": {"cpu": [[1, "2"], [2, "1"]], "mem": []}, "def": {"cpu": [], "mem": [[1, "3"]]}}
+
+
+def test_promql_cache_fetches_tail():
+    xfrm = transformer.AE5PromQLTransformer("http://localhost", None)
+    calls = []
+
+    async def fetch(query, start, end, step):
+        calls.append((start, end))
+        values = [[t, "1"] for t in range(start, end + 1, step)]
+        return {"status": "success", "data": {"result": [{"metric": {"pod_name": "x"}, "values": values}]}}
+
+    xfrm._fetch_range = fetch
+    end = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    resp1 = asyncio.run(xfrm.query_range("abc", metric="cpu", end=end, period="1h", step="60"))
+    later = end + datetime.timedelta(minutes=5)
+    resp2 = asyncio.run(xfrm.query_range("abc", metric="cpu", end=later, period="1h", step="60"))
+    assert calls[1] == (calls[0][1], calls[0][1] + 300)
+    values1 = resp1["data"]["result"][0]["values"]
+    values2 = resp2["data"]["result"][0]["values"]
+    assert len(values1) == len(values2) == 61
+    assert values2[0][0] == values1[5][0]
+    assert values2[-1][0] == values1[-1][0] + 300
+
+
+def test_promql_cache_concurrent_queries():
+    xfrm = transformer.AE5PromQLTransformer("http://localhost", None)
+
+    async def fetch(query, start, end, step):
+        await asyncio.sleep(0.01)
+        values = [[t, "1"] for t in range(start, end + 1, step)]
+        return {"status": "success", "data": {"result": [{"metric": {"pod_name": "x"}, "values": values}]}}
+
+    xfrm._fetch_range = fetch
+    end = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    later = end + datetime.timedelta(minutes=5)
+
+    async def run():
+        await xfrm.query_range("abc", metric="cpu", end=end, period="1h", step="60")
+        return await asyncio.gather(*(xfrm.query_range("abc", metric="cpu", end=later, period="1h", step="60") for _ in range(3)))
+
+    for resp in asyncio.run(run()):
+        times = [v[0] for v in resp["data"]["result"][0]["values"]]
+        assert times == sorted(set(times)) and len(times) == 61
+
+
+LOGS = {"pod-a": b"a1\na2\na3\n", "pod-b": b"b1\nb2 unterminated"}
+
+
+class LogSession:
+    def get(self, url, headers=None, timeout=None):
+        assert timeout is transformer.STREAM_TIMEOUT
+        name = url.split("/pods/", 1)[1].split("/", 1)[0]
+        return MockResponse(LOGS[name])
+
+
+class SlowStream:
+    def __init__(self):
+        self.writes = []
+
+    async def prepare(self, request):
+        pass
+
+    def closing(self):
+        return False
+
+    async def write(self, data):
+        await asyncio.sleep(0.001)
+        self.writes.append(data)
+
+    async def finish(self):
+        pass
+
+
+def test_iter_lines():
+    async def collect():
+        return [line async for line in transformer._iter_lines(MockContent(b"first line\nsecond line\n\nlast"))]
+
+    assert asyncio.run(collect()) == [b"first line\n", b"second line\n", b"\n", b"last\n"]
+
+
+def test_pod_logs_multiplexed():
+    xfrm = AE5K8STransformer("http://localhost", None)
+    xfrm._session = LogSession()
+    paths = []
+
+    async def pod_info(id):
+        return {"name": f"pod-{id[-1]}", "containers": {"app": {"name": "app"}}}
+
+    async def log_path(*args):
+        paths.append(await AE5K8STransformer._log_path(xfrm, *args))
+        return paths[-1]
+
+    xfrm._pod_info = pod_info
+    xfrm._log_path = log_path
+    stream = SlowStream()
+    asyncio.run(xfrm.pod_logs(["a2-a", "a2-b"], since=600, tail=10, stream=stream, queue_size=1))
+    xfrm._session = None
+    lines = b"".join(stream.writes).splitlines()
+    assert [x for x in lines if x.startswith(b"[a2-a]")] == [b"[a2-a] a1", b"[a2-a] a2", b"[a2-a] a3"]
+    assert [x for x in lines if x.startswith(b"[a2-b]")] == [b"[a2-b] b1", b"[a2-b] b2 unterminated"]
+    query = parse_qs(urlparse(paths[0]).query)
+    assert query == {"container": ["app"], "follow": ["false"], "sinceSeconds": ["600"], "tailLines": ["10"]}
+
+
+def test_pod_logs_reports_missing_pods():
+    xfrm = AE5K8STransformer("http://localhost", None)
+    xfrm._session = LogSession()
+
+    async def pod_info(id):
+        if id == "a2-c":
+            raise KeyError(f"Pod not found: {id}")
+        return {"name": f"pod-{id[-1]}", "containers": {"app": {"name": "app"}}}
+
+    xfrm._pod_info = pod_info
+    stream = SlowStream()
+    asyncio.run(xfrm.pod_logs(["a2-a", "a2-c"], stream=stream))
+    lines = b"".join(stream.writes).splitlines()
+    assert b"[a2-c] Error reading log: Pod not found: a2-c" in lines
+    assert [x for x in lines if x.startswith(b"[a2-a]")] == [b"[a2-a] a1", b"[a2-a] a2", b"[a2-a] a3"]
+    # When no pod can be found, the error is raised instead
+    with pytest.raises(KeyError):
+        asyncio.run(xfrm.pod_logs(["a2-c"], stream=SlowStream()))
+    xfrm._session = None
+
+
+def _stamped(*texts):
+    return [f"2024-01-01T12:00:{k:02d}.5Z {text}\n".encode() for k, text in enumerate(texts)]
+
+
+def _search(log_filter, lines):
+    output = []
+    for line in lines:
+        output.extend(log_filter.feed(line))
+        if log_filter.done:
+            break
+    return b"".join(output).decode()
+
+
+def test_log_filter_context():
+    lines = _stamped("a", "ERROR 1", "b", "c", "d", "e", "ERROR 2", "f")
+    assert _search(transformer.LogFilter("ERROR"), lines) == "ERROR 1\nERROR 2\n"
+    assert _search(transformer.LogFilter("ERROR", context=1), lines) == "a\nERROR 1\nb\n--\ne\nERROR 2\nf\n"
+    assert _search(transformer.LogFilter("ERROR", context=2), lines) == "a\nERROR 1\nb\nc\nd\ne\nERROR 2\nf\n"
+
+
+def test_log_filter_limits():
+    lines = _stamped("ERROR 1", "x", "ERROR 2", "ERROR 3")
+    until = datetime.datetime(2024, 1, 1, 12, 0, 2)
+    assert _search(transformer.LogFilter("ERROR", until=until), lines) == "ERROR 1\nERROR 2\n"
+    assert _search(transformer.LogFilter("ERROR", max_count=2), lines) == "ERROR 1\nERROR 2\n"
+    assert _search(transformer.LogFilter(r"\d$", max_count=1, timestamps=True), lines) == "2024-01-01T12:00:00.5Z ERROR 1\n"
+
+
+SLUG = "0123456789abcdef0123456789abcdef"
+
+
+def _session_pod(phase, ready=False, restarts=0):
+    pod = {
+        "metadata": {"name": "anaconda-session-x", "labels": {"anaconda-session-id": SLUG}, "resourceVersion": "2"},
+        "spec": {"containers": [{"name": "editor", "resources": {"requests": {"cpu": "1"}}}]},
+        "status": {"phase": phase},
+    }
+    if phase != "Pending":
+        pod["spec"]["nodeName"] = "node1"
+        pod["status"]["conditions"] = [{"type": "Ready", "lastTransitionTime": "2024-01-01T12:00:00Z"}]
+        pod["status"]["containerStatuses"] = [{"name": "editor", "ready": ready, "restartCount": restarts, "state": {}}]
+    return pod
+
+
+class HangingContent:
+    async def iter_chunks(self):
+        await asyncio.Event().wait()
+        yield b"", True
+
+
+class WatchSession:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.urls.append(url)
+        # Only the watch itself is open indefinitely
+        assert (timeout is transformer.STREAM_TIMEOUT) == ("watch=true" in url)
+        if "watch=true" not in url:
+            return MockResponse({"metadata": {"resourceVersion": "1"}, "items": [_session_pod("Pending")]})
+        if sum("watch=true" in u for u in self.urls) > 1:
+            resp = MockResponse(b"")
+            resp.content = HangingContent()
+            return resp
+        events = [
+            {"type": "MODIFIED", "object": _session_pod("Running", ready=True)},
+            {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "3"}}},
+            {"type": "MODIFIED", "object": _session_pod("Running", ready=True)},
+            {"type": "MODIFIED", "object": _session_pod("Running", ready=True, restarts=1)},
+            {"type": "DELETED", "object": _session_pod("Running")},
+        ]
+        return MockResponse(b"".join(json.dumps(e).encode() + b"\n" for e in events))
+
+
+def test_watch_pods():
+    xfrm = AE5K8STransformer("http://localhost", None)
+    xfrm._session = session = WatchSession()
+
+    async def collect():
+        events = []
+        async for event in xfrm.watch_pods([f"a1-{SLUG}"], usage_interval=3600):
+            events.append(event)
+            if event["type"] == "DELETED":
+                break
+        return events
+
+    events = asyncio.run(collect())
+    xfrm._session = None
+    assert [e["type"] for e in events] == ["ADDED", "MODIFIED", "MODIFIED", "DELETED"]
+    assert {e["id"] for e in events} == {f"a1-{SLUG}"}
+    assert events[0]["pod"]["phase"] == "Pending" and events[0]["pod"]["node"] is None
+    assert events[2]["pod"]["restarts"] == 1
+    assert parse_qs(urlparse(session.urls[0]).query)["labelSelector"] == [f"anaconda-session-id in ({SLUG})"]
+    assert parse_qs(urlparse(session.urls[2]).query)["resourceVersion"] == ["2"]
+    with pytest.raises(ValueError):
+        transformer._watch_selectors(["a3-x"])
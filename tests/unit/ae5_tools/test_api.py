@@ -1,7 +1,9 @@
 import json
 import os
+import threading
 from unittest.mock import MagicMock
 
+import pytest
 import requests
 
 from ae5_tools.api import AEAdminSession, AESessionBase, AEUserSession
@@ -118,3 +120,47 @@ def test_admin_session_gracefully_failures_with_exceeded_retry_count():
     admin_session.session.post = MagicMock(side_effect=[requests.exceptions.RetryError("Boom!")])
     admin_session._connect(password=base_params["password"])
     assert admin_session._sdata == {}
+
+
+def test_gather_runs_concurrently_and_keeps_order():
+    tester: AESessionBaseTester = AESessionBaseTester(**base_params, prefix="mock-prefix")
+    barrier = threading.Barrier(3, timeout=5)
+
+    def call(value):
+        # Deadlocks unless all three calls are in flight at once
+        barrier.wait()
+        return value
+
+    assert tester._gather(lambda: call(1), lambda: call(2), lambda: call(3)) == [1, 2, 3]
+
+    def fail(msg):
+        raise ValueError(msg)
+
+    with pytest.raises(ValueError, match="first"):
+        tester._gather(lambda: 1, lambda: fail("first"), lambda: fail("second"))
+
+
+def test_etag_cache_reuses_unmodified_responses():
+    tester: AESessionBaseTester = AESessionBaseTester(**base_params, prefix="mock-prefix")
+    tester.connected = True
+
+    def response(status, content=b"", **headers):
+        result = requests.Response()
+        result.status_code = status
+        result.headers.update(headers)
+        result._content = content
+        return result
+
+    first = response(200, b"[1]", etag='"v1"', **{"content-type": "application/json"})
+    tester.session.get = MagicMock(side_effect=[first, response(304), response(200, b"[2]", etag='"v2"')])
+    tester._is_login = MagicMock(return_value=False)
+    tester._etag_cache = {}
+    assert tester._get("items") == [1]
+    # Only the ETag, content type and body are kept
+    assert tester._etag_cache == {(tester.session.get.call_args.args[0], "null"): ('"v1"', "application/json", b"[1]")}
+    assert tester._get("items") == [1]
+    assert tester.session.get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    # Streamed responses are neither revalidated nor kept
+    tester._get("items", stream=True, format="response")
+    assert "headers" not in tester.session.get.call_args.kwargs
+    assert len(tester._etag_cache) == 1
@@ -0,0 +1,103 @@
+import hashlib
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools.api import AEUserSession
+
+PROJECTS = [
+    {"id": "a0-p1", "name": "one", "owner": "alice", "editor": "jupyterlab", "resource_profile": "large", "_record_type": "project"},
+    {"id": "a0-p2", "name": "two", "owner": "bob", "editor": "notebook", "resource_profile": "default", "_record_type": "project"},
+]
+
+
+def _get_records(endpoint, filter=None, **kwargs):
+    if endpoint == "projects":
+        return [dict(p) for p in PROJECTS]
+    pid, what = endpoint.split("/")[1:]
+    if what == "collaborators":
+        return [{"id": "carol", "type": "user", "permission": "rw", "first_name": "Carol"}]
+    return [{"id": f"{pid}-r2", "name": "0.2"}, {"id": f"{pid}-r1", "name": "0.1"}]
+
+
+def _download(endpoint, filename, **kwargs):
+    with open(filename, "wb") as fp:
+        fp.write(endpoint.encode())
+    return {"filename": filename, "size": len(endpoint), "sha256": hashlib.sha256(endpoint.encode()).hexdigest()}
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    session = AEUserSession(hostname="MOCK-HOSTNAME", username="alice", password="MOCK-AE-USER-PASSWORD", persist=False)
+    session.authorize = MagicMock()
+    session._get_records = MagicMock(side_effect=_get_records)
+    session._download = MagicMock(side_effect=_download)
+    return session
+
+
+def test_project_backup(user_session, tmp_path):
+    records = user_session.project_backup(str(tmp_path))
+    assert sorted((r["name"], r["status"], r["revisions"], r["downloaded"], r["skipped"]) for r in records) == [
+        ("one", "ok", 1, 1, 0),
+        ("two", "ok", 1, 1, 0),
+    ]
+    manifest = json.load(open(tmp_path / "backup.json"))
+    entry = manifest["projects"]["a0-p1"]
+    assert entry["collaborators"] == [{"id": "carol", "type": "user", "permission": "rw"}]
+    assert [r["id"] for r in entry["revisions"]] == ["a0-p1-r2"]
+    assert (tmp_path / entry["revisions"][0]["filename"]).read_bytes() == b"projects/a0-p1/revisions/a0-p1-r2/archive"
+
+    # Archives with matching checksums are not downloaded again
+    records = user_session.project_backup(str(tmp_path), all_revisions=True, jobs=2)
+    assert sorted((r["name"], r["revisions"], r["downloaded"], r["skipped"]) for r in records) == [("one", 2, 1, 1), ("two", 2, 1, 1)]
+    assert user_session._download.call_count == 4
+
+
+def test_project_backup_reports_errors(user_session, tmp_path):
+    def _fail(endpoint, filename, **kwargs):
+        if "a0-p2" in endpoint:
+            raise RuntimeError("boom")
+        return _download(endpoint, filename)
+
+    user_session._download.side_effect = _fail
+    records = {r["name"]: r for r in user_session.project_backup(str(tmp_path))}
+    assert records["one"]["status"] == "ok"
+    assert records["two"]["status"] == "error: boom"
+    assert "sha256" not in json.load(open(tmp_path / "backup.json"))["projects"]["a0-p2"]["revisions"][0]
+
+
+def test_project_restore(user_session, tmp_path):
+    user_session.project_backup(str(tmp_path))
+    # Only the project owned by the current user conflicts
+    user_session.project_upload = MagicMock(
+        return_value={"id": "a0-new", "editor": "notebook", "resource_profile": "large", "_record_type": "project"}
+    )
+    user_session._patch = MagicMock()
+    user_session.project_collaborator_list_set = MagicMock()
+    records = {r["name"]: r for r in user_session.project_restore(str(tmp_path))}
+    assert records["one"]["status"] == "exists"
+    assert records["two"] == {
+        "name": "two",
+        "owner": "bob",
+        "status": "restored",
+        "revision": "0.2",
+        "id": "a0-new",
+        "source_id": "a0-p2",
+        "_record_type": "restore",
+    }
+    filename = user_session.project_upload.call_args.args[0]
+    assert user_session.project_upload.call_args.args[1:] == ("two", "0.2")
+    assert filename == str(tmp_path / "a0-p2" / "a0-p2-r2.tar.gz")
+    user_session._patch.assert_called_once_with("projects/a0-new", json={"resource_profile": "default"})
+    collabs = user_session.project_collaborator_list_set.call_args.args[1]
+    assert collabs == [{"id": "carol", "type": "user", "permission": "rw"}]
+
+
+def test_project_restore_verifies_checksums(user_session, tmp_path):
+    user_session.project_backup(str(tmp_path), filter=("name=two",))
+    (tmp_path / "a0-p2" / "a0-p2-r2.tar.gz").write_bytes(b"corrupt")
+    user_session.project_upload = MagicMock()
+    records = user_session.project_restore(str(tmp_path), filter=("name=two",))
+    assert records[0]["status"].startswith("error: Archive missing or corrupt")
+    user_session.project_upload.assert_not_called()
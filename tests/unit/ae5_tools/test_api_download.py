@@ -0,0 +1,113 @@
+import hashlib
+import json
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from ae5_tools.api import AEUserSession
+
+
+class FakeResponse:
+    def __init__(self, chunks, status_code=200, headers=None, fail=False):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.fail = fail
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, size):
+        yield from self.chunks
+        if self.fail:
+            raise requests.exceptions.ChunkedEncodingError("connection reset")
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    return AEUserSession(hostname="MOCK-HOSTNAME", username="MOCK-AE-USERNAME", password="MOCK-AE-USER-PASSWORD", persist=False)
+
+
+def _write_part(filename, data, endpoint="archive", validator='"v1"'):
+    with open(filename + ".part", "wb") as fp:
+        fp.write(data)
+    with open(filename + ".part.json", "w") as fp:
+        json.dump({"endpoint": endpoint, "validator": validator}, fp)
+
+
+def test_download_resumes_partial_file(user_session, tmp_path):
+    filename = str(tmp_path / "project.tar.gz")
+    _write_part(filename, b"abc")
+    user_session._api = MagicMock(return_value=FakeResponse([b"def"], status_code=206, headers={"content-length": "3"}))
+    progress = []
+    result = user_session._download("archive", filename, progress=lambda n, t: progress.append((n, t)))
+    assert user_session._api.call_args.kwargs["headers"] == {"Range": "bytes=3-", "If-Range": '"v1"'}
+    assert open(filename, "rb").read() == b"abcdef"
+    assert result == {"filename": filename, "size": 6, "sha256": hashlib.sha256(b"abcdef").hexdigest()}
+    assert progress == [(6, 6)]
+    assert not (tmp_path / "project.tar.gz.part.json").exists()
+
+
+@pytest.mark.parametrize("state", [None, {"endpoint": "archive"}, {"endpoint": "other-revision", "validator": '"v1"'}])
+def test_download_discards_part_without_validator(user_session, tmp_path, state):
+    filename = str(tmp_path / "project.tar.gz")
+    with open(filename + ".part", "wb") as fp:
+        fp.write(b"stale")
+    if state is not None:
+        with open(filename + ".part.json", "w") as fp:
+            json.dump(state, fp)
+    user_session._api = MagicMock(return_value=FakeResponse([b"fresh"], headers={"etag": '"v2"'}))
+    user_session._download("archive", filename)
+    assert user_session._api.call_args.kwargs["headers"] == {}
+    assert open(filename, "rb").read() == b"fresh"
+
+
+def test_download_retries_interrupted_transfer(user_session, tmp_path):
+    filename = str(tmp_path / "project.tar.gz")
+    responses = [
+        FakeResponse([b"ab"], headers={"content-length": "4", "etag": '"v1"'}, fail=True),
+        FakeResponse([b"cd"], status_code=206, headers={"content-length": "2"}),
+    ]
+    user_session._api = MagicMock(side_effect=responses)
+    result = user_session._download("archive", filename)
+    assert user_session._api.call_args.kwargs["headers"] == {"Range": "bytes=2-", "If-Range": '"v1"'}
+    assert open(filename, "rb").read() == b"abcd"
+    assert result["sha256"] == hashlib.sha256(b"abcd").hexdigest()
+
+
+def test_download_keeps_validator_for_later_resume(user_session, tmp_path):
+    filename = str(tmp_path / "project.tar.gz")
+    user_session._api = MagicMock(return_value=FakeResponse([b"ab"], headers={"content-length": "4", "etag": '"v1"'}, fail=True))
+    with pytest.raises(Exception, match="run it again to resume"):
+        user_session._download("archive", filename)
+    assert json.load(open(filename + ".part.json")) == {"endpoint": "archive", "validator": '"v1"'}
+    user_session._api = MagicMock(return_value=FakeResponse([b"cd"], status_code=206, headers={"content-length": "2"}))
+    user_session._download("archive", filename)
+    assert user_session._api.call_args.kwargs["headers"] == {"Range": "bytes=2-", "If-Range": '"v1"'}
+    assert open(filename, "rb").read() == b"abcd"
+
+
+def test_download_restarts_without_validator(user_session, tmp_path):
+    filename = str(tmp_path / "project.tar.gz")
+    responses = [
+        FakeResponse([b"ab"], headers={"content-length": "4"}, fail=True),
+        FakeResponse([b"abcd"], headers={"content-length": "4"}),
+    ]
+    user_session._api = MagicMock(side_effect=responses)
+    user_session._download("archive", filename)
+    assert user_session._api.call_args.kwargs["headers"] == {}
+    assert open(filename, "rb").read() == b"abcd"
+
+
+def test_download_restarts_when_range_ignored(user_session, tmp_path):
+    filename = str(tmp_path / "project.tar.gz")
+    _write_part(filename, b"stale")
+    user_session._api = MagicMock(return_value=FakeResponse([b"fresh"]))
+    result = user_session._download("archive", filename)
+    assert user_session._api.call_args.kwargs["headers"] == {"Range": "bytes=5-", "If-Range": '"v1"'}
+    assert open(filename, "rb").read() == b"fresh"
+    assert result["size"] == 5
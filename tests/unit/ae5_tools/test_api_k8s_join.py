@@ -0,0 +1,184 @@
+import json
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import api
+from ae5_tools.api import AEUserSession
+from ae5_tools.k8s.client import PodWatch
+
+
+class FakeK8SClient:
+    def __init__(self):
+        self.calls = []
+        self.threads = set()
+
+    def pod_info(self, ids):
+        self.calls.append(list(ids))
+        self.threads.add(threading.get_ident())
+        return [
+            (
+                None
+                if id.endswith("x")
+                else {"phase": "Running", "since": "", "restarts": 0, "usage": {"mem": "1", "cpu": "1", "gpu": "0"}, "node": "n1"}
+            )
+            for id in ids
+        ]
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    user_session = AEUserSession(hostname="MOCK-HOSTNAME", username="MOCK-AE-USERNAME", password="MOCK-AE-USER-PASSWORD", persist=False)
+    user_session._k8s_client = FakeK8SClient()
+    return user_session
+
+
+def test_join_k8s_chunks(user_session, monkeypatch):
+    monkeypatch.setattr(api, "K8S_JSON_LIST_MAX", 3)
+    records = [{"id": f"a2-{k}", "_record_type": "deployment"} for k in range(10)] + [{"id": "a2-x", "_record_type": "deployment"}]
+    result = user_session._join_k8s(records)
+    client = user_session._k8s_client
+    assert sorted(len(c) for c in client.calls) == [2, 3, 3, 3]
+    assert [r["id"] for r in result] == [f"a2-{k}" for k in range(10)]
+    assert all(r["phase"] == "Running" and r["node"] == "n1" for r in result)
+
+
+def test_join_k8s_skips_podless_states(user_session):
+    states = ["running", "completed", "failed", "error"]
+    records = [{"id": f"a1-{k}", "_record_type": "run", "state": state} for k, state in enumerate(states)]
+    result = user_session._join_k8s(records, changes=True)
+    assert user_session._k8s_client.calls == [["a1-0"]]
+    assert [r["id"] for r in result] == ["a1-0", "a1-1", "a1-2", "a1-3"]
+    assert result[0]["phase"] == "Running"
+    assert all(r["phase"] is None and r["_k8s"] is None and r["modified"] == "n/a" for r in result[1:])
+
+
+def test_join_k8s_all_podless(user_session):
+    records = [{"id": "a2-0", "_record_type": "deployment", "state": "stopped"}]
+    result = user_session._join_k8s(records)
+    assert user_session._k8s_client.calls == []
+    assert result[0]["node"] is None
+
+
+def test_post_pod_drops_podless(user_session):
+    records = [
+        {"id": "a2-0", "_record_type": "pod", "type": "deployment", "state": "started"},
+        {"id": "a2-1", "_record_type": "pod", "type": "deployment", "state": "initial"},
+        {"id": "a1-0", "_record_type": "pod", "type": "run", "state": "completed"},
+    ]
+    result = user_session._post_pod(records)
+    assert user_session._k8s_client.calls == [["a2-0"]]
+    assert [r["id"] for r in result] == ["a2-0"]
+
+
+def test_join_k8s_progress(user_session, monkeypatch):
+    monkeypatch.setattr(api, "K8S_JSON_LIST_MAX", 2)
+    snapshots = []
+    user_session._k8s_progress = snapshots.append
+    records = [{"id": f"a2-{k}", "_record_type": "deployment", "state": "started"} for k in range(3)] + [
+        {"id": "a2-x", "_record_type": "deployment", "state": "started"}
+    ]
+    result = user_session._join_k8s(records)
+    assert len(snapshots) == 3
+    # The first snapshot has every record, with empty k8s columns
+    assert [r["id"] for r in snapshots[0]] == ["a2-0", "a2-1", "a2-2", "a2-x"]
+    assert all(r["phase"] is None for r in snapshots[0])
+    assert [r["id"] for r in snapshots[-1]] == [r["id"] for r in result] == ["a2-0", "a2-1", "a2-2"]
+    assert all(r["phase"] == "Running" for r in snapshots[-1])
+
+
+def test_pod_logs_skips_podless_records(user_session):
+    records = [
+        {"id": "a2-0", "project_id": "a0-0", "_record_type": "deployment", "state": "started"},
+        {"id": "a2-1", "project_id": "a0-1", "_record_type": "deployment", "state": "stopped"},
+        {"id": "a1-2", "project_id": "a0-2", "_record_type": "run", "state": "completed"},
+    ]
+    user_session.session_list = MagicMock(return_value=[])
+    user_session.deployment_list = MagicMock(return_value=records[:2])
+    user_session.run_list = MagicMock(return_value=records[2:])
+    user_session._k8s = MagicMock()
+    user_session.pod_logs(filter=("name=*",))
+    user_session._k8s.assert_called_once_with("pod_logs", ["a2-0"], container=None, follow=False, since=None, tail=None, stream=None)
+    user_session.deployment_list.return_value = records[1:2]
+    user_session.run_list.return_value = []
+    with pytest.raises(api.AEException, match="No pods"):
+        user_session.pod_logs()
+
+
+class EventResponse:
+    def __init__(self, events):
+        self.lines = [line for e in events for line in ("data: " + json.dumps(e), "")]
+        self.closed = False
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        return iter(self.lines)
+
+    def close(self):
+        self.closed = True
+
+
+def _pod(phase, ready):
+    return {"phase": phase, "containers": {"app": {"ready": ready}}}
+
+
+def _start_deployment(user_session, monkeypatch, k8s):
+    sleeps = []
+    monkeypatch.setattr(api.time, "sleep", sleeps.append)
+    user_session._revision = MagicMock(
+        return_value={"project_id": "a0-0", "_project": {"resource_profile": "default"}, "url": "u", "name": "1", "commands": "app"}
+    )
+    user_session._post_record = MagicMock(return_value={"id": "a2-0", "state": "initial"})
+    user_session._get_records = MagicMock(side_effect=[{"id": "a2-0", "state": "starting"}, {"id": "a2-0", "state": "started"}])
+    user_session._k8s = k8s
+    assert user_session.deployment_start("proj")["state"] == "started"
+    return sleeps
+
+
+def test_deployment_start_waits_for_pod_events(user_session, monkeypatch):
+    response = EventResponse(
+        [{"type": "ADDED", "id": "a2-0", "pod": _pod("Pending", False)}, {"type": "MODIFIED", "id": "a2-0", "pod": _pod("Running", True)}]
+    )
+    k8s = MagicMock(return_value=PodWatch(response))
+    sleeps = _start_deployment(user_session, monkeypatch, k8s)
+    k8s.assert_called_once_with("watch_pods", ["a2-0"])
+    # The state is checked as soon as the pod is ready, and polled only while AE5 catches up
+    assert sleeps == [2]
+    assert response.closed
+
+
+def test_deployment_start_polls_without_k8s(user_session, monkeypatch):
+    sleeps = _start_deployment(user_session, monkeypatch, MagicMock(side_effect=api.AEException("No k8s connection available")))
+    assert sleeps == [2, 2]
+
+
+class HangingWatch:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        # No pod events arrive until the watch is closed
+        self.closed.wait(5)
+        return iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.closed.set()
+
+
+def test_watch_ends_when_start_fails_without_pod(user_session, monkeypatch):
+    monkeypatch.setattr(api, "K8S_WATCH_CHECK_INTERVAL", 0.01)
+    watch = HangingWatch()
+    user_session._k8s = MagicMock(return_value=watch)
+    finished = MagicMock(side_effect=[False, True])
+    assert user_session._watch_until_ready("a2-0", finished) is True
+    assert watch.closed.is_set() and finished.call_count == 2
+    # Past K8S_WATCH_WAIT, the caller falls back to polling
+    monkeypatch.setattr(api, "K8S_WATCH_WAIT", 0.01)
+    user_session._k8s = MagicMock(return_value=HangingWatch())
+    assert user_session._watch_until_ready("a2-0", lambda: False) is False
@@ -0,0 +1,74 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools.api import AEException, AEUserSession
+from ae5_tools.waiter import ActionWaiter
+
+PROJECTS = [
+    {"id": f"a0-{n}", "name": f"workshop-{n}", "owner": "alice", "editor": "jupyterlab", "resource_profile": "default", "_record_type": "project"}
+    for n in range(3)
+]
+
+
+def _action(id, done=False, error=False, message=""):
+    return {"id": id, "done": done, "error": error, "message": message}
+
+
+@pytest.fixture(scope="function")
+def user_session():
+    session = AEUserSession(hostname="MOCK-HOSTNAME", username="alice", password="MOCK-AE-USER-PASSWORD", persist=False)
+    session.authorize = MagicMock()
+    session._waiter = ActionWaiter(session, initial=0)
+    return session
+
+
+def test_session_start_many(user_session):
+    user_session._get_records = MagicMock(return_value=[dict(p) for p in PROJECTS])
+    user_session._patch = MagicMock()
+    user_session._post_record = MagicMock(
+        side_effect=lambda endpoint: {"id": "a1-" + endpoint.split("/")[1][3:], "project_id": endpoint.split("/")[1], "action": _action("start")}
+    )
+    user_session._get = MagicMock(
+        side_effect=lambda endpoint, params=None: {"data": [_action("start", done=True, error="a0-2" in endpoint, message="no capacity")]}
+    )
+    idents = ["alice/workshop-0", "workshop-2", "workshop-0", "missing"]
+    records = user_session.session_start_many(idents, resource_profile="large", jobs=2)
+    user_session._get_records.assert_called_once_with("projects", None)
+    assert [(r["name"], r["status"], r["id"]) for r in records[:2]] == [
+        ("workshop-0", "started", "a1-0"),
+        ("workshop-2", "error: no capacity", "a1-2"),
+    ]
+    assert records[0]["ready"] is not None
+    assert records[2]["name"] == "missing"
+    assert records[2]["status"].startswith("error: No projects found")
+    assert user_session._post_record.call_count == 2
+    assert user_session._patch.call_count == 2
+
+
+def test_session_start_many_requires_selection(user_session):
+    with pytest.raises(AEException, match="must be selected"):
+        user_session.session_start_many()
+
+
+def test_session_stop_many(user_session):
+    sessions = [{"id": f"a1-{n}", "name": f"workshop-{n}", "owner": "alice", "project_id": f"a0-{n}", "_record_type": "session"} for n in range(3)]
+    user_session._get_records = MagicMock(return_value=sessions)
+    user_session._delete = MagicMock(side_effect=[None, RuntimeError("busy"), None])
+    records = user_session.session_stop_many(filter=("name=workshop-*",), jobs=1)
+    user_session._get_records.assert_called_once_with("sessions", ("name=workshop-*",))
+    assert [(r["id"], r["status"]) for r in records] == [("a1-0", "stopped"), ("a1-1", "error: busy"), ("a1-2", "stopped")]
+
+
+def test_session_and_run_lists_use_record_hooks(user_session):
+    # Only the HTTP layer is mocked, so the _pre_* and _post_* hooks run
+    responses = {
+        "projects": [{"id": "a0-0", "name": "workshop-0", "owner": "alice"}],
+        "sessions": [{"id": "a1-0", "name": "0", "owner": "alice", "project_url": "https://host/projects/0"}],
+        "runs": [{"id": "a2-0", "name": "run", "owner": "alice", "project_url": "https://host/projects/0"}],
+    }
+    user_session._api = MagicMock(side_effect=lambda method, endpoint, **kwargs: [dict(r) for r in responses[endpoint]])
+    sessions = user_session.session_list()
+    assert [(s["name"], s["session_name"], s["project_id"]) for s in sessions] == [("workshop-0", "0", "a0-0")]
+    runs = user_session.run_list()
+    assert [(r["name"], r["project_id"]) for r in runs] == [("run", "a0-0")]
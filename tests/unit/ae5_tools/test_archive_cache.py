@@ -0,0 +1,106 @@
+import hashlib
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import archive_cache
+from ae5_tools.api import AEUserSession
+from ae5_tools.archive_cache import ArchiveCache
+
+
+def _write(path, data):
+    with open(path, "wb") as fp:
+        fp.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_archive_cache_get_put(tmp_path):
+    cache = ArchiveCache(str(tmp_path / "cache"), max_size=1000)
+    source = str(tmp_path / "a.tar.gz")
+    sha256 = _write(source, b"archive")
+    assert cache.get("host", "p1", "r1", str(tmp_path / "out.tar.gz")) is None
+    cache.put("host", "p1", "r1", source, sha256)
+    result = cache.get("host", "p1", "r1", str(tmp_path / "out.tar.gz"))
+    assert result == {"filename": str(tmp_path / "out.tar.gz"), "size": 7, "sha256": sha256}
+    assert open(tmp_path / "out.tar.gz", "rb").read() == b"archive"
+    assert cache.get("other", "p1", "r1", str(tmp_path / "out2.tar.gz")) is None
+
+
+def test_archive_cache_copies_files(tmp_path):
+    cache = ArchiveCache(str(tmp_path / "cache"), max_size=1000)
+    source = str(tmp_path / "a.tar.gz")
+    sha256 = _write(source, b"archive")
+    mode = os.stat(source).st_mode
+    cache.put("host", "p1", "r1", source, sha256)
+    # The caller's file is left writable, and changing it leaves the cache intact
+    assert os.stat(source).st_mode == mode
+    _write(source, b"changed")
+    out = str(tmp_path / "out.tar.gz")
+    cache.get("host", "p1", "r1", out)
+    assert open(out, "rb").read() == b"archive"
+    _write(out, b"changed")
+    assert open(cache._blob(sha256), "rb").read() == b"archive"
+
+
+def test_archive_cache_copies_outside_lock(tmp_path, monkeypatch):
+    cache = ArchiveCache(str(tmp_path / "cache"), max_size=1000)
+    source = str(tmp_path / "a.tar.gz")
+    sha256 = _write(source, b"archive")
+    copyfile = archive_cache.shutil.copyfile
+
+    def unlocked_copyfile(src, dst):
+        assert not archive_cache._LOCK.locked()
+        return copyfile(src, dst)
+
+    monkeypatch.setattr(archive_cache.shutil, "copyfile", unlocked_copyfile)
+    cache.put("host", "p1", "r1", source, sha256)
+    assert cache.get("host", "p1", "r1", str(tmp_path / "out.tar.gz"))
+    # An archive removed between the lookup and the copy is a miss
+    os.unlink(cache._blob(sha256))
+    assert cache.get("host", "p1", "r1", str(tmp_path / "out2.tar.gz")) is None
+
+
+def test_archive_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = ArchiveCache(str(tmp_path / "cache"), max_size=25)
+    clock = iter(range(100))
+    monkeypatch.setattr(archive_cache.time, "time", lambda: next(clock))
+    for rev in ("r1", "r2"):
+        source = str(tmp_path / f"{rev}.tar.gz")
+        cache.put("host", "p1", rev, source, _write(source, rev.encode() * 5))
+    # Using r1 makes r2 the least recently used
+    assert cache.get("host", "p1", "r1", str(tmp_path / "out.tar.gz"))
+    source = str(tmp_path / "r3.tar.gz")
+    cache.put("host", "p1", "r3", source, _write(source, b"r3" * 5))
+    assert cache.get("host", "p1", "r2", str(tmp_path / "out.tar.gz")) is None
+    assert cache.get("host", "p1", "r1", str(tmp_path / "out.tar.gz"))
+    assert len(os.listdir(tmp_path / "cache" / "blobs")) == 2
+
+
+def test_project_download_uses_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive_cache.config, "_path", str(tmp_path / "config"))
+    session = AEUserSession(hostname="MOCK-HOSTNAME", username="MOCK-AE-USERNAME", password="MOCK-AE-USER-PASSWORD", persist=False)
+    rrec = {"id": "rev-id", "name": "latest", "_project": {"id": "proj-id", "name": "proj"}}
+    session._revision = MagicMock(return_value=rrec)
+    sha256 = hashlib.sha256(b"archive").hexdigest()
+
+    def download(endpoint, filename, progress=None, resume=True):
+        _write(filename, b"archive")
+        return {"filename": filename, "size": 7, "sha256": sha256}
+
+    session._download = MagicMock(side_effect=download)
+    assert session.project_download("proj", filename=str(tmp_path / "one.tar.gz")) is None
+    assert session._download.call_args.args[0] == "projects/proj-id/revisions/rev-id/archive"
+    first = session.project_download("proj", filename=str(tmp_path / "one.tar.gz"), details=True)
+    second = session.project_download("proj", filename=str(tmp_path / "two.tar.gz"), details=True)
+    assert session._download.call_count == 1
+    assert second == dict(first, filename=str(tmp_path / "two.tar.gz"))
+    assert open(tmp_path / "two.tar.gz", "rb").read() == b"archive"
+    # A new latest revision is downloaded again
+    rrec["id"] = "rev-id-2"
+    session.project_download("proj", filename=str(tmp_path / "three.tar.gz"))
+    assert session._download.call_count == 2
+    # Without a filename, the constructed one is returned
+    monkeypatch.chdir(tmp_path)
+    assert session.project_download("proj") == "proj.tar.gz"
+    assert session._download.call_count == 2
@@ -0,0 +1,106 @@
+import gzip
+import io
+import os
+import subprocess
+import tarfile
+import zlib
+
+import pytest
+
+from ae5_tools import archiver
+from ae5_tools.archiver import ParallelGzipWriter, create_tar_archive, scan_project
+
+
+def test_parallel_gzip_writer_single_member():
+    data = os.urandom(1000) * 50
+    out = io.BytesIO()
+    writer = ParallelGzipWriter(out, level=6, workers=4, block_size=4096)
+    for k in range(0, len(data), 1000):
+        writer.write(data[k : k + 1000])
+    writer.close()
+    assert gzip.decompress(out.getvalue()) == data
+    # The blocks form one gzip member, which a single decompressor consumes entirely
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(out.getvalue()) == data
+    assert decompressor.eof and decompressor.unused_data == b""
+
+
+def test_parallel_gzip_writer_set_level():
+    out = io.BytesIO()
+    writer = ParallelGzipWriter(out, level=9, workers=1)
+    writer.write(b"a" * 10000)
+    writer.set_level(0)
+    writer.write(b"b" * 10000)
+    writer.close()
+    assert gzip.decompress(out.getvalue()) == b"a" * 10000 + b"b" * 10000
+    # The second block is stored, so the output is larger than its input
+    assert len(out.getvalue()) > 10000
+
+
+@pytest.mark.parametrize("compression", ["gzip", "parallel", "fast"])
+def test_create_tar_archive(tmp_path, monkeypatch, compression):
+    monkeypatch.setattr(archiver, "ARCHIVE_BLOCK_SIZE", 4096)
+    (tmp_path / "anaconda-project.yml").write_text("name: test\n")
+    (tmp_path / "data.csv").write_text("x,y\n" * 10000)
+    (tmp_path / "data.zip").write_bytes(os.urandom(20000))
+    out = io.BytesIO()
+    create_tar_archive(str(tmp_path), "project", out, compression=compression)
+    out.seek(0)
+    with tarfile.open(fileobj=out, mode="r:gz") as tf:
+        assert sorted(tf.getnames()) == ["project/anaconda-project.yml", "project/data.csv", "project/data.zip"]
+        assert tf.extractfile("project/data.csv").read() == b"x,y\n" * 10000
+    # Streaming readers, such as tarfile's "r|gz" mode, accept only a single gzip member
+    out.seek(0)
+    with tarfile.open(fileobj=out, mode="r|gz") as tf:
+        contents = {member.name: tf.extractfile(member).read() for member in tf}
+    assert contents["project/data.csv"] == b"x,y\n" * 10000
+    assert len(contents["project/data.zip"]) == 20000
+
+
+def test_create_tar_archive_stops_workers_on_error(tmp_path, monkeypatch):
+    (tmp_path / "anaconda-project.yml").write_text("name: test\n")
+    writers = []
+
+    class Writer(ParallelGzipWriter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, workers=2, **kwargs)
+            writers.append(self)
+
+    def fail(project_directory):
+        raise OSError("unreadable")
+        yield
+
+    monkeypatch.setattr(archiver, "ParallelGzipWriter", Writer)
+    monkeypatch.setattr(archiver, "scan_project", fail)
+    with pytest.raises(OSError, match="unreadable"):
+        create_tar_archive(str(tmp_path), "project", io.BytesIO(), compression="parallel")
+    assert writers[0]._executor is None
+
+
+def _make_tree(root, paths):
+    for path in paths:
+        full = root / path
+        full.parent.mkdir(parents=True, exist_ok=True)
+        full.write_text(path)
+
+
+def test_scan_project_projectignore(tmp_path):
+    _make_tree(
+        tmp_path,
+        ["anaconda-project.yml", "a.py", "a.pyc", "data/x.csv", "sub/data/y.csv", "sub/keep.txt", "build/out.txt", "sub/build/out.txt", "logs/z.log"],
+    )
+    (tmp_path / ".projectignore").write_text("# comment\n*.pyc\n/data\nbuild/\nlogs/*.log\n")
+    result = {pfile.relpath: pfile for pfile in scan_project(str(tmp_path))}
+    assert sorted(result) == [".projectignore", "a.py", "anaconda-project.yml", "sub/data/y.csv", "sub/keep.txt"]
+    pfile = result["sub/keep.txt"]
+    assert pfile.abspath == str(tmp_path / "sub" / "keep.txt")
+    assert pfile.size == len("sub/keep.txt")
+    assert pfile.mtime == os.stat(pfile.abspath).st_mtime
+
+
+def test_scan_project_git_ignored(tmp_path):
+    _make_tree(tmp_path, ["anaconda-project.yml", "a+b.txt", "a.txt", "cache/big.bin", "src/main.py"])
+    (tmp_path / ".gitignore").write_text("a+b.txt\ncache/\n")
+    subprocess.check_call(["git", "init", "-q"], cwd=tmp_path)
+    result = sorted(pfile.relpath for pfile in scan_project(str(tmp_path)))
+    assert result == [".gitignore", "a.txt", "anaconda-project.yml", "src/main.py"]
@@ -0,0 +1,60 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import manifest
+from ae5_tools.api import AEUserSession
+from ae5_tools.manifest import UploadManifest, diff_files, hash_project
+
+
+@pytest.fixture(scope="function")
+def project_dir(tmp_path):
+    project = tmp_path / "proj"
+    project.mkdir()
+    (project / "anaconda-project.yml").write_text("name: proj\n")
+    (project / "notebook.ipynb").write_text("{}")
+    return project
+
+
+@pytest.fixture(scope="function")
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest.config, "_path", str(tmp_path / "config"))
+
+
+def test_hash_project_reuses_unchanged(project_dir, monkeypatch):
+    files = hash_project(str(project_dir))
+    assert sorted(files) == ["anaconda-project.yml", "notebook.ipynb"]
+    hashed = []
+    monkeypatch.setattr(manifest, "sha256_file", lambda path: hashed.append(path) or "new")
+    (project_dir / "notebook.ipynb").write_text('{"cells": []}')
+    (project_dir / "extra.py").write_text("")
+    files2 = hash_project(str(project_dir), files)
+    assert sorted(hashed) == [str(project_dir / "extra.py"), str(project_dir / "notebook.ipynb")]
+    assert diff_files(files, files2) == {"added": ["extra.py"], "modified": ["notebook.ipynb"], "removed": []}
+
+
+def test_manifest_roundtrip(project_dir, config_dir):
+    UploadManifest("host", "user").set(str(project_dir), "proj", "a0-1", "r1", {"a": [1, 2.5, "x"]})
+    entry = UploadManifest("host", "user").get(str(project_dir), "proj")
+    assert entry == {"project_id": "a0-1", "revision": "r1", "files": {"a": [1, 2.5, "x"]}}
+    assert UploadManifest("host", "user").get(str(project_dir), "other") is None
+
+
+def test_project_upload_skips_unchanged(project_dir, config_dir):
+    session = AEUserSession(hostname="host", username="user", password="pw", persist=False)
+    session.authorize = MagicMock()
+    UploadManifest("host", "user").set(str(project_dir), "proj", "a0-1", "r1", hash_project(str(project_dir)))
+    session._revision = MagicMock(return_value={"id": "r1", "_project": {"id": "a0-1", "name": "proj", "_record_type": "project"}})
+    session._post_record = MagicMock()
+    record = session.project_upload(str(project_dir), "proj", None)
+    session._post_record.assert_not_called()
+    assert record["id"] == "a0-1"
+    assert record["upload"] == "skipped"
+    assert record["changes"] == ""
+
+    # A new revision made elsewhere means the directory is uploaded again
+    session._revision.return_value = {"id": "r2", "_project": {"id": "a0-1"}}
+    session._post_record.return_value = {"error": {"message": "stop here"}}
+    with pytest.raises(RuntimeError, match="stop here"):
+        session.project_upload(str(project_dir), "proj", None)
+    session._post_record.assert_called_once()
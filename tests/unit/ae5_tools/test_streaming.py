@@ -0,0 +1,85 @@
+import io
+import os
+import tarfile
+from email.parser import BytesParser
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from ae5_tools import streaming
+from ae5_tools.api import AEException, AEUserSession
+from ae5_tools.archiver import iter_tar_archive
+from ae5_tools.streaming import MultipartEncoder
+
+
+def _parse(body, content_type):
+    # Use the email parser as an independent multipart decoder
+    message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True) for part in message.get_payload()}
+
+
+def test_multipart_encoder_with_file(monkeypatch):
+    monkeypatch.setattr(streaming, "UPLOAD_CHUNK_SIZE", 4)
+    progress = []
+    body = MultipartEncoder(
+        {"name": "proj"}, {"project_file": ("p.tar.gz", io.BytesIO(b"0123456789"))}, progress=lambda n, t: progress.append((n, t))
+    )
+    data = b""
+    while True:
+        chunk = body.read(7)
+        if not chunk:
+            break
+        data += chunk
+    assert len(data) == body.len
+    assert progress[-1] == (body.len, body.len)
+    assert _parse(data, body.content_type) == {"name": b"proj", "project_file": b"0123456789"}
+
+
+def test_multipart_encoder_with_generator():
+    body = MultipartEncoder({}, {"project_file": ("p.tar.gz", iter([b"abc", b"", b"def"]))})
+    assert not hasattr(body, "len")
+    prepared = requests.Request("POST", "http://localhost/", data=body).prepare()
+    assert prepared.headers.get("Transfer-Encoding") == "chunked"
+    assert _parse(b"".join(body), body.content_type) == {"project_file": b"abcdef"}
+
+
+def test_iter_tar_archive(tmp_path):
+    (tmp_path / "anaconda-project.yml").write_text("name: test\n")
+    (tmp_path / "data.bin").write_bytes(bytes(range(256)) * 1000)
+    data = b"".join(iter_tar_archive(str(tmp_path), "project", chunk_size=1024))
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tf:
+        assert sorted(tf.getnames()) == ["project/anaconda-project.yml", "project/data.bin"]
+        assert tf.extractfile("project/data.bin").read() == bytes(range(256)) * 1000
+
+
+def test_iter_tar_archive_stops_early(tmp_path):
+    (tmp_path / "anaconda-project.yml").write_text("name: test\n")
+    (tmp_path / "data.bin").write_bytes(os.urandom(1 << 20))
+    chunks = iter_tar_archive(str(tmp_path), "project", chunk_size=1024)
+    next(chunks)
+    # Closing the generator must not leave the archiving thread blocked
+    chunks.close()
+
+
+def test_streamed_body_is_not_resent_after_login():
+    session = AEUserSession(hostname="MOCK-HOSTNAME", username="MOCK-AE-USERNAME", password="MOCK-AE-USER-PASSWORD", persist=False)
+    session.connected = True
+    session.authorize = MagicMock()
+    session.disconnect = MagicMock()
+    response = requests.Response()
+    response.status_code = 401
+    session.session.post = MagicMock(return_value=response)
+    body = MultipartEncoder({"name": "project"}, {"project_file": ("project.tar.gz", iter([b"data"]))})
+    with pytest.raises(AEException, match="cannot be repeated"):
+        session._api("post", "projects/upload", data=body)
+    session.authorize.assert_not_called()
+    assert session.session.post.call_count == 1
+    assert not session.connected
+    session.connected = True
+    # A body that can be sent again is retried after logging in
+    ok = requests.Response()
+    ok.status_code, ok._content = 200, b""
+    session.session.post = MagicMock(side_effect=[response, ok])
+    assert session._api("post", "projects/upload", json={"name": "project"}) is None
+    session.authorize.assert_called_once()
@@ -0,0 +1,149 @@
+from concurrent.futures import Future
+from unittest.mock import MagicMock
+
+import pytest
+
+from ae5_tools import manifest
+from ae5_tools import waiter as waiter_module
+from ae5_tools.api import AEException, AEUserSession
+from ae5_tools.waiter import ActionWaiter
+
+
+def _action(id, done=False, error=False, message=""):
+    return {"id": id, "done": done, "error": error, "message": message}
+
+
+@pytest.fixture(scope="function")
+def user_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest.config, "_path", str(tmp_path / "config"))
+    session = AEUserSession(hostname="host", username="user", password="pw", persist=False)
+    session.authorize = MagicMock()
+    return session
+
+
+def test_waiter_polls_each_project_once(user_session):
+    polls = []
+    activity = {"p1": [_action("a1"), _action("a2", done=True)], "p2": [_action("a3", error=True, message="failed")]}
+
+    def _get(endpoint, params=None):
+        project_id = endpoint.split("/")[1]
+        polls.append(project_id)
+        data, activity[project_id] = activity[project_id], [_action(a["id"], done=True) for a in activity[project_id]]
+        return {"data": data}
+
+    user_session._get = MagicMock(side_effect=_get)
+    waiter = ActionWaiter(user_session, initial=0)
+    futures = [waiter.add({"id": pid, "action": _action(aid)}) for pid, aid in (("p1", "a1"), ("p1", "a2"), ("p2", "a3"))]
+    done = waiter.add({"id": "p3", "action": _action("a4", done=True)})
+    results = [f.result(timeout=5)["action"] for f in futures]
+    assert [(a["done"], a["error"]) for a in results] == [(True, False), (True, False), (False, True)]
+    assert done.result()["action"]["id"] == "a4"
+    assert sorted(polls) == ["p1", "p1", "p2"]
+
+
+def test_waiter_backs_off_and_times_out(user_session, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(waiter_module.time, "monotonic", lambda: clock[0])
+    user_session._get = MagicMock(return_value={"data": [_action("a1")]})
+    waiter = ActionWaiter(user_session, initial=1, backoff=2, max_interval=5, timeout=60)
+    waiter._projects["p1"] = project = waiter_module._PendingProject(1, 0)
+    project.actions["a1"] = (Future(), {"id": "p1", "action": _action("a1")}, 60)
+    intervals = []
+    for _ in range(5):
+        waiter._update("p1", ["a1"], waiter._poll(("p1", ["a1"], project.page_size)), None)
+        intervals.append(project.interval)
+    assert intervals == [2, 4, 5, 5, 5]
+    assert project.page_size == waiter_module.WAITER_PAGE_SIZE
+    clock[0] = 61
+    future = project.actions["a1"][0]
+    waiter._expire()
+    with pytest.raises(AEException, match="Timed out"):
+        future.result()
+    assert not waiter._projects
+
+
+def test_waiter_looks_up_missing_actions_in_larger_pages(user_session):
+    user_session._get = MagicMock(return_value={"data": []})
+    waiter = ActionWaiter(user_session)
+    waiter._projects["p1"] = project = waiter_module._PendingProject(1, 0)
+    project.actions["a1"] = (Future(), {"id": "p1", "action": _action("a1")}, None)
+    for _ in range(2):
+        waiter._update("p1", ["a1"], waiter._poll(("p1", ["a1"], project.page_size)), None)
+    assert [c.kwargs["params"]["page[size]"] for c in user_session._get.call_args_list] == [10, 20]
+
+
+def test_waiter_retries_failed_polls(user_session, monkeypatch):
+    monkeypatch.setattr(waiter_module, "WAITER_POLL_RETRIES", 2)
+    user_session._get = MagicMock(side_effect=[RuntimeError("502"), RuntimeError("502"), {"data": [_action("a1", done=True)]}])
+    waiter = ActionWaiter(user_session, initial=0)
+    future = waiter.add({"id": "p1", "action": _action("a1")})
+    assert future.result(timeout=5)["action"]["done"]
+    assert user_session._get.call_count == 3
+
+
+def test_waiter_fails_actions_added_during_failed_poll(user_session, monkeypatch):
+    monkeypatch.setattr(waiter_module, "WAITER_POLL_RETRIES", 0)
+    waiter = ActionWaiter(user_session)
+    waiter._projects["p1"] = project = waiter_module._PendingProject(1, 0)
+    first, second = Future(), Future()
+    project.actions["a1"] = (first, {"id": "p1", "action": _action("a1")}, None)
+    # a2 was added while the poll for a1 was running
+    project.actions["a2"] = (second, {"id": "p1", "action": _action("a2")}, None)
+    waiter._update("p1", ["a1"], None, RuntimeError("502"))
+    for future in (first, second):
+        with pytest.raises(RuntimeError, match="502"):
+            future.result()
+    assert not waiter._projects
+
+
+def test_waiter_thread_error_fails_pending_actions(user_session, monkeypatch):
+    waiter = ActionWaiter(user_session, initial=0)
+    monkeypatch.setattr(waiter, "_expire", MagicMock(side_effect=[TypeError("bug"), None, None]))
+    monkeypatch.setattr(waiter_module.threading, "excepthook", lambda args: None)
+    with pytest.raises(AEException, match="Stopped waiting"):
+        waiter.add({"id": "p1", "action": _action("a1")}).result(timeout=5)
+    assert waiter._thread is None
+    # A later action starts a new thread
+    user_session._get = MagicMock(return_value={"data": [_action("a2", done=True)]})
+    assert waiter.add({"id": "p1", "action": _action("a2")}).result(timeout=5)["action"]["done"]
+
+
+def test_project_upload_many(user_session, tmp_path):
+    paths = []
+    for name in ("one", "two", "bad"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "anaconda-project.yml").write_text(f"name: {name}\n")
+        paths.append(str(tmp_path / name))
+
+    def _post_record(endpoint, record_type=None, api_kwargs=None):
+        body = api_kwargs["data"].read()
+        name = "bad" if b"bad" in body else "one" if b"one" in body else "two"
+        return {"id": f"a0-{name}", "action": _action(f"act-{name}")}
+
+    user_session._post_record = MagicMock(side_effect=_post_record)
+    user_session._get = MagicMock(
+        side_effect=lambda endpoint, params=None: {
+            "data": [_action(f"act-{n}", done=n != "bad", error=n == "bad", message="invalid project") for n in ("one", "two", "bad")]
+        }
+    )
+    projects = [{"id": "a0-one", "name": "one", "_record_type": "project"}, {"id": "a0-two", "name": "two", "_record_type": "project"}]
+    user_session._get_records = MagicMock(return_value=projects)
+    precs = {p["id"]: p for p in projects}
+
+    def _revision(ident, **kwargs):
+        prec = ident if isinstance(ident, dict) else precs[ident]
+        return {"id": "r-" + prec["id"], "_project": prec}
+
+    user_session._revision = MagicMock(side_effect=_revision)
+    records = user_session.project_upload_many(paths, jobs=2)
+    assert [(r["name"], r["status"], r["id"]) for r in records] == [
+        ("one", "uploaded", "a0-one"),
+        ("two", "uploaded", "a0-two"),
+        ("bad", "error: invalid project", None),
+    ]
+    user_session._get_records.assert_called_once_with("projects")
+
+    # Unchanged directories are skipped the next time
+    records = user_session.project_upload_many(paths[:2])
+    assert [r["status"] for r in records] == ["skipped", "skipped"]
+    assert user_session._post_record.call_count == 3